@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducible benchmark suite of the teleconnection entry points:
+
+    get_teleconnection_via_numpy ('dask', 'tiled' and 'streaming' engines)
+
+    get_teleconnection_pyramid, get_teleconnection_approximate,
+    get_teleconnection_eof and get_teleconnection_partners (top-k)
+
+    get_correlation_for_each_pixel ('all_pairs' and 'per_pixel' modes)
+
+Each case runs over a synthetic field with planted dipoles (see
+utils.planted_dipole_dataset), so that the suite runs offline and its
+correctness is checked against the planted answer. Each case runs in a
+fresh (spawned) process, so that its peak resident memory is its own.
+
+Usage (from this directory):
+
+    python benchmark_suite.py --output results.json [--quick]
+
+    python benchmark_suite.py --output results.json --baseline baseline.json
+
+A stored results file is a baseline for a later run: the cases are matched
+by their case_id, and the run fails (exit code 1) if any case is slower,
+uses more memory (beyond the tolerances) or is less correct than in the
+baseline.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import platform
+import sys
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError: # i.e.: Windows
+    resource = None
+
+
+GRIDS = [(16, 32), (32, 64), (64, 128)]
+
+TIME_LENGTHS = [60, 240]
+
+# None: in-memory numpy; otherwise the number of latitudes per dask chunk
+CHUNKINGS = [None, 8]
+
+DTYPES = ['float64', 'float32']
+
+ENGINES = ['numpy:dask', 'numpy:tiled', 'numpy:streaming',
+           'numpy:pyramid', 'numpy:approximate', 'numpy:eof', 'numpy:topk',
+           'pathways:all_pairs', 'pathways:per_pixel']
+
+# the approximate engines: their recall is reported (and compared with the
+# baseline), but it is not required to be 1 (i.e.: the pyramid and the EOFs
+# miss the single-cell dipoles of the larger grids)
+APPROXIMATE_ENGINES = ['numpy:pyramid', 'numpy:approximate', 'numpy:eof']
+
+# the engines that always evaluate in float64 (the ranks), whatever the dtype
+# of the field: only their float64 rows are run
+ENGINE_DTYPES = {'pathways:all_pairs':['float64'],
+                 'pathways:per_pixel':['float64']}
+
+# the engines that scale poorly are only run on the small grids
+ENGINE_MAX_LOCATIONS = {'numpy:dask':4096,
+                        'pathways:all_pairs':2048,
+                        'pathways:per_pixel':512}
+
+
+def benchmark_cases(grids=GRIDS, time_lengths=TIME_LENGTHS, chunkings=CHUNKINGS,
+                    dtypes=DTYPES, engines=ENGINES, n_dipoles=4, seed=0, repeat=3):
+
+    '''
+    Function description:
+
+        The cases of the suite: every combination of grid, time length,
+        chunking, dtype and engine (except the engines beyond their
+        ENGINE_MAX_LOCATIONS, and the dtypes outside their ENGINE_DTYPES).
+        Each case is run "repeat" times, and its best wall time is kept.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        list of dicts (one per case), with a unique 'case_id'
+
+    '''
+
+    cases = []
+
+    for (n_lat, n_lon), n_time, chunking, dtype, engine in itertools.product(grids, time_lengths, chunkings,
+                                                                             dtypes, engines):
+
+        if n_lat * n_lon > ENGINE_MAX_LOCATIONS.get(engine, np.inf):
+            continue
+
+        if dtype not in ENGINE_DTYPES.get(engine, DTYPES):
+            continue
+
+        case_id = '{0}|{1}x{2}|t{3}|{4}|{5}'.format(engine, n_lat, n_lon, n_time,
+                                                    'numpy' if chunking is None else 'lat{0}'.format(chunking),
+                                                    dtype)
+
+        cases.append({'case_id':case_id, 'engine':engine, 'n_lat':n_lat, 'n_lon':n_lon,
+                      'n_time':n_time, 'chunking':chunking, 'dtype':dtype,
+                      'n_dipoles':n_dipoles, 'seed':seed, 'repeat':repeat})
+
+    return cases
+
+
+def quick_cases(repeat=3):
+
+    # a small subset of the suite (i.e.: a smoke test)
+
+    return benchmark_cases(grids=GRIDS[:1], time_lengths=TIME_LENGTHS[:1], dtypes=DTYPES[:1], repeat=repeat)
+
+
+def _peak_rss_bytes():
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    return int(peak if sys.platform == 'darwin' else peak * 1024)
+
+
+def _compute(x):
+
+    return x.compute() if hasattr(x, 'compute') else x
+
+
+def _run_entry_point(engine, ds, dtype):
+
+    # runs the engine, and returns its (fully computed) line paths
+
+    module, name = engine.split(':')
+
+    if module == 'numpy' and name == 'topk':
+
+        from teleconnection_via_numpy import get_teleconnection_partners
+
+        Partners, Partners_paths = get_teleconnection_partners(ds, variable='air', dim='time',
+                                                               dtype=np.dtype(dtype))
+
+        # the strongest partner of each location
+        return Partners_paths[Partners_paths['rank'] == 0]
+
+    elif module == 'numpy' and name in ['pyramid', 'approximate', 'eof']:
+
+        import teleconnection_via_numpy
+
+        entry_point = getattr(teleconnection_via_numpy, 'get_teleconnection_' + name)
+
+        outputs = entry_point(ds, variable='air', dim='time', dtype=np.dtype(dtype))
+
+        return outputs[1]
+
+    elif module == 'numpy':
+
+        from teleconnection_via_numpy import get_teleconnection_via_numpy
+
+        Teleconnection, Teleconnection_paths = get_teleconnection_via_numpy(ds, variable='air', dim='time',
+                                                                            engine=name,
+                                                                            dtype=np.dtype(dtype))
+
+        _compute(Teleconnection)
+
+        return Teleconnection_paths
+
+    from teleconnection_with_connecting_pathways import get_correlation_for_each_pixel
+
+    dsx, Teleconnection_paths = get_correlation_for_each_pixel(ds, variable='air', dim='time',
+                                                               mode=name,
+                                                               verbose=False)
+
+    return Teleconnection_paths
+
+
+def run_case(case):
+
+    '''
+    Function description:
+
+        Runs a single case (see benchmark_cases) in the current process.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        dict: the case, plus:
+
+            'wall_seconds': the best run time of the entry point (without
+                            the generation of the field)
+
+            'peak_rss_bytes': the peak resident memory of the process
+                              (None where it is not available)
+
+            'rss_before_bytes': the peak resident memory before the run
+                                (imports and field)
+
+            'partner_recall': the fraction of the planted dipole cells whose
+                              partner is found (see utils.planted_partner_recall)
+
+            'status': 'ok', or the error of a failed run
+
+    '''
+
+    from utils import planted_dipole_dataset, planted_partner_recall
+
+    result = dict(case)
+
+    chunks = None if case['chunking'] is None else {'lat':case['chunking']}
+
+    ds, Dipoles = planted_dipole_dataset(n_lat=case['n_lat'], n_lon=case['n_lon'], n_time=case['n_time'],
+                                         n_dipoles=case['n_dipoles'], dtype=np.dtype(case['dtype']),
+                                         chunks=chunks, seed=case['seed'])
+
+    result['rss_before_bytes'] = _peak_rss_bytes()
+
+    wall_seconds = []
+
+    try:
+
+        for run in range(case.get('repeat', 1)):
+
+            start = time.perf_counter()
+
+            Teleconnection_paths = _run_entry_point(case['engine'], ds, case['dtype'])
+
+            wall_seconds.append(time.perf_counter() - start)
+
+    except Exception as error:
+
+        result.update({'wall_seconds':None, 'peak_rss_bytes':_peak_rss_bytes(),
+                       'partner_recall':None, 'status':'{0}: {1}'.format(type(error).__name__, error)})
+
+        return result
+
+    result['wall_seconds'] = min(wall_seconds)
+
+    result['peak_rss_bytes'] = _peak_rss_bytes()
+
+    result['partner_recall'] = planted_partner_recall(Teleconnection_paths, Dipoles)
+
+    result['status'] = 'ok'
+
+    return result
+
+
+def run_benchmarks(cases, isolate=True, verbose=True):
+
+    '''
+    Function description:
+
+        Runs the cases one after the other.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        cases (list of dicts): see benchmark_cases
+
+        isolate (bool = True): if True, each case runs in a fresh (spawned)
+                               process, so that its peak memory does not
+                               include the previous cases
+
+        verbose (bool = True): prints one line per case
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        list of dicts (see run_case)
+
+    '''
+
+    results = []
+
+    context = multiprocessing.get_context('spawn')
+
+    for case in cases:
+
+        if isolate:
+
+            with context.Pool(processes=1, maxtasksperchild=1) as pool:
+
+                result = pool.apply(run_case, (case,))
+
+        else:
+
+            result = run_case(case)
+
+        if verbose:
+
+            print('{0:<48} {1:>9} s {2:>9} MB  recall {3}  {4}'.format(
+                  result['case_id'],
+                  'nan' if result['wall_seconds'] is None else '{0:.3f}'.format(result['wall_seconds']),
+                  'nan' if result['peak_rss_bytes'] is None else '{0:.0f}'.format(result['peak_rss_bytes'] / 2.0**20),
+                  result['partner_recall'],
+                  result['status']))
+
+        results.append(result)
+
+    return results
+
+
+def _metadata():
+
+    import dask
+    import xarray as xr
+
+    return {'python':platform.python_version(),
+            'numpy':np.__version__,
+            'dask':dask.__version__,
+            'xarray':xr.__version__,
+            'platform':platform.platform(),
+            'processor':platform.processor(),
+            'cpu_count':multiprocessing.cpu_count(),
+            'date':time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def write_results(path, results):
+
+    '''
+    Writes the results (and the versions/platform of the run) as JSON.
+    '''
+
+    with open(path, 'w') as f:
+
+        json.dump({'metadata':_metadata(), 'results':results}, f, indent=1)
+
+
+def load_results(path):
+
+    with open(path) as f:
+
+        return json.load(f)['results']
+
+
+def compare_with_baseline(results, baseline, time_tolerance=1.25, memory_tolerance=1.25,
+                          time_slack=0.05):
+
+    '''
+    Function description:
+
+        Compares the results with a baseline (i.e.: a stored results file),
+        case by case (matched by case_id).
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        results, baseline (lists of dicts): see run_case
+
+        time_tolerance, memory_tolerance (float = 1.25): the largest ratios
+                                (result / baseline) of the wall time and of
+                                the peak memory that are not regressions
+
+        time_slack (float = 0.05): the smallest slowdown (in seconds) that
+                                   is a regression, so that the timer noise
+                                   of the fastest cases is not reported
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        list of dicts (one per case found in both), with the 'time_ratio',
+        the 'memory_ratio', the 'recall_change' and whether it is a
+        'regression'
+
+    '''
+
+    baseline = {x['case_id']:x for x in baseline}
+
+    comparisons = []
+
+    for result in results:
+
+        reference = baseline.get(result['case_id'])
+
+        if reference is None:
+            continue
+
+        comparison = {'case_id':result['case_id'], 'time_ratio':None,
+                      'memory_ratio':None, 'recall_change':None}
+
+        if result['status'] != 'ok':
+
+            comparison['regression'] = reference['status'] == 'ok'
+
+            comparisons.append(comparison)
+
+            continue
+
+        regression = False
+
+        if reference['wall_seconds']:
+
+            comparison['time_ratio'] = result['wall_seconds'] / reference['wall_seconds']
+
+            regression |= (comparison['time_ratio'] > time_tolerance and
+                           result['wall_seconds'] - reference['wall_seconds'] > time_slack)
+
+        if reference['peak_rss_bytes'] and result['peak_rss_bytes']:
+
+            # the memory of the run itself (above the imports and the field)
+            used = result['peak_rss_bytes'] - result['rss_before_bytes']
+
+            reference_used = reference['peak_rss_bytes'] - reference['rss_before_bytes']
+
+            comparison['memory_ratio'] = used / float(max(reference_used, 2**20))
+
+            regression |= comparison['memory_ratio'] > memory_tolerance and used > 2**20
+
+        if reference['partner_recall'] is not None:
+
+            comparison['recall_change'] = result['partner_recall'] - reference['partner_recall']
+
+            regression |= comparison['recall_change'] < 0
+
+        comparison['regression'] = bool(regression)
+
+        comparisons.append(comparison)
+
+    return comparisons
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark suite of the teleconnection entry points')
+
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='the JSON file of the results')
+
+    parser.add_argument('--baseline', default=None,
+                        help='a stored results file to compare with')
+
+    parser.add_argument('--quick', action='store_true',
+                        help='runs a small subset of the cases')
+
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES)
+
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='the number of runs of each case (the best wall time is kept)')
+
+    parser.add_argument('--time-tolerance', type=float, default=1.25)
+
+    parser.add_argument('--memory-tolerance', type=float, default=1.25)
+
+    parser.add_argument('--no-isolation', action='store_true',
+                        help='runs every case in this process (the peak memory is then cumulative)')
+
+    arguments = parser.parse_args(argv)
+
+    cases = quick_cases(repeat=arguments.repeat) if arguments.quick else benchmark_cases(repeat=arguments.repeat)
+
+    cases = [case for case in cases if case['engine'] in arguments.engines]
+
+    results = run_benchmarks(cases, isolate=not arguments.no_isolation)
+
+    write_results(arguments.output, results)
+
+    failed = [x for x in results if x['status'] != 'ok' or
+              (x['partner_recall'] < 1 and x['engine'] not in APPROXIMATE_ENGINES)]
+
+    for result in failed:
+
+        print('incorrect or failed:', result['case_id'], result['status'], result['partner_recall'])
+
+    if arguments.baseline is None:
+
+        return int(bool(failed))
+
+    comparisons = compare_with_baseline(results, load_results(arguments.baseline),
+                                        time_tolerance=arguments.time_tolerance,
+                                        memory_tolerance=arguments.memory_tolerance)
+
+    regressions = [x for x in comparisons if x['regression']]
+
+    for comparison in regressions:
+
+        print('regression:', comparison)
+
+    print('{0} cases compared with the baseline, {1} regressions'.format(len(comparisons), len(regressions)))
+
+    return int(bool(failed or regressions))
+
+
+if '__main__' == __name__:
+
+    sys.exit(main())
@@ -5,48 +5,274 @@ Created on Thu Oct 24 14:25:15 2019
 @author: lealp
 """
 
+from functools import partial
+import warnings
+
 import pandas as pd
 pd.set_option('display.width', 50000)
 pd.set_option('display.max_rows', 50000)
 pd.set_option('display.max_columns', 5000)
 
 from dask.array import corrcoef as da_corrcoef
+from dask.array import isnan as da_isnan, where as da_where
+import dask
 import numpy as np
 import xarray as xr
-from shapely.geometry import Point, LineString
 import geopandas as gpd
 
 from utils import Base_class_space_time_netcdf_gdf 
+from utils import tiled_min_correlation, tiled_topk_correlation, DEFAULT_TILE_MEMORY_BUDGET
+from utils import tiled_lagged_min_correlation
+from utils import standardize_series, standardized_pearson_tile, standardized_ranks
+from utils import Correlation_store, Result_cache
+from utils import teleconnection_significance
+from utils import Sparse_threshold_collector, chain_tile_callbacks
+from utils import Streaming_correlation_statistics
+from utils import Region_pair_mask, Distance_pair_mask, combine_pair_masks
+from utils import area_weighted_coarsen, pyramid_min_correlation, teleconnection_accuracy
+from utils import approximate_min_correlation, low_rank_min_correlation
+from utils import stage, linepaths_gdf
+import time
 
 ####################33 numpy function:
 
 
-def get_gdf(Correlate, Teleconnection, index, crs={'init' :'epsg:4326'}):
+def get_gdf(Correlate, Teleconnection, index, crs={'init' :'epsg:4326'}, partner_index=None,
+            Telecon_threshold=None):
+    
+    '''
     
+    Function description:
         
-    Teleconnection_paths = Correlate.to_dask_dataframe().idxmin(axis=1).compute()
+        Builds the geopandas GeoDataFrame of the Linestring paths connecting
+        each location to its most negatively correlated partner.
+        
+        The coordinates of each origin and partner are gathered by array 
+        indexing, and all Linestrings are built in a single vectorized call.
+        
+        
+    -------------------------------------------------------------------------
     
-    origin = Teleconnection_paths.index
-    to_point = Teleconnection_paths.values
+    Parameters:
+        
+        Correlate (2D dask-array): the (locations x locations) correlation 
+                                   matrix. It is ignored if the partner_index 
+                                   is given.
+        
+        Teleconnection (1D array): the minimum correlation of each location. 
+                                   It is ignored if the partner_index is not 
+                                   given: it is then evaluated along with the 
+                                   partners, in the same pass over Correlate.
+        
+        index (pandas DataFrame): the coordinates of each location
+        
+        partner_index (1D array of int = None): the index of the partner of 
+                                                each location (i.e.: as 
+                                                returned by the tiled engine). 
+                                                Negative values mean that the 
+                                                location has no partner.
+        
+        Telecon_threshold (float = None): if given, only the locations whose 
+                                          Teleconnection is lower or equal to 
+                                          it are kept. The filter is applied 
+                                          before any geometry is built.
     
-    Origin_points = []
-    destination_points = []
-    lat, lon = index.columns
-    for o,p in zip(origin, to_point): 
+    '''
     
-        Origin_points.append(Point(index.iloc[o][lon], index.iloc[o][lat]))
-        destination_points.append(Point(index.iloc[p][lon], index.iloc[p][lat]))
+    if partner_index is None:
         
-    Teleconnection_paths = [LineString( (op, dp)) for op, dp in zip(Origin_points, destination_points)]
+        # the (lazy) correlation matrix is evaluated here
+        with stage('idxmin', nbytes=Correlate.nbytes):
+            
+            # NaN correlations never become partners (as in the idxmin)
+            Correlate = da_where(da_isnan(Correlate), np.inf, Correlate)
+            
+            partner_index, minimum = dask.compute(Correlate.argmin(axis=1), Correlate.min(axis=1))
+            
+            partner_index = np.where(np.isinf(minimum), -1, partner_index)
+            
+            Teleconnection = np.where(np.isinf(minimum), np.nan, minimum)
     
-    Teleconnection_paths = gpd.GeoDataFrame({'Teleconnection':Teleconnection}, 
-                                            geometry=Teleconnection_paths,
-                                            crs=crs,
-                                            index=np.arange(Teleconnection.size))
+    partner_index = np.asarray(partner_index)
+    
+    Teleconnection = np.asarray(Teleconnection)
+    
+    selected = partner_index >= 0
+    
+    if Telecon_threshold is not None:
+        
+        selected &= Teleconnection <= Telecon_threshold
+    
+    origin = np.flatnonzero(selected)
+    to_point = partner_index[origin]
+    
+    lat, lon = index.columns
+    
+    lons = index[lon].values
+    lats = index[lat].values
+    
+    with stage('geometry', nbytes=origin.size * 4 * lons.itemsize):
+        
+        Teleconnection_paths = linepaths_gdf(lons[origin], lats[origin], lons[to_point], lats[to_point],
+                                             {'Teleconnection':Teleconnection[origin]}, 
+                                             crs=crs,
+                                             index=origin)
     
     return Teleconnection_paths
 
-def get_teleconnection_via_numpy(ds, variable='air', dim='time', Telecon_threshold= -0.5):
+def _to_location_map(values, ds, listed_dims, name='Teleconnection', extra_coords={}):
+    
+    # reshapes an O(N) result (one value per location) back into the grid.
+    # extra_coords: other O(N) results (i.e.: partner_index) to be attached 
+    # as non-dimensional coordinates
+    
+    shape = [ds.coords[x].size for x in listed_dims]
+    
+    with stage('location_map'):
+        
+        location_map = xr.DataArray(data=np.asarray(values).reshape(shape), 
+                                    dims=listed_dims,
+                                    coords={x:ds.coords[x].values for x in listed_dims},
+                                    name=name)
+        
+        for coord_name, coord_values in extra_coords.items():
+            
+            location_map.coords[coord_name] = (listed_dims, np.asarray(coord_values).reshape(shape))
+        
+        for x in listed_dims:
+            
+            location_map = location_map.sortby(x)
+    
+    return location_map
+
+
+def _get_pair_mask(index, listed_dims, region=None, region_pairs=None, min_distance_km=None):
+    
+    # the allowed pairs of the flattened locations (None if all are allowed)
+    
+    lat, lon = index.columns
+    
+    lons = index[lon].values
+    
+    lats = index[lat].values
+    
+    Distance_mask = None
+    
+    if min_distance_km is not None:
+        
+        Distance_mask = Distance_pair_mask(lons, lats, min_distance_km)
+    
+    return combine_pair_masks(Region_pair_mask.from_regions(lons, lats, 
+                                                            region=region, region_pairs=region_pairs, 
+                                                            dims=listed_dims,
+                                                            coordinate_names={'lat':lat, 'lon':lon}),
+                              Distance_mask)
+
+
+def _get_min_correlation_outputs(ds, index, listed_dims, Teleconnection, partner_index, 
+                                 Telecon_threshold=None, Columns={}):
+    
+    # builds the outputs of the O(N) engines (the Teleconnection map and its 
+    # paths) from the minimum correlation of each location and its partner. 
+    # The other O(N) results (i.e.: lag, Significance), if any, are attached 
+    # as coordinates of the map and columns of the paths.
+    
+    Teleconnection_paths = get_gdf(None, Teleconnection, index, partner_index=partner_index, 
+                                   Telecon_threshold=Telecon_threshold)
+    
+    extra_coords = {'partner_index':partner_index}
+    
+    for name, values in Columns.items():
+        
+        Teleconnection_paths[name] = values[Teleconnection_paths.index]
+        
+        extra_coords[name] = values
+    
+    Teleconnection = _to_location_map(Teleconnection, ds, listed_dims, 
+                                      extra_coords=extra_coords)
+    
+    return Teleconnection, Teleconnection_paths
+
+
+def _stack_locations(ds, variable='air', dim='time'):
+    
+    # reshapes the variable into a (dim x locations) array. 
+    # Returns the array, the MultiIndex of the locations, its DataFrame 
+    # version and the names of the location dimensions.
+    
+    da = ds[variable]
+    
+    dims_keys = [x for x in da.dims]
+    
+    listed_dims = [d for d in dims_keys if d != dim]
+    
+    locations_depth = np.prod([ds.coords[x].size for x in listed_dims])
+    
+    #locations_shape = [ds.coords[x].size for x in listed_dims]
+    
+    
+    idx = pd.MultiIndex.from_product([ds.coords[x].values for x in listed_dims], names=listed_dims)
+    
+    index = idx.to_frame().reset_index(drop=True)
+    
+    correlation_dim_depth = ds.coords[dim].size
+    
+    
+    to_shape = (correlation_dim_depth, locations_depth)
+    
+    
+    da = da.transpose(dim, *listed_dims).data.reshape(to_shape)
+    
+    return da, idx, index, listed_dims
+
+
+CORRELATIONS = ['pearson', 'spearman']
+
+
+def _standardize_locations(da, correlation='pearson', dtype=np.float64):
+    
+    # standardized series (pearson) or standardized ranks (spearman): 
+    # in both cases a correlation tile is a plain matrix product
+    
+    if correlation == 'pearson':
+        return standardize_series(da, dtype=dtype)
+    
+    elif correlation == 'spearman':
+        return standardized_ranks(da, dtype=dtype)
+    
+    raise ValueError("correlation must be one of {0}, not {1}".format(CORRELATIONS, correlation))
+
+
+def _segment_preparation(correlation='pearson', dtype=np.float64):
+    
+    # the lagged reduction standardizes (or ranks) each overlapping segment 
+    # of the series, so that each lagged correlation is exact over its overlap
+    
+    if correlation == 'pearson':
+        return partial(standardize_series, dtype=dtype)
+    
+    elif correlation == 'spearman':
+        return partial(standardized_ranks, dtype=dtype)
+    
+    raise ValueError("correlation must be one of {0}, not {1}".format(CORRELATIONS, correlation))
+
+
+def get_teleconnection_via_numpy(ds, variable='air', dim='time', Telecon_threshold= -0.5,
+                                 engine='dask',
+                                 tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                                 dtype=np.float64,
+                                 store_path=None,
+                                 significance=False,
+                                 use_effective_sample_size=False,
+                                 fdr_alpha=None,
+                                 sparse_output=False,
+                                 correlation='pearson',
+                                 lags=None,
+                                 time_chunk_size=None,
+                                 statistics_path=None,
+                                 region=None,
+                                 region_pairs=None,
+                                 min_distance_km=None):
     
     '''
     
@@ -73,75 +299,1079 @@ def get_teleconnection_via_numpy(ds, variable='air', dim='time', Telecon_thresho
         variable of the xarray-dataset to be used in the analysis
         
         dim (string): the dimesion that will be used for correlation
+        
+        engine (string = 'dask'): 
+            
+            'dask': evaluates the full (N x N) correlation matrix 
+                    through dask.array.corrcoef.
+            
+            'tiled': walks the correlation matrix in tiles, keeping only 
+                     the running minimum and argmin of each location. 
+                     The (N x N) matrix is never materialized.
+                     Each series is standardized once, so that each 
+                     correlation tile is a plain (BLAS) matrix product.
+            
+            'streaming': reads the data once, one time chunk at a time 
+                         (i.e.: a record of many files opened with 
+                         xarray.open_mfdataset), accumulating the count, 
+                         the means and the co-moments of the locations 
+                         (see utils.Streaming_correlation_statistics). 
+                         The correlations are finished at the end, tile by 
+                         tile, with the same outputs as the 'tiled' engine. 
+                         The memory depends on the number of locations 
+                         (N x N co-moments), not on the length of the record. 
+                         Only the 'pearson' correlation is available.
+        
+        tile_memory_budget (int): maximum number of bytes of a single 
+                                  correlation tile (only used by the 
+                                  'tiled' and 'streaming' engines).
+        
+        time_chunk_size (int = None): the number of time steps per chunk of 
+                                      the 'streaming' engine (default: the 
+                                      dask chunks along "dim").
+        
+        statistics_path (str = None): if given, the running statistics of the 
+                                      'streaming' engine are persisted in this 
+                                      directory (N x N x 8 bytes on disk), so 
+                                      that new time steps can later be added 
+                                      with update_teleconnection_via_numpy 
+                                      (the statistics hold every pair: the 
+                                      region and distance filters are given 
+                                      again to each update).
+        
+        region (= None): restricts the analysis to the pairs of locations 
+                         inside this region: a shapely (Multi)Polygon, a 
+                         GeoDataFrame/GeoSeries (the union of its geometries) 
+                         or a boolean mask of the locations (i.e.: a 
+                         xarray-DataArray land-sea mask). 
+        
+        region_pairs (list of tuples = None): restricts the analysis to the 
+                         pairs of locations that link the regions of any of 
+                         these (region_a, region_b) tuples (i.e.: 
+                         [(ocean_basin, land_region)]). 
+                         
+                         For both, the tiles that cannot hold an allowed pair 
+                         are skipped before any correlation is evaluated, and 
+                         the locations without any allowed pair have a NaN 
+                         Teleconnection (and no partner). Only available for 
+                         the 'tiled' and 'streaming' engines.
+        
+        min_distance_km (float = None): if given, the pairs of locations closer 
+                         than this great-circle distance are excluded (i.e.: 
+                         the neighbouring cells across a sharp gradient), 
+                         so that the partners are remote. The mask of each 
+                         tile is evaluated from the chord distances between 
+                         its locations (see utils.Distance_pair_mask), 
+                         inside the reduction. Only available for the 
+                         'tiled' and 'streaming' engines.
+        
+        dtype (numpy dtype = float64): precision of the 'tiled' engine. 
+                                       float32 halves the memory and roughly 
+                                       doubles the throughput, with an 
+                                       absolute error of up to ~1e-6 relative 
+                                       to float64 (see utils.standardize_series).
+        
+        store_path (str = None): if given, each correlation tile evaluated 
+                                 by the 'tiled' engine is also written to a 
+                                 memory-mapped store in this directory. 
+                                 The correlation map of any location can 
+                                 later be read back without recomputing it:
+                                     
+                                     store = utils.Correlation_store(store_path)
+                                     store.get_row_map(lat=-10, lon=-60)
+                                 
+                                 The store takes N x N x itemsize bytes 
+                                 on disk.
+        
+        significance (bool = False): if True, the p-value of each 
+                                     teleconnection (Pearson t-test) is 
+                                     evaluated from the O(N) results of the 
+                                     'tiled' engine, and returned as the 
+                                     'p_value' coordinate of the map and 
+                                     column of the paths. 
+                                     Since the partner is the most negative 
+                                     of the N - 1 correlations of each 
+                                     location (times the number of lags), 
+                                     its p-value is adjusted for this 
+                                     search (Sidak: 1 - (1 - p)**(N - 1), 
+                                     see utils.sidak_p_value). The pairs 
+                                     excluded by the region or distance 
+                                     filters are still counted, so that 
+                                     the adjustment is conservative.
+        
+        use_effective_sample_size (bool = False): corrects the number of 
+                                     samples of each pair for the lag-1 
+                                     autocorrelation of both series 
+                                     (see utils.effective_sample_size).
+        
+        fdr_alpha (float = None): if given, the field significance is 
+                                  controlled through the Benjamini-Hochberg 
+                                  procedure at this false discovery rate 
+                                  ('q_value' and 'significant' outputs).
+        
+        sparse_output (bool = False): if True, every pair of locations whose 
+                                      correlation is lower or equal to the 
+                                      Telecon_threshold is kept, tile by tile, 
+                                      in a sparse matrix (only available for 
+                                      the 'tiled' engine). Its memory scales 
+                                      with the number of teleconnections, 
+                                      instead of N x N.
+        
+        correlation (string = 'pearson'): the correlation of the 'tiled' 
+                                          engine: 'pearson' or 'spearman'. 
+                                          For 'spearman', each series is 
+                                          ranked once along "dim", and the 
+                                          ranks are reduced with the same 
+                                          BLAS tiles as 'pearson' (the 
+                                          significance is then the t-test 
+                                          of the ranks).
+        
+        lags (iterable of int = None): if given, each location is correlated 
+                                       with every other location shifted by 
+                                       each of these lags (in steps of "dim"; 
+                                       a positive lag means that the partner 
+                                       lags behind the location), and its 
+                                       partner is the most negative 
+                                       correlation over all pairs and lags. 
+                                       Each lagged correlation is evaluated 
+                                       over the overlapping segment of both 
+                                       series, with one blocked (BLAS) 
+                                       product per lag and tile: no shifted 
+                                       copy of the dataset is built. The 
+                                       best lag of each location is returned 
+                                       as the 'lag' coordinate of the map and 
+                                       column of the paths. Only available 
+                                       for the 'tiled' engine, without the 
+                                       store_path and the sparse_output.
     
     -------------------------------------------------------------------------
     
     returns: xarray-dataarray containing the Teleconnection Map
     
-    '''
+        For the 'tiled' engine, the returned Teleconnection Map has the 
+        dimensions of the locations (i.e.: lat, lon), and the index of the 
+        partner of each location is given in its 'partner_index' coordinate.
+        
+        If sparse_output is True, a third output is returned: the (N x N) 
+        scipy.sparse CSR matrix of the thresholded correlations, whose rows 
+        and columns follow the flat location index (i.e.: partner_index).
     
-    da = ds[variable]
+    '''
     
-    dims_keys = [x for x in ds.dims.keys()]
+    with stage('reshape') as Reshape:
+        
+        da, idx, index, listed_dims = _stack_locations(ds, variable=variable, dim=dim)
+        
+        Reshape.add_bytes(da.nbytes)
     
-    listed_dims = [d for d in dims_keys if d != dim]
+    pair_mask = _get_pair_mask(index, listed_dims, region=region, region_pairs=region_pairs, 
+                               min_distance_km=min_distance_km)
     
-    locations_depth = np.prod([ds.coords[x].size for x in listed_dims])
+    if statistics_path is not None and engine != 'streaming':
+        
+        raise ValueError("the statistics_path is only available for the 'streaming' engine")
     
-    #locations_shape = [ds.coords[x].size for x in listed_dims]
+    elif engine == 'tiled' and lags is not None:
+        
+        if store_path is not None or sparse_output:
+            
+            raise ValueError("the lagged correlation is not available with the correlation store nor the sparse output")
+        
+        lags = [int(lag) for lag in lags]
+        
+        with stage('correlation', nbytes=da.nbytes):
+            
+            Teleconnection, partner_index, best_lag = tiled_lagged_min_correlation(da, lags,
+                                                                                   tile_memory_budget=tile_memory_budget,
+                                                                                   correlation_tile=standardized_pearson_tile,
+                                                                                   prepare_segment=_segment_preparation(correlation, dtype),
+                                                                                   pair_mask=pair_mask)
+        
+        Columns = {'lag':best_lag}
+        
+        if significance:
+            
+            with stage('significance'):
+                
+                Columns.update(teleconnection_significance(Teleconnection, partner_index, 
+                                                           _standardize_locations(da, correlation=correlation, dtype=dtype),
+                                                           method='pearson',
+                                                           use_effective_sample_size=use_effective_sample_size,
+                                                           fdr_alpha=fdr_alpha,
+                                                           n_samples=da.shape[0] - np.abs(best_lag),
+                                                           n_candidates=len(lags) * (Teleconnection.size - 1)))
+        
+        return _get_min_correlation_outputs(ds, index, listed_dims, Teleconnection, partner_index, 
+                                            Telecon_threshold=Telecon_threshold, Columns=Columns)
     
+    elif engine in ['tiled', 'streaming']:
+        
+        if engine == 'streaming' and correlation != 'pearson':
+            
+            raise ValueError("the 'streaming' engine only evaluates the 'pearson' correlation")
+        
+        elif engine == 'streaming' and lags is not None:
+            
+            raise ValueError("the lagged correlation is only available for the 'tiled' engine")
+        
+        tile_callback = None
+        
+        if sparse_output:
+            
+            Sparse_teleconnections = Sparse_threshold_collector(da.shape[1], 
+                                                                threshold=Telecon_threshold,
+                                                                dtype=dtype)
+            
+            tile_callback = Sparse_teleconnections
+        
+        if store_path is not None:
+            
+            store = Correlation_store.create(store_path, 
+                                             coords={x:ds.coords[x].values for x in listed_dims}, 
+                                             dims=listed_dims, 
+                                             dtype=dtype)
+            
+            tile_callback = chain_tile_callbacks(tile_callback, store.write_tile)
+        
+        if engine == 'tiled':
+            
+            with stage('standardize', nbytes=da.nbytes):
+                
+                Z = _standardize_locations(da, correlation=correlation, dtype=dtype)
+            
+            with stage('correlation', nbytes=Z.nbytes):
+                
+                Teleconnection, partner_index = tiled_min_correlation(Z, 
+                                                                      tile_memory_budget=tile_memory_budget,
+                                                                      correlation_tile=standardized_pearson_tile,
+                                                                      tile_callback=tile_callback,
+                                                                      pair_mask=pair_mask)
+        
+        else:
+            
+            # the raw data is only read again by the significance, if the 
+            # effective sample size is requested (lag-1 autocorrelations)
+            Z = da
+            
+            Statistics = Streaming_correlation_statistics(da.shape[1], 
+                                                          path=statistics_path,
+                                                          tile_memory_budget=tile_memory_budget,
+                                                          coords={x:ds.coords[x].values for x in listed_dims},
+                                                          dims=listed_dims)
+            
+            with stage('accumulate', nbytes=da.nbytes):
+                
+                Statistics.accumulate(da, time_chunk_size=time_chunk_size)
+            
+            if statistics_path is not None:
+                
+                Statistics.time_stop = ds.coords[dim].values[-1]
+                
+                with stage('flush'):
+                    
+                    Statistics.flush()
+            
+            with stage('correlation'):
+                
+                Teleconnection, partner_index = Statistics.min_correlation(tile_callback=tile_callback, 
+                                                                           pair_mask=pair_mask)
+        
+        if store_path is not None:
+            
+            store.flush()
+        
+        Columns = {}
+        
+        if significance:
+            
+            with stage('significance'):
+                
+                Columns = teleconnection_significance(Teleconnection, partner_index, Z,
+                                                      method='pearson',
+                                                      use_effective_sample_size=use_effective_sample_size,
+                                                      fdr_alpha=fdr_alpha,
+                                                      n_candidates=Teleconnection.size - 1)
+        
+        Teleconnection, Teleconnection_paths = _get_min_correlation_outputs(ds, index, listed_dims, 
+                                                                            Teleconnection, partner_index, 
+                                                                            Telecon_threshold=Telecon_threshold, 
+                                                                            Columns=Columns)
+        
+        if sparse_output:
+            
+            return Teleconnection, Teleconnection_paths, Sparse_teleconnections.to_csr()
+        
+        return Teleconnection, Teleconnection_paths
     
-    idx = pd.MultiIndex.from_product([ds.coords[x].values for x in listed_dims], names=listed_dims)
+    elif engine != 'dask':
+        
+        raise ValueError("engine must be one of 'dask', 'tiled' or 'streaming', not {0}".format(engine))
     
-    index = idx.to_frame().reset_index(drop=True)
+    elif store_path is not None:
+        
+        raise ValueError("the correlation store is only available for the 'tiled' and 'streaming' engines")
     
-    correlation_dim_depth = ds.coords[dim].size
+    elif significance:
+        
+        raise ValueError("the significance is only available for the 'tiled' and 'streaming' engines")
     
+    elif sparse_output:
+        
+        raise ValueError("the sparse output is only available for the 'tiled' and 'streaming' engines")
     
-    to_shape = (correlation_dim_depth, locations_depth)
+    elif correlation != 'pearson':
+        
+        raise ValueError("the {0} correlation is only available for the 'tiled' engine".format(correlation))
     
+    elif lags is not None:
+        
+        raise ValueError("the lagged correlation is only available for the 'tiled' engine")
     
-    da = da.data.reshape(to_shape)
+    elif pair_mask is not None:
+        
+        raise ValueError("the region and distance filters are only available for the 'tiled' and 'streaming' engines")
 	
-    Correlate = da_corrcoef(da, 
-                       rowvar=False # to ensure that each column is an entry 
-                                    # (i.e. a different location in space that
-                                    # must be correlated with everyone else) 
-                            )
+    # only the (lazy) graph is built here: it is evaluated by the idxmin 
+    # stage of get_gdf
+    with stage('corrcoef', nbytes=da.nbytes):
+        
+        Correlate = da_corrcoef(da, 
+                           rowvar=False # to ensure that each column is an entry 
+                                        # (i.e. a different location in space that
+                                        # must be correlated with everyone else) 
+                                )
     
+    # the minimum of each location in space is evaluated by get_gdf, in the 
+    # same pass as its partner
+    Teleconnection_paths = get_gdf(Correlate, None, index, 
+                                   Telecon_threshold=Telecon_threshold)
     
-    Teleconnection = Correlate.min(axis=1) # getting minimum for each location in space
-                
-                      
+
+    # use from_series method
+   
+    
+    with stage('location_map'):
+        
+        Teleconnection = xr.DataArray(data=Correlate, 
+                                                  dims=idx.names,
+                                                  #coords=idx,
+                                                  name='Teleconnection')
+        
+        for name in index.columns:
+            
+            Teleconnection[name] = (name, index[name])
+            
+            Teleconnection = Teleconnection.sortby(name)
     
-    Teleconnection_paths = get_gdf(Correlate, Teleconnection, index)
+    return Teleconnection, Teleconnection_paths
 
-    Teleconnection_paths = Teleconnection_paths[Teleconnection_paths['Teleconnection'] <= Telecon_threshold]
+
+
+def update_teleconnection_via_numpy(ds, statistics_path, variable='air', dim='time', 
+                                    Telecon_threshold= -0.5,
+                                    time_chunk_size=None,
+                                    significance=False,
+                                    fdr_alpha=None,
+                                    region=None,
+                                    region_pairs=None,
+                                    min_distance_km=None):
+    
+    '''
+    
+    Function description:
+        
+        Adds new time steps to the running statistics persisted by the 
+        'streaming' engine (see get_teleconnection_via_numpy and its 
+        statistics_path), and refreshes the Teleconnection map and its paths.
+        
+        Only the time steps after the last one already accumulated are read, 
+        and merged into the co-moments with an online (pairwise) covariance 
+        update, so that the cost is proportional to the new data plus the 
+        final reduction, instead of the whole record.
+    
+    -------------------------------------------------------------------------
+    
+    Parameters:
+        
+        ds (3-D xarray-Dataset): the new time steps (or the whole record: the 
+                                 time steps already accumulated are skipped). 
+                                 Its locations must be the same as the ones 
+                                 of the persisted statistics.
+        
+        statistics_path (str): the directory of the persisted statistics
+        
+        time_chunk_size (int = None): see get_teleconnection_via_numpy
+        
+        significance, fdr_alpha: see get_teleconnection_via_numpy (the 
+                                 effective sample size is not available, 
+                                 since the past records are not read again)
+        
+        region, region_pairs, min_distance_km: see get_teleconnection_via_numpy. 
+                                 The statistics hold every pair of locations, 
+                                 so that the filters are applied by the final 
+                                 reduction: they must be given again to each 
+                                 update (i.e.: the ones of the first run).
+    
+    -------------------------------------------------------------------------
     
+    returns: the Teleconnection Map and paths (as the 'streaming' engine of 
+             get_teleconnection_via_numpy)
+    
+    '''
+    
+    da, idx, index, listed_dims = _stack_locations(ds, variable=variable, dim=dim)
+    
+    Statistics = Streaming_correlation_statistics.open(statistics_path)
+    
+    if Statistics.dims != listed_dims or not all(np.array_equal(Statistics.coords[x], ds.coords[x].values) 
+                                                 for x in listed_dims):
+        
+        raise ValueError("the locations of the dataset do not match the ones of the statistics in {0}".format(statistics_path))
+    
+    time_values = ds.coords[dim].values
+    
+    if Statistics.time_stop is None:
+        new_steps = np.arange(time_values.size)
+    
+    else:
+        new_steps = np.flatnonzero(time_values > Statistics.time_stop)
+    
+    if new_steps.size:
+        
+        with stage('accumulate', nbytes=new_steps.size * da.shape[1] * da.dtype.itemsize):
+            
+            Statistics.accumulate(da[new_steps], time_chunk_size=time_chunk_size)
+        
+        Statistics.time_stop = time_values[new_steps].max()
+        
+        with stage('flush'):
+            
+            Statistics.flush()
+    
+    pair_mask = _get_pair_mask(index, listed_dims, region=region, region_pairs=region_pairs, 
+                               min_distance_km=min_distance_km)
+    
+    with stage('correlation'):
+        
+        Teleconnection, partner_index = Statistics.min_correlation(pair_mask=pair_mask)
+    
+    Columns = {}
+    
+    if significance:
+        
+        with stage('significance'):
+            
+            Columns = teleconnection_significance(Teleconnection, partner_index, None,
+                                                  method='pearson',
+                                                  fdr_alpha=fdr_alpha,
+                                                  n_samples=Statistics.count,
+                                                  n_candidates=Teleconnection.size - 1)
+    
+    return _get_min_correlation_outputs(ds, index, listed_dims, Teleconnection, partner_index, 
+                                        Telecon_threshold=Telecon_threshold, Columns=Columns)
 
-    # use from_series method
-   
+
+
+def get_teleconnection_pyramid(ds, variable='air', dim='time', Telecon_threshold= -0.5,
+                               levels=3,
+                               factor=4,
+                               candidates=3,
+                               neighbourhood=1,
+                               tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                               dtype=np.float64,
+                               report=False):
     
-    Teleconnection = xr.DataArray(data=Correlate, 
-                                              dims=idx.names,
-                                              #coords=idx,
-                                              name='Teleconnection')
+    '''
     
-    for name in index.columns:
+    Function description:
+        
+        Coarse-to-fine (multi-resolution) version of the Teleconnection map, 
+        for high-resolution grids.
         
-        Teleconnection[name] = (name, index[name])
+        The dataset is coarsened (area-weighted) "levels - 1" times by 
+        "factor" along each location dimension. The candidate partners are 
+        found exhaustively at the coarsest level only; the exact correlations 
+        are then evaluated, level by level, only between the cells of a 
+        coarse cell and the cells around its candidate partners 
+        (see utils.pyramid_min_correlation).
         
-        Teleconnection = Teleconnection.sortby(name)
+        With the defaults, each location is correlated with at most 
+        3 x 9 x 16 = 432 locations per level (instead of N): i.e., for a 
+        0.1 degree grid, about four orders of magnitude fewer correlations 
+        than the exhaustive search.
     
-    return Teleconnection, Teleconnection_paths
+    -------------------------------------------------------------------------
+    
+    Parameters:
+        
+        ds, variable, dim, Telecon_threshold, tile_memory_budget, dtype: 
+            see get_teleconnection_via_numpy
+        
+        levels (int = 3): the number of levels of the pyramid (including the 
+                          original grid; at least 2)
+        
+        factor (int = 4): the coarsening factor between consecutive levels
+        
+        candidates (int = 3): the number of candidate partners kept for each 
+                              cell of the coarser levels
+        
+        neighbourhood (int = 1): the number of cells around each candidate 
+                                 whose children are also evaluated
+        
+        report (bool = False): if True, the exhaustive ('tiled') result is 
+                               also evaluated, and a report of the accuracy 
+                               of the pyramid (see utils.teleconnection_accuracy) 
+                               and of the run times is returned.
+    
+    -------------------------------------------------------------------------
+    
+    returns: the Teleconnection Map and paths (as the 'tiled' engine of 
+             get_teleconnection_via_numpy), and the report (dict) if 
+             report is True.
+    
+    '''
+    
+    if levels < 2:
+        
+        raise ValueError("the pyramid needs at least 2 levels, not {0}".format(levels))
+    
+    da, idx, index, listed_dims = _stack_locations(ds, variable=variable, dim=dim)
+    
+    start = time.perf_counter()
+    
+    with stage('standardize', nbytes=da.nbytes):
+        
+        # the finest level stays lazy (for dask): its refinement only loads 
+        # the columns of each batch (see utils.refine_candidates)
+        Z = [standardize_series(da, dtype=dtype)]
+        
+        shapes = [tuple(ds[variable].sizes[x] for x in listed_dims)]
+        
+        coarse = ds[variable]
+        
+        for level in range(1, levels):
+            
+            coarse = area_weighted_coarsen(coarse, factor, listed_dims, latitude_dimension=index.columns[0])
+            
+            shapes.append(tuple(coarse.sizes[x] for x in listed_dims))
+            
+            coarse_data = coarse.transpose(dim, *listed_dims).data.reshape(coarse.sizes[dim], -1)
+            
+            Z.append(np.asarray(standardize_series(coarse_data, dtype=dtype)))
+    
+    with stage('correlation', nbytes=Z[0].nbytes):
+        
+        Teleconnection, partner_index = pyramid_min_correlation(Z, shapes, 
+                                                                factor=factor, 
+                                                                k=candidates, 
+                                                                neighbourhood=neighbourhood,
+                                                                tile_memory_budget=tile_memory_budget)
+    
+    pyramid_seconds = time.perf_counter() - start
+    
+    outputs = _get_min_correlation_outputs(ds, index, listed_dims, Teleconnection, partner_index, 
+                                           Telecon_threshold=Telecon_threshold)
+    
+    if not report:
+        
+        return outputs
+    
+    start = time.perf_counter()
+    
+    with stage('reference_correlation', nbytes=Z[0].nbytes):
+        
+        Reference, reference_partner_index = tiled_min_correlation(Z[0], 
+                                                                   tile_memory_budget=tile_memory_budget,
+                                                                   correlation_tile=standardized_pearson_tile)
+    
+    exhaustive_seconds = time.perf_counter() - start
+    
+    Report = teleconnection_accuracy(Teleconnection, partner_index, Reference, reference_partner_index)
+    
+    Report.update({'pyramid_seconds':pyramid_seconds, 
+                   'exhaustive_seconds':exhaustive_seconds, 
+                   'speedup':exhaustive_seconds / pyramid_seconds})
+    
+    return outputs + (Report,)
+
+
+
+def get_teleconnection_approximate(ds, variable='air', dim='time', Telecon_threshold= -0.5,
+                                   n_trees=8,
+                                   leaf_size=64,
+                                   seed=0,
+                                   dtype=np.float64,
+                                   tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                                   report=False):
+    
+    '''
+    
+    Function description:
+        
+        Approximate (sub-quadratic) version of the Teleconnection map. 
+        
+        The partner of each location (the idxmin of its correlations) is 
+        searched as the nearest neighbour of its negated standardized 
+        series, in a forest of random projection trees 
+        (see utils.approximate_min_correlation): each location is only 
+        correlated with at most 2 x n_trees x leaf_size other locations 
+        (instead of N).
+        
+        The Teleconnection of a location whose exact partner is missed is 
+        the correlation with the best partner found (i.e.: higher than the 
+        exact one).
+    
+    -------------------------------------------------------------------------
+    
+    Parameters:
+        
+        ds, variable, dim, Telecon_threshold, dtype: 
+            see get_teleconnection_via_numpy
+        
+        n_trees (int = 8): the number of trees of the forest. The recall/speed 
+                           knob of the search: the cost, and the recall of the 
+                           exact partners, grow with the number of trees.
+        
+        leaf_size (int = 64): the maximum number of locations of each leaf
+        
+        seed (int = 0): the seed of the random splits (None for a different 
+                        forest at each run)
+        
+        tile_memory_budget (int): only used by the exhaustive ('tiled') 
+                                  reference of the report
+        
+        report (bool = False): if True, the exhaustive ('tiled') result is 
+                               also evaluated, and a report of the measured 
+                               recall (see utils.teleconnection_accuracy) 
+                               and of the run times is returned.
+    
+    -------------------------------------------------------------------------
+    
+    returns: the Teleconnection Map and paths (as the 'tiled' engine of 
+             get_teleconnection_via_numpy), and the report (dict) if 
+             report is True.
+    
+    '''
+    
+    da, idx, index, listed_dims = _stack_locations(ds, variable=variable, dim=dim)
+    
+    start = time.perf_counter()
+    
+    with stage('standardize', nbytes=da.nbytes):
+        
+        Z = np.asarray(standardize_series(da, dtype=dtype))
+    
+    with stage('correlation', nbytes=Z.nbytes):
+        
+        Teleconnection, partner_index = approximate_min_correlation(Z, 
+                                                                    n_trees=n_trees, 
+                                                                    leaf_size=leaf_size, 
+                                                                    seed=seed)
+    
+    approximate_seconds = time.perf_counter() - start
+    
+    outputs = _get_min_correlation_outputs(ds, index, listed_dims, Teleconnection, partner_index, 
+                                           Telecon_threshold=Telecon_threshold)
+    
+    if not report:
+        
+        return outputs
+    
+    start = time.perf_counter()
+    
+    with stage('reference_correlation', nbytes=da.nbytes):
+        
+        Reference, reference_partner_index = tiled_min_correlation(Z, 
+                                                                   tile_memory_budget=tile_memory_budget,
+                                                                   correlation_tile=standardized_pearson_tile)
+    
+    exhaustive_seconds = time.perf_counter() - start
+    
+    Report = teleconnection_accuracy(Teleconnection, partner_index, Reference, reference_partner_index)
+    
+    Report.update({'approximate_seconds':approximate_seconds, 
+                   'exhaustive_seconds':exhaustive_seconds, 
+                   'speedup':exhaustive_seconds / approximate_seconds})
+    
+    return outputs + (Report,)
+
+
+
+def get_teleconnection_eof(ds, variable='air', dim='time', Telecon_threshold= -0.5,
+                           rank=20,
+                           oversampling=10,
+                           n_power_iterations=2,
+                           seed=0,
+                           dtype=np.float64,
+                           tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                           report=False):
+    
+    '''
+    
+    Function description:
+        
+        Low-rank (EOF) preview of the Teleconnection map. 
+        
+        The standardized (time x locations) data is decomposed by a 
+        randomized truncated SVD, and the map and partners are evaluated 
+        from the rank-r approximation of the correlation matrix 
+        (see utils.low_rank_min_correlation), in O(N x rank) memory.
+        
+        The approximated Teleconnections are the correlations explained by 
+        the leading EOFs only: they are weaker (closer to zero) than the 
+        exact ones, by the variance that is left out.
+    
+    -------------------------------------------------------------------------
+    
+    Parameters:
+        
+        ds, variable, dim, Telecon_threshold, dtype, tile_memory_budget: 
+            see get_teleconnection_via_numpy
+        
+        rank (int = 20): the number of EOFs kept
+        
+        oversampling (int = 10), n_power_iterations (int = 2), seed (int = 0): 
+            see utils.randomized_svd
+        
+        report (bool = False): if True, the exhaustive ('tiled') result is 
+                               also evaluated, and a report of the accuracy 
+                               of the preview (see utils.teleconnection_accuracy) 
+                               and of the run times is returned.
+    
+    -------------------------------------------------------------------------
+    
+    returns: the Teleconnection Map and paths (as the 'tiled' engine of 
+             get_teleconnection_via_numpy), the EOFs (xarray-Dataset with 
+             the 'EOF' patterns (mode x locations), their principal 
+             components 'PC' (dim x mode) and their 'explained_variance' 
+             fraction (mode)), and the report (dict) if report is True.
+    
+    '''
+    
+    da, idx, index, listed_dims = _stack_locations(ds, variable=variable, dim=dim)
+    
+    start = time.perf_counter()
+    
+    Z = standardize_series(da, dtype=dtype)
+    
+    # the lazy standardized series are evaluated by the decomposition
+    with stage('correlation', nbytes=da.nbytes):
+        
+        Teleconnection, partner_index, (U, S, Vt) = low_rank_min_correlation(Z, 
+                                                                             rank=rank, 
+                                                                             oversampling=oversampling,
+                                                                             n_power_iterations=n_power_iterations,
+                                                                             seed=seed,
+                                                                             tile_memory_budget=tile_memory_budget)
+    
+    low_rank_seconds = time.perf_counter() - start
+    
+    outputs = _get_min_correlation_outputs(ds, index, listed_dims, Teleconnection, partner_index, 
+                                           Telecon_threshold=Telecon_threshold)
+    
+    shape = [ds.coords[x].size for x in listed_dims]
+    
+    # each standardized series has a unit variance (norm)
+    n_valid = np.sum(~np.isnan(Vt[0]))
+    
+    EOFs = xr.Dataset({'EOF':(['mode'] + listed_dims, Vt.reshape([S.size] + shape)),
+                       'PC':([dim, 'mode'], U * S),
+                       'explained_variance':(['mode'], S**2 / n_valid)},
+                      coords=dict({x:ds.coords[x].values for x in listed_dims + [dim]},
+                                  mode=np.arange(1, S.size + 1)))
+    
+    for x in listed_dims:
+        
+        EOFs = EOFs.sortby(x)
+    
+    if not report:
+        
+        return outputs + (EOFs,)
+    
+    start = time.perf_counter()
+    
+    with stage('reference_correlation', nbytes=da.nbytes):
+        
+        Reference, reference_partner_index = tiled_min_correlation(Z, 
+                                                                   tile_memory_budget=tile_memory_budget,
+                                                                   correlation_tile=standardized_pearson_tile)
+    
+    exhaustive_seconds = time.perf_counter() - start
+    
+    Report = teleconnection_accuracy(Teleconnection, partner_index, Reference, reference_partner_index)
+    
+    Report.update({'low_rank_seconds':low_rank_seconds, 
+                   'exhaustive_seconds':exhaustive_seconds, 
+                   'speedup':exhaustive_seconds / low_rank_seconds})
+    
+    return outputs + (EOFs, Report)
+
+
 
+def get_partners_gdf(correlation, partner_index, index, crs={'init' :'epsg:4326'}):
+    
+    '''
+    
+    Function description:
+        
+        Builds the geopandas GeoDataFrame of the Linestring paths connecting
+        each location to each one of its k partners (k lines per origin).
+        
+    -------------------------------------------------------------------------
+    
+    Parameters:
+        
+        correlation (2D array): (locations x k) correlations
+        
+        partner_index (2D array of int): (locations x k) partner indexes.
+                                         Negative values mean no partner.
+        
+        index (pandas DataFrame): the coordinates of each location
+    
+    -------------------------------------------------------------------------
+    
+    returns: GeoDataFrame with the origin index, the partner index, the rank 
+             of the partner (0 is the strongest) and its correlation.
+    
+    '''
+    
+    origin, rank = np.nonzero(partner_index >= 0)
+    
+    to_point = partner_index[origin, rank]
+    
+    lat, lon = index.columns
+    
+    lons = index[lon].values
+    lats = index[lat].values
+    
+    return linepaths_gdf(lons[origin], lats[origin], lons[to_point], lats[to_point],
+                         {'origin_index':origin,
+                          'partner_index':to_point,
+                          'rank':rank,
+                          'Teleconnection':correlation[origin, rank]}, 
+                         crs=crs)
+
+
+def get_teleconnection_partners(ds, variable='air', dim='time', k=5, 
+                                positive=False,
+                                tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                                make_gdf=True,
+                                dtype=np.float64,
+                                correlation='pearson'):
+    
+    '''
+    
+    Function description:
+        
+        Evaluates, for each location, its k most negatively correlated 
+        partners (and optionally its k most positively correlated ones).
+        
+        The correlation matrix is walked in tiles, keeping only a streaming 
+        top-k selection of each location (O(N * k) memory).
+    
+    -------------------------------------------------------------------------
+    
+    Parameters:
+        
+        ds, variable, dim: see get_teleconnection_via_numpy
+        
+        k (int = 5): the number of partners per location
+        
+        positive (bool = False): if True, the k most positive partners are 
+                                 also evaluated
+        
+        tile_memory_budget (int): maximum number of bytes of a single 
+                                  correlation tile
+        
+        make_gdf (bool = True): if True, the GeoDataFrame of the k lines per 
+                                origin is also returned
+        
+        dtype (numpy dtype = float64): see get_teleconnection_via_numpy
+        
+        correlation (string = 'pearson'): 'pearson' or 'spearman' 
+                                          (see get_teleconnection_via_numpy)
+    
+    -------------------------------------------------------------------------
+    
+    returns: 
+        
+        Partners (xarray-Dataset): with dimensions (locations, 'rank'), and 
+                                   the variables 'negative_correlation' and 
+                                   'negative_partner_index' (plus the 
+                                   'positive_*' ones, if positive is True). 
+                                   Rank 0 is the strongest partner.
+        
+        Partners_paths (GeoDataFrame or None): see get_partners_gdf. 
+                                               The 'sign' column tells 
+                                               whether the partner is a 
+                                               negative or a positive one.
+    
+    '''
+    
+    da, idx, index, listed_dims = _stack_locations(ds, variable=variable, dim=dim)
+    
+    Z = _standardize_locations(da, correlation=correlation, dtype=dtype)
+    
+    signs = ['negative', 'positive'] if positive else ['negative']
+    
+    shape = [ds.coords[x].size for x in listed_dims] + [k]
+    
+    Partners = xr.Dataset(coords={x:ds.coords[x].values for x in listed_dims})
+    
+    Partners.coords['rank'] = np.arange(k)
+    
+    Partners_paths = []
+    
+    for sign in signs:
+        
+        with stage('correlation', nbytes=da.nbytes):
+            
+            correlation, partner_index = tiled_topk_correlation(Z, k, 
+                                                                largest=(sign == 'positive'),
+                                                                tile_memory_budget=tile_memory_budget,
+                                                                correlation_tile=standardized_pearson_tile)
+        
+        Partners[sign + '_correlation'] = (listed_dims + ['rank'], correlation.reshape(shape))
+        
+        Partners[sign + '_partner_index'] = (listed_dims + ['rank'], partner_index.reshape(shape))
+        
+        if make_gdf:
+            
+            gdf = get_partners_gdf(correlation, partner_index, index)
+            
+            gdf['sign'] = sign
+            
+            Partners_paths.append(gdf)
+    
+    for x in listed_dims:
+        
+        Partners = Partners.sortby(x)
+    
+    if make_gdf:
+        
+        Partners_paths = gpd.GeoDataFrame(pd.concat(Partners_paths, ignore_index=True), 
+                                          crs=Partners_paths[0].crs)
+    
+    else:
+        
+        Partners_paths = None
+    
+    return Partners, Partners_paths
 
 
 def main( ds, variable='air', dim='time', Telecon_threshold= -0.5,
          netcdf_temporal_coord_name='time',
          longitude_dimension='lon',
-         latitude_dimension='lat'):
+         latitude_dimension='lat',
+         cache=None,
+         refresh_cache=False,
+         preview=False,
+         **kwargs):
+    
+    '''
+    
+    Function description:
+        
+        Normalizes the given dataset (see Base_class_space_time_netcdf_gdf) 
+        and evaluates its Teleconnection map.
+        
+        Any extra keyword argument (i.e.: engine, tile_memory_budget) is 
+        passed to the get_teleconnection_via_numpy function.
+        
+        The duration, processed bytes and peak memory of each stage of the 
+        run (i.e.: 'normalization', 'reshape', 'corrcoef', 'idxmin', 
+        'geometry') are recorded inside a utils.profile context:
+            
+            with profile(trace_memory=True) as Profiler:
+                main(ds)
+            
+            Profiler.summary_dataframe()
+    
+    -------------------------------------------------------------------------
+    
+    Parameters:
+        
+        cache (None, bool, str or utils.Result_cache): 
+            
+            None or False: no cache is used
+            
+            True: the default on-disk cache (utils.DEFAULT_CACHE_DIR)
+            
+            str: the directory of the on-disk cache
+            
+            utils.Result_cache: a configured cache (i.e.: its size limit)
+            
+            The results are keyed by a hash of the input variable, its 
+            coordinates and every parameter of the run (the arrays, masks 
+            and geometries by content), so that a repeated run returns the 
+            cached Teleconnection map and paths. 
+            The cache is bypassed when a "store_path" or a "statistics_path" 
+            is given (their files must be written), for the 'dask' engine 
+            (its lazy Correlate matrix would be computed and pickled whole: 
+            N x N values), or (with a warning) if a parameter cannot be 
+            hashed by content.
+        
+        refresh_cache (bool = False): if True, the result is recomputed and 
+                                      its cache entry overwritten. 
+                                      To drop entries, see 
+                                      utils.Result_cache.invalidate.
+        
+        preview (bool or int = False): if given, a fast low-rank preview of 
+                                       the map is evaluated instead (see 
+                                       get_teleconnection_eof), from the 
+                                       leading 20 EOFs (True) or from the 
+                                       given number of EOFs (int). The extra 
+                                       keyword arguments are then passed to 
+                                       get_teleconnection_eof, and its EOFs 
+                                       are returned as a third output.
+    
+    '''
+    
+    if cache is True:
+        cache = Result_cache()
+    
+    elif isinstance(cache, str):
+        cache = Result_cache(cache)
     
+    key = None
+    
+    # the runs that write to disk (the correlation store, the streaming 
+    # statistics) are never served from the cache, nor the 'dask' engine 
+    # runs, whose lazy (N x N) Correlate matrix is too large to be pickled
+    use_cache = (kwargs.get('store_path') is None and kwargs.get('statistics_path') is None and 
+                 (preview or kwargs.get('engine', 'dask') != 'dask'))
+    
+    if cache and use_cache:
+        
+        try:
+            
+            # the data (and the array-like parameters) are hashed by content
+            with stage('cache_key', nbytes=ds[variable].nbytes):
+                
+                key = cache.key(ds[variable], 
+                                variable=variable, dim=dim, Telecon_threshold=Telecon_threshold,
+                                netcdf_temporal_coord_name=netcdf_temporal_coord_name,
+                                longitude_dimension=longitude_dimension,
+                                latitude_dimension=latitude_dimension,
+                                preview=preview,
+                                **kwargs)
+        
+        except TypeError as error:
+            
+            warnings.warn("the cache is bypassed: {0}".format(error))
+    
+    if key is not None:
+        
+        if not refresh_cache:
+            
+            result = cache.get(key)
+            
+            if result is not None:
+                return result
+    
+    else:
+        
+        cache = None
     
     B = Base_class_space_time_netcdf_gdf(ds, 
                                          netcdf_temporal_coord_name=netcdf_temporal_coord_name,
@@ -151,9 +1381,24 @@ def main( ds, variable='air', dim='time', Telecon_threshold= -0.5,
     ds = B.netcdf_ds
     
     
-
-
-    return get_teleconnection_via_numpy(ds, variable=variable, dim=dim, Telecon_threshold= Telecon_threshold)
+    if preview:
+        
+        rank = 20 if preview is True else int(preview)
+        
+        result = get_teleconnection_eof(ds, variable=variable, dim=dim, Telecon_threshold= Telecon_threshold, 
+                                        rank=rank, **kwargs)
+    
+    else:
+        
+        result = get_teleconnection_via_numpy(ds, variable=variable, dim=dim, Telecon_threshold= Telecon_threshold, **kwargs)
+    
+    if cache is not None:
+        
+        with stage('cache_put'):
+            
+            cache.put(key, tuple(x.compute() if hasattr(x, 'compute') else x for x in result))
+    
+    return result
 
 if '__main__' == __name__:
         
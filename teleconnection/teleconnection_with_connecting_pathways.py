@@ -25,6 +25,14 @@ from shapely.geometry import Point
 from shapely.geometry import LineString
 import geopandas as gpd
 
+from utils import rank_series, kendall_tau_b_tile, standardized_ranks
+from utils import standardized_pearson_tile
+from utils import iter_tiles, row_block_min_correlation, row_block_topk_correlation, DEFAULT_TILE_MEMORY_BUDGET
+from utils import row_block_lagged_min_correlation, Region_pair_mask, Distance_pair_mask, combine_pair_masks
+from utils import map_row_blocks, teleconnection_significance
+from utils import stage, linepaths_gdf
+from functools import partial
+
 
 # https://stackoverflow.com/questions/51680659/disparity-between-result-of-numpy-gradient-applied-directly-and-applied-using-xa/51690873#51690873
 
@@ -93,9 +101,149 @@ def kendall_correlation(x,y,dim='month'):
         )
     
 
+def _kendall_against_reference(values, reference, ranked=False):
+    
+    # values: (..., dim) array of series; reference: the reference series, 
+    # broadcasted by apply_ufunc as (..., dim). If ranked, both are already 
+    # ranked (see rank_along_dim), and are used as is
+    
+    n_time = values.shape[-1]
+    
+    ranks = values.reshape(-1, n_time).T
+    
+    reference_ranks = np.reshape(reference, (-1, n_time))[:1].T
+    
+    if not ranked:
+        
+        ranks, reference_ranks = rank_series(ranks), rank_series(reference_ranks)
+    
+    tau = kendall_tau_b_tile(reference_ranks, ranks)
+    
+    return tau.reshape(values.shape[:-1])
+    
+    
+def vectorized_kendall_correlation(x, y, dim='month', ranked=False):
+    '''
+    Function description:
+        
+        This is a vectorized version of the "kendall_correlation" function.
+        
+        Instead of calling scipy.stats.kendalltau once for each pixel, 
+        all series of "x" are ranked at once and correlated against the 
+        reference series "y" through numpy matrix products 
+        (see utils.kendall_tau_b_tile). Ties are handled as scipy's tau-b.
+        
+        If ranked is True, "x" and "y" are already ranked (see 
+        rank_along_dim), so that the series are not ranked again for each 
+        reference series.
+        
+    ---------------------------------------------------------------------
+    
+    
+    Return (2D-xarray-DataArray):
+        
+        The same as the "kendall_correlation" function.
+        
+    '''
+    
+    return xr.apply_ufunc(
+        _kendall_against_reference, x , y,
+        dask='parallelized',
+        input_core_dims=[dim, dim],
+        kwargs={'ranked':ranked},
+        output_dtypes=[float],
+        dask_gufunc_kwargs={'allow_rechunk':True}
+        )
+
+
+def _spearman_against_reference(values, reference, ranked=False):
+    
+    # same as _kendall_against_reference, for the Spearman correlation (if 
+    # ranked, both are already standardized ranks)
+    
+    n_time = values.shape[-1]
+    
+    z = values.reshape(-1, n_time).T
+    
+    reference_z = np.reshape(reference, (-1, n_time))[:1].T
+    
+    if not ranked:
+        
+        z, reference_z = standardized_ranks(z), standardized_ranks(reference_z)
+    
+    return standardized_pearson_tile(reference_z, z).reshape(values.shape[:-1])
+
+
+def vectorized_spearman_correlation(x, y, dim='month', ranked=False):
+    '''
+    Function description:
+        
+        Spearman version of the "vectorized_kendall_correlation" function:
+        the series are ranked and the correlation of the ranks is evaluated 
+        through a single matrix product.
+        
+        If ranked is True, "x" and "y" are already standardized ranks (see 
+        rank_along_dim).
+        
+    '''
+    
+    return xr.apply_ufunc(
+        _spearman_against_reference, x , y,
+        dask='parallelized',
+        input_core_dims=[dim, dim],
+        kwargs={'ranked':ranked},
+        output_dtypes=[float],
+        dask_gufunc_kwargs={'allow_rechunk':True}
+        )
+
+
+def _standardized_ranks_along_last_axis(values):
+    
+    n_time = values.shape[-1]
+    
+    return standardized_ranks(values.reshape(-1, n_time).T).T.reshape(values.shape)
+
+
+def rank_along_dim(dataArray, dim='time', standardize=False):
+    '''
+    Function description:
+        
+        Ranks each series of the dataArray along "dim". 
+        
+        Since the Kendall correlation only depends on the order of the values, 
+        the dataArray can be ranked once before correlating it with each 
+        reference pixel (see vectorized_kendall_correlation and its "ranked" 
+        parameter). If standardize is True, the ranks are also standardized 
+        (see utils.standardized_ranks), as used by the Spearman correlation.
+        
+        The ranks of a dask-backed dataArray are persisted, so that they are 
+        evaluated once, and not again by each correlation map.
+    
+    '''
+    
+    if standardize:
+        function, kwargs = _standardized_ranks_along_last_axis, {}
+    
+    else:
+        function, kwargs = rank_series, {'axis':-1}
+    
+    ranks = xr.apply_ufunc(
+        function, dataArray,
+        dask='parallelized',
+        input_core_dims=[[dim]],
+        output_core_dims=[[dim]],
+        kwargs=kwargs,
+        output_dtypes=[float],
+        dask_gufunc_kwargs={'allow_rechunk':True}
+        )
+    
+    return ranks.persist()
+
+
 ########### To apply over all points:
     
-def get_correlation_for_x_pixel(x, dataArray, dim='time', see_progressBar=False):
+def get_correlation_for_x_pixel(x, dataArray, dim='time', see_progressBar=False, engine='vectorized',
+                                correlation='kendall', ranked=False):
     '''
     Function description:
         
@@ -125,6 +273,27 @@ def get_correlation_for_x_pixel(x, dataArray, dim='time', see_progressBar=False)
         see_progressBar (boolean): a boolean parameter to allow the user to 
         
             see the evolution of the analysis:
+        
+        
+        engine (string = 'vectorized'): 
+            
+            'vectorized': uses the vectorized_kendall_correlation function
+            
+            'scipy': uses the kendall_correlation function (one 
+                     scipy.stats.kendalltau call per pixel)
+        
+        
+        correlation (string = 'kendall'): 'kendall' or 'spearman'. 
+                                          The 'spearman' correlation is only 
+                                          available for the 'vectorized' 
+                                          engine (see 
+                                          vectorized_spearman_correlation).
+        
+        
+        ranked (boolean = False): whether "x" and "dataArray" are already 
+                                  ranked (see rank_along_dim; standardized 
+                                  ranks for the 'spearman' correlation). 
+                                  Only for the 'vectorized' engine.
                 
      ---------------------------------------------------------------------
     
@@ -142,14 +311,38 @@ def get_correlation_for_x_pixel(x, dataArray, dim='time', see_progressBar=False)
         
         
     '''
+    if correlation not in CORRELATIONS:
+        raise ValueError("correlation must be one of {0}, not {1}".format(CORRELATIONS, correlation))
+    
+    if engine == 'vectorized' and correlation == 'spearman':
+        correlation_function = vectorized_spearman_correlation
+    
+    elif engine == 'vectorized':
+        correlation_function = vectorized_kendall_correlation
+    
+    elif engine == 'scipy' and correlation == 'spearman':
+        raise ValueError("the 'spearman' correlation is only available for the 'vectorized' engine")
+    
+    elif engine == 'scipy' and ranked:
+        raise ValueError("the ranked series are only available for the 'vectorized' engine")
+    
+    elif engine == 'scipy':
+        correlation_function = kendall_correlation
+        
+    else:
+        raise ValueError("engine must be one of 'vectorized' or 'scipy', not {0}".format(engine))
+    
+    if engine == 'vectorized':
+        correlation_function = partial(correlation_function, ranked=ranked)
+    
     if see_progressBar==False:
-        r = kendall_correlation(dataArray, x ,[dim]).compute()  
+        r = correlation_function(dataArray, x ,[dim]).compute()  
         
     else:
             
         with ProgressBar():
         # Until 'compute' is run, no computation is executed
-            r = kendall_correlation(dataArray, x ,[dim]).compute()  
+            r = correlation_function(dataArray, x ,[dim]).compute()  
             
     return r 
 
@@ -271,6 +464,34 @@ def get_teleconnection_line_path(r_correlation_map, x,
     
     '''
     
+    P = get_teleconnection_point(r_correlation_map, variable, coordinate_names=coordinate_names)
+    
+    if P is not None:
+        return get_geoseries_for_teleconnection_line_path(x, P)
+
+
+def get_teleconnection_point(r_correlation_map, variable, 
+                             coordinate_names = {'lat':'lat', 'lon':'lon'}):
+    
+    '''
+    Function description:
+    
+        This function finds the teleconnection point (i.e.: the point of 
+        minimum correlation) inside of the r_correlation_map.
+        
+    ------------------------------------------------------------------
+    Parameters:
+        
+        See get_teleconnection_line_path
+        
+    ------------------------------------------------------------------
+    Returns:
+        
+        xarray-DataArray of a single point (with its respective longitude and 
+        latitude coordinates), or None if no single point could be selected.
+        
+    '''
+    
     Tele_connection_for_point_x = r_correlation_map[variable]
     
     P = (Tele_connection_for_point_x.where(Tele_connection_for_point_x == np.unique(Tele_connection_for_point_x.min()), 
@@ -291,7 +512,7 @@ def get_teleconnection_line_path(r_correlation_map, x,
         
         
         if (P[ coordinate_names['lat'] ].size == P[ coordinate_names['lon']  ].size) & (P[ coordinate_names['lat'] ].size == 1):
-            return get_geoseries_for_teleconnection_line_path(x, P)
+            return P
         
         else:
             pass
@@ -315,7 +536,463 @@ def get_teleconnection_line_path(r_correlation_map, x,
         pass
         
         
+
+CORRELATIONS = ['kendall', 'spearman']
+
+
+def _prepare_locations(data, correlation='kendall'):
+    
+    # prepares the (dim x locations) array once, and returns it with its 
+    # respective tile function and significance test:
+    #   kendall: ranks, reduced by the Kendall tau-b tiles
+    #   spearman: standardized ranks, reduced by BLAS matrix products 
+    #             (the same tiles as the Pearson correlation)
+    
+    if correlation == 'kendall':
+        return rank_series(data), kendall_tau_b_tile, 'kendall'
+    
+    elif correlation == 'spearman':
+        return standardized_ranks(data), standardized_pearson_tile, 'pearson'
+    
+    raise ValueError("correlation must be one of {0}, not {1}".format(CORRELATIONS, correlation))
+
+
+def _prepare_lagged_locations(data, correlation='kendall'):
+    
+    # as _prepare_locations, for the lagged reduction, which prepares each 
+    # overlapping segment of the series:
+    #   kendall: the ranks of the whole series keep the order of any segment, 
+    #            so that they are ranked once (the segments are used as is)
+    #   spearman: each segment is ranked and standardized 
+    
+    if correlation == 'kendall':
+        return rank_series(data), kendall_tau_b_tile, np.asarray, 'kendall'
+    
+    elif correlation == 'spearman':
+        return np.asarray(data, dtype=np.float64), standardized_pearson_tile, standardized_ranks, 'pearson'
+    
+    raise ValueError("correlation must be one of {0}, not {1}".format(CORRELATIONS, correlation))
+
+
+def stack_locations(dataArray, dim='time', coordinate_names = {'lat':'lat', 'lon':'lon'}):
+    
+    '''
+    Function description:
+    
+        Stacks the dataArray into a (dim x locations) numpy array.
+        
+        The locations are ordered as in the pixel loop of 
+        "get_correlation_for_each_pixel" (i.e.: longitude first, then latitude), 
+        so that location k corresponds to 
+        (lon[k // n_lat], lat[k % n_lat]).
+    
+    '''
+    
+    stacked = dataArray.transpose(dim, coordinate_names['lon'], coordinate_names['lat'])
+    
+    return np.asarray(stacked.values).reshape(stacked.shape[0], -1)
+
+
+def get_pair_mask(dataArray, coordinate_names = {'lat':'lat', 'lon':'lon'}, 
+                  region=None, region_pairs=None, min_distance_km=None):
+    
+    '''
+    Function description:
+    
+        Builds the mask of the allowed pairs of locations, in the order of 
+        "stack_locations":
+            
+            region, region_pairs: see utils.Region_pair_mask.from_regions
+            
+            min_distance_km: the pairs closer than this great-circle 
+                             distance are excluded (see 
+                             utils.Distance_pair_mask)
+        
+        Returns None if all pairs are allowed.
+    
+    '''
+    
+    lons = dataArray.coords[ coordinate_names['lon'] ].values
+    
+    lats = dataArray.coords[ coordinate_names['lat'] ].values
+    
+    lons, lats = np.repeat(lons, lats.size), np.tile(lats, lons.size)
+    
+    Distance_mask = None
+    
+    if min_distance_km is not None:
+        
+        Distance_mask = Distance_pair_mask(lons, lats, min_distance_km)
+    
+    return combine_pair_masks(Region_pair_mask.from_regions(lons, lats,
+                                                            region=region, 
+                                                            region_pairs=region_pairs,
+                                                            dims=[coordinate_names['lon'], coordinate_names['lat']],
+                                                            coordinate_names=coordinate_names),
+                              Distance_mask)
+
+
+def get_linepaths_gdf(origin_lon, origin_lat, partner_lon, partner_lat, correlation):
+    
+    '''
+    Function description:
+    
+        Builds the GeoDataFrame of the teleconnection Line paths 
+        (the same as the one returned by "get_correlation_for_each_pixel") 
+        from the coordinates of each pair of teleconnected points.
+        
+        All the LineStrings are built in a single vectorized call 
+        (see utils.linepaths_gdf).
+    
+    '''
+    
+    return linepaths_gdf(origin_lon, origin_lat, partner_lon, partner_lat, 
+                         {'Correlation':np.asarray(correlation)})
+
+
+def get_correlation_for_all_pixels(dataArray, 
+                                   coordinate_names = {'lat':'lat', 'lon':'lon'}, 
+                                   dim='time',
+                                   reference_block_size=256,
+                                   tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                                   verbose=True,
+                                   executor=None,
+                                   n_workers=None,
+                                   significance=False,
+                                   use_effective_sample_size=False,
+                                   fdr_alpha=None,
+                                   correlation='kendall',
+                                   lags=None,
+                                   region=None,
+                                   region_pairs=None,
+                                   min_distance_km=None):
+    
+    '''
+    Function Description:
+    
+        All-vs-all version of the pixel loop of "get_correlation_for_each_pixel".
+        
+        The dataArray is computed and ranked only once; the Kendall 
+        correlations are then evaluated for blocks of "reference_block_size" 
+        reference pixels at a time (see utils.row_block_min_correlation), 
+        keeping only the minimum correlation of each pixel and its partner.
+    
+    ------------------------------------------------------------------
+    
+    Parameters:
+        
+        dataArray (3D xarray-DataArray): the data to be analyzed
+        
+        coordinate_names (dict = {'lat':'lat', 'lon':'lon'}): see 
+                                                              get_teleconnection_line_path
+        
+        dim (string): the dimension to be reduced by the correlation
+        
+        reference_block_size (int): number of reference pixels per block
+        
+        tile_memory_budget (int): maximum number of bytes of a single 
+                                  correlation tile
+        
+        verbose (bool): prints the progress of each block
+        
+        executor (None, string or concurrent.futures.Executor): the backend 
+            that evaluates the blocks of reference pixels ('serial', 
+            'threads', 'processes' or 'distributed'; see 
+            utils.map_row_blocks). The results do not depend on the backend.
+        
+        n_workers (int = None): the number of workers of the executor
+        
+        significance (bool = False): if True, the p-value of the Kendall 
+                                     correlation of each pixel with its 
+                                     partner is also evaluated (normal 
+                                     approximation; see 
+                                     utils.teleconnection_significance)
+        
+        use_effective_sample_size (bool = False): corrects the number of 
+                                     samples for the lag-1 autocorrelation 
+                                     of both (ranked) series
+        
+        fdr_alpha (float = None): if given, Benjamini-Hochberg field 
+                                  significance at this false discovery rate
+        
+        correlation (string = 'kendall'): 'kendall' or 'spearman'. 
+                                          The 'spearman' ranks are reduced 
+                                          with BLAS matrix products, at about 
+                                          the cost of a Pearson correlation 
+                                          (its significance is the t-test of 
+                                          the ranks).
+        
+        lags (iterable of int = None): if given, each pixel is correlated 
+                                       with every other pixel shifted by each 
+                                       of these lags (a positive lag means 
+                                       that the partner lags behind the 
+                                       pixel), over the overlapping segment 
+                                       of both series (see 
+                                       utils.row_block_lagged_min_correlation).
+        
+        region, region_pairs (= None): restrict the analysis to the pairs of 
+                                       pixels inside a region, or linking 
+                                       pairs of regions (polygons, 
+                                       GeoDataFrames or boolean masks; see 
+                                       get_pair_mask). The tiles without 
+                                       any allowed pair are skipped before 
+                                       any correlation is evaluated.
+        
+        min_distance_km (float = None): excludes the pairs of pixels closer 
+                                       than this great-circle distance (see 
+                                       get_pair_mask)
+    
+    ------------------------------------------------------------------
+    
+    Returns:
+        
+        Teleconnection (1D array): the minimum correlation of each pixel
+        
+        partner_index (1D array of int): the index of the teleconnected pixel 
+                                         of each pixel (-1 if there is none)
+        
+        best_lag (1D array of int): only if lags are given. The lag of the 
+                                    correlation of each pixel with its partner.
+        
+        Significance (dict): only if significance is True. The 'p_value' 
+                             (and 'q_value', 'significant') of each pixel.
+        
+        All arrays are ordered as in "stack_locations".
+        
+    '''
+    
+    with stage('reshape') as Reshape:
+        
+        stacked = stack_locations(dataArray, dim, coordinate_names)
+        
+        Reshape.add_bytes(stacked.nbytes)
+    
+    pair_mask = get_pair_mask(dataArray, coordinate_names, region=region, region_pairs=region_pairs, 
+                              min_distance_km=min_distance_km)
+    
+    if lags is None:
+        
+        with stage('prepare', nbytes=stacked.nbytes):
+            
+            ranks, correlation_tile, significance_method = _prepare_locations(stacked, correlation=correlation)
+        
+        block_function = partial(row_block_min_correlation, 
+                                 tile_memory_budget=tile_memory_budget,
+                                 correlation_tile=correlation_tile,
+                                 pair_mask=pair_mask)
+    
+    else:
+        
+        lags = [int(lag) for lag in lags]
+        
+        with stage('prepare', nbytes=stacked.nbytes):
+            
+            ranks, correlation_tile, prepare_segment, significance_method = _prepare_lagged_locations(stacked, 
+                                                                                                      correlation=correlation)
+        
+        block_function = partial(row_block_lagged_min_correlation, 
+                                 lags=lags,
+                                 tile_memory_budget=tile_memory_budget,
+                                 correlation_tile=correlation_tile,
+                                 prepare_segment=prepare_segment,
+                                 pair_mask=pair_mask)
+    
+    n_locations = ranks.shape[1]
+    
+    Teleconnection = np.full(n_locations, np.nan)
+    
+    partner_index = np.full(n_locations, -1, dtype=np.int64)
+    
+    best_lag = np.zeros(n_locations, dtype=np.int64)
+    
+    blocks = list(iter_tiles(n_locations, reference_block_size))
+    
+    with stage('correlation', nbytes=ranks.nbytes):
+        
+        results = map_row_blocks(block_function, ranks, blocks, executor=executor, n_workers=n_workers)
+        
+        for rows, result in zip(blocks, results):
+            
+            Teleconnection[rows], partner_index[rows] = result[:2]
+            
+            if lags is not None:
+                best_lag[rows] = result[2]
+            
+            if verbose:
+                print('pixels {0} to {1} of {2}'.format(rows.start, rows.stop, n_locations), '\n')
+    
+    outputs = (Teleconnection, partner_index) if lags is None else (Teleconnection, partner_index, best_lag)
+    
+    if significance:
+        
+        with stage('significance'):
+            
+            Significance = teleconnection_significance(Teleconnection, partner_index, ranks,
+                                                       method=significance_method,
+                                                       use_effective_sample_size=use_effective_sample_size,
+                                                       fdr_alpha=fdr_alpha,
+                                                       n_samples=ranks.shape[0] - np.abs(best_lag))
+        
+        return outputs + (Significance,)
+    
+    return outputs
+
+
+def get_partners_for_all_pixels(dataArray, k=5, positive=False,
+                                coordinate_names = {'lat':'lat', 'lon':'lon'}, 
+                                dim='time',
+                                reference_block_size=256,
+                                tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                                make_gdf=True,
+                                executor=None,
+                                n_workers=None,
+                                correlation='kendall'):
+    
+    '''
+    Function Description:
+    
+        Evaluates, for each pixel, its k most negative Kendall (or Spearman) 
+        correlations 
+        (and optionally its k most positive ones) and the respective partner 
+        pixels, through a streaming top-k selection over the correlation 
+        tiles (O(N * k) memory).
+    
+    ------------------------------------------------------------------
+    
+    Parameters:
+        
+        k (int = 5): the number of partners per pixel
+        
+        positive (bool = False): if True, the k most positive partners are 
+                                 also evaluated
+        
+        make_gdf (bool = True): if True, the GeoDataFrame of the k line 
+                                paths per pixel is also returned
+        
+        For the remaining parameters (i.e.: executor, n_workers, correlation), 
+        see get_correlation_for_all_pixels
+    
+    ------------------------------------------------------------------
+    
+    Returns:
+        
+        Partners (dict): for each sign ('negative', and 'positive' if 
+                         requested) a tuple (correlation, partner_index) of 
+                         (pixels x k) arrays, ordered as in "stack_locations". 
+                         Column 0 is the strongest partner.
+        
+        Partners_Linepaths_gdf (GeoDataFrame or None): the line paths 
+                                                       with the 'rank' and 
+                                                       'sign' of each partner.
+        
+    '''
+    
+    ranks, correlation_tile, _ = _prepare_locations(stack_locations(dataArray, dim, coordinate_names),
+                                                    correlation=correlation)
+    
+    n_locations = ranks.shape[1]
+    
+    signs = ['negative', 'positive'] if positive else ['negative']
+    
+    Partners = {}
+    
+    for sign in signs:
         
+        blocks = list(iter_tiles(n_locations, reference_block_size))
+        
+        block_function = partial(row_block_topk_correlation, 
+                                 k=k,
+                                 largest=(sign == 'positive'),
+                                 tile_memory_budget=tile_memory_budget,
+                                 correlation_tile=correlation_tile)
+        
+        results = map_row_blocks(block_function, ranks, blocks, executor=executor, n_workers=n_workers)
+        
+        correlation = np.concatenate([result[0] for result in results])
+        
+        partner_index = np.concatenate([result[1] for result in results])
+        
+        Partners[sign] = (correlation, partner_index)
+    
+    if not make_gdf:
+        
+        return Partners, None
+    
+    lons = dataArray.coords[ coordinate_names['lon'] ].values
+    
+    lats = dataArray.coords[ coordinate_names['lat'] ].values
+    
+    Partners_Linepaths_gdf = []
+    
+    for sign, (correlation, partner_index) in Partners.items():
+        
+        origin, rank = np.nonzero(partner_index >= 0)
+        
+        to_point = partner_index[origin, rank]
+        
+        origin_lon_idx, origin_lat_idx = np.unravel_index(origin, (lons.size, lats.size))
+        
+        partner_lon_idx, partner_lat_idx = np.unravel_index(to_point, (lons.size, lats.size))
+        
+        gdf = get_linepaths_gdf(lons[origin_lon_idx], lats[origin_lat_idx],
+                                lons[partner_lon_idx], lats[partner_lat_idx],
+                                correlation[origin, rank])
+        
+        gdf['rank'] = rank
+        
+        gdf['sign'] = sign
+        
+        Partners_Linepaths_gdf.append(gdf)
+    
+    Partners_Linepaths_gdf = gpd.GeoDataFrame(pd.concat(Partners_Linepaths_gdf, ignore_index=True))
+    
+    return Partners, Partners_Linepaths_gdf
+
+
+def _get_all_pairs_outputs(dataSet, variable, coordinate_names, Teleconnection, partner_index, 
+                           Columns={}):
+    
+    # rebuilds the outputs of the pixel loop (dsx, Teleconnection_Linepaths_gdf)
+    # from the all-pairs results. The other O(N) results (i.e.: Significance, 
+    # lag), if any, are added as columns of the line paths.
+    
+    lons = dataSet.coords[ coordinate_names['lon'] ].values
+    
+    lats = dataSet.coords[ coordinate_names['lat'] ].values
+    
+    lon_idx, lat_idx = np.unravel_index(np.arange(Teleconnection.size), (lons.size, lats.size))
+    
+    dsx = []
+    
+    with stage('pixel_datasets'):
+        
+        for k, (i, j) in enumerate(zip(lon_idx, lat_idx)):
+            
+            x = dataSet.isel({coordinate_names['lon']:i, coordinate_names['lat']:j})
+            
+            x[variable] = np.abs(Teleconnection[k])
+            
+            dsx.append(x)
+    
+    has_partner = partner_index >= 0
+    
+    partner_lon_idx, partner_lat_idx = np.unravel_index(partner_index[has_partner], (lons.size, lats.size))
+    
+    with stage('geometry'):
+        
+        Teleconnection_Linepaths_gdf = get_linepaths_gdf(lons[lon_idx[has_partner]], 
+                                                         lats[lat_idx[has_partner]],
+                                                         lons[partner_lon_idx], 
+                                                         lats[partner_lat_idx],
+                                                         np.abs(Teleconnection[has_partner]))
+    
+    for name, values in Columns.items():
+        
+        Teleconnection_Linepaths_gdf[name] = values[has_partner]
+    
+    return dsx, Teleconnection_Linepaths_gdf
+
+
 counter = 0
 
 def get_correlation_for_each_pixel(dataSet, variable='air', 
@@ -323,6 +1000,19 @@ def get_correlation_for_each_pixel(dataSet, variable='air',
                                    dim='time',
                                    see_progressBar=False, 
                                    verbose=True, 
+                                   engine='vectorized',
+                                   mode='per_pixel',
+                                   reference_block_size=256,
+                                   executor=None,
+                                   n_workers=None,
+                                   significance=False,
+                                   use_effective_sample_size=False,
+                                   fdr_alpha=None,
+                                   correlation='kendall',
+                                   lags=None,
+                                   region=None,
+                                   region_pairs=None,
+                                   min_distance_km=None,
                                    make_partial_plots={'condition':False,
                                                        'figure_base_path_save':r'C:\Users\lealp\Downloads\temp\imagens'}
                                    
@@ -342,6 +1032,55 @@ def get_correlation_for_each_pixel(dataSet, variable='air',
     Parameters:
         ds_chunked
         
+        engine (string = 'vectorized'): the Kendall correlation engine 
+                                        (see get_correlation_for_x_pixel). 
+                                        For the 'vectorized' engine, the 
+                                        dataArray is ranked only once.
+        
+        mode (string = 'per_pixel'): 
+            
+            'per_pixel': evaluates one correlation map per pixel (one dask 
+                         graph per pixel). It allows the partial plots.
+            
+            'all_pairs': evaluates the correlations in blocks of 
+                         "reference_block_size" reference pixels 
+                         (see get_correlation_for_all_pixels). It returns 
+                         the same outputs, but the partial plots are 
+                         not available.
+        
+        reference_block_size (int = 256): number of reference pixels per block
+                                          (only used in the 'all_pairs' mode)
+        
+        executor (None, string or concurrent.futures.Executor): the backend 
+                                          that spreads the blocks of reference 
+                                          pixels across cores (only used in 
+                                          the 'all_pairs' mode; see 
+                                          get_correlation_for_all_pixels)
+        
+        n_workers (int = None): the number of workers of the executor
+        
+        significance, use_effective_sample_size, fdr_alpha: adds the 
+                                          'p_value' (and 'q_value', 
+                                          'significant') columns to the line 
+                                          paths (only in the 'all_pairs' 
+                                          mode; see 
+                                          get_correlation_for_all_pixels)
+        
+        correlation (string = 'kendall'): 'kendall' or 'spearman' 
+                                          (see get_correlation_for_x_pixel 
+                                          and get_correlation_for_all_pixels)
+        
+        lags (iterable of int = None): the lags of the correlations, whose 
+                                          best value is added as the 'lag' 
+                                          column of the line paths (only in 
+                                          the 'all_pairs' mode; see 
+                                          get_correlation_for_all_pixels)
+        
+        region, region_pairs, min_distance_km (= None): the region and 
+                                          distance filters of the pairs of 
+                                          pixels (only in the 'all_pairs' 
+                                          mode; see get_pair_mask)
+        
         
     ------------------------------------------------------------------
     
@@ -352,10 +1091,82 @@ def get_correlation_for_each_pixel(dataSet, variable='air',
     
     global counter
     
-    Teleconnection_Linepaths_gdf =  gpd.GeoDataFrame()
+    if mode == 'all_pairs':
+        
+        if make_partial_plots['condition'] == True:
+            raise ValueError("make_partial_plots is not available in the 'all_pairs' mode")
+        
+        results = get_correlation_for_all_pixels(dataSet[variable], 
+                                                 coordinate_names=coordinate_names, 
+                                                 dim=dim,
+                                                 reference_block_size=reference_block_size,
+                                                 verbose=verbose,
+                                                 executor=executor,
+                                                 n_workers=n_workers,
+                                                 significance=significance,
+                                                 use_effective_sample_size=use_effective_sample_size,
+                                                 fdr_alpha=fdr_alpha,
+                                                 correlation=correlation,
+                                                 lags=lags,
+                                                 region=region,
+                                                 region_pairs=region_pairs,
+                                                 min_distance_km=min_distance_km)
+        
+        Columns = dict(results[-1]) if significance else {}
+        
+        if lags is not None:
+            Columns['lag'] = results[2]
+        
+        return _get_all_pairs_outputs(dataSet, variable, coordinate_names, 
+                                      results[0], results[1], Columns)
+    
+    elif mode != 'per_pixel':
+        
+        raise ValueError("mode must be one of 'per_pixel' or 'all_pairs', not {0}".format(mode))
+    
+    elif executor is not None:
+        
+        raise ValueError("the executor is only available in the 'all_pairs' mode")
+    
+    elif significance:
+        
+        raise ValueError("the significance is only available in the 'all_pairs' mode")
+    
+    elif lags is not None:
+        
+        raise ValueError("the lagged correlation is only available in the 'all_pairs' mode")
+    
+    elif region is not None or region_pairs is not None or min_distance_km is not None:
+        
+        raise ValueError("the region and distance filters are only available in the 'all_pairs' mode")
     
     dataArray=dataSet[variable]
     
+    # the reference series of each pixel (the outputs are still built from 
+    # the dataSet, with all its variables and coordinates)
+    References = dataSet
+    
+    if engine == 'vectorized':
+        
+        # ranked (and persisted) once: each correlation map then reuses the 
+        # ranks of both the reference pixel and the dataArray
+        with stage('rank', nbytes=dataArray.nbytes):
+            
+            dataArray = rank_along_dim(dataArray, dim=dim, standardize=correlation == 'spearman')
+        
+        References = dataArray.to_dataset(name=variable)
+    
+    # columnar buffers of the teleconnection line paths,
+    # preallocated for (at most) one path per pixel
+    
+    n_pixels = dataSet.coords[ coordinate_names['lon'] ].size * dataSet.coords[ coordinate_names['lat'] ].size
+    
+    Linepath_buffers = {column:np.full(n_pixels, np.nan) for column in ['origin_lon', 'origin_lat', 
+                                                                      'partner_lon', 'partner_lat',
+                                                                      'Correlation']}
+    
+    n_paths = 0
+    
     dsx = []
     for lon in dataSet.coords[ coordinate_names['lon'] ].values:
         for lat in dataSet.coords[ coordinate_names['lat']   ].values:
@@ -363,28 +1174,51 @@ def get_correlation_for_each_pixel(dataSet, variable='air',
             
             x = dataSet.sel({coordinate_names['lon']:lon, coordinate_names['lat'] :lat})
             
+            reference = References.sel({coordinate_names['lon']:lon, coordinate_names['lat'] :lat})
+            
             
             # evaluating the Teleconnection map relative to Point x:
             
-            r_correlation_map = get_correlation_for_x_pixel(x=x , 
-                                                            dataArray=dataArray, 
-                                                            dim=dim,
-                                                            see_progressBar=see_progressBar)
+            with stage('pixel_correlation', nbytes=dataArray.nbytes):
+                
+                r_correlation_map = get_correlation_for_x_pixel(x=reference , 
+                                                                dataArray=dataArray, 
+                                                                dim=dim,
+                                                                see_progressBar=see_progressBar,
+                                                                engine=engine,
+                                                                correlation=correlation,
+                                                                ranked=engine == 'vectorized')
             
             
             # getting teleconnections pathways around the globe:
             
-            GS = get_teleconnection_line_path(r_correlation_map, 
-                                              x, 
-                                              variable=variable,
-                                              coordinate_names =coordinate_names)
+            with stage('idxmin'):
+                
+                P = get_teleconnection_point(r_correlation_map, 
+                                             variable=variable,
+                                             coordinate_names =coordinate_names)
+            
+            if P is not None:
+                
+                Linepath_buffers['origin_lon'][n_paths] = lon
+                Linepath_buffers['origin_lat'][n_paths] = lat
+                Linepath_buffers['partner_lon'][n_paths] = P[coordinate_names['lon']].values.ravel()[0]
+                Linepath_buffers['partner_lat'][n_paths] = P[coordinate_names['lat']].values.ravel()[0]
+                Linepath_buffers['Correlation'][n_paths] = np.abs(P.values.ravel()[0])
+                
+                n_paths += 1
             
             if make_partial_plots['condition'] == True:
                 
                 fig, ax = plt.subplots()
                 r_correlation_map[variable].plot(ax=ax, cmap='viridis')
                 
-                GS.plot(ax=ax, color='k', linestyle='--')
+                if P is not None:
+                    
+                    GS = get_linepaths_gdf(*[Linepath_buffers[column][n_paths - 1: n_paths] 
+                                             for column in Linepath_buffers])
+                    
+                    GS.plot(ax=ax, color='k', linestyle='--')
                 
                 fig.suptitle('Teleconnection Map')
                 
@@ -420,11 +1254,13 @@ def get_correlation_for_each_pixel(dataSet, variable='air',
             
             x[variable] = Teleconnection_value
             
-                        
-            Teleconnection_Linepaths_gdf = Teleconnection_Linepaths_gdf.append(GS, ignore_index=True)
-     
             dsx.append(x)
     
+    with stage('geometry'):
+        
+        Teleconnection_Linepaths_gdf = get_linepaths_gdf(*[Linepath_buffers[column][:n_paths] 
+                                                           for column in Linepath_buffers])
+    
     return dsx, Teleconnection_Linepaths_gdf
 
 
@@ -1 +1,26 @@
-from .netcdf_gdf_setter import Base_class_space_time_netcdf_gdf
\ No newline at end of file
+from .netcdf_gdf_setter import Base_class_space_time_netcdf_gdf
+from .tiled_correlation import (tiled_min_correlation, row_block_min_correlation, 
+                                tiled_topk_correlation, row_block_topk_correlation,
+                                iter_tiles, get_tile_size, pearson_tile,
+                                standardize_series, standardized_pearson_tile,
+                                chain_tile_callbacks, lag_segments,
+                                tiled_lagged_min_correlation, row_block_lagged_min_correlation,
+                                DEFAULT_TILE_MEMORY_BUDGET)
+from .rank_correlation import rank_series, kendall_tau_b_tile, fit_kendall_tile, standardized_ranks
+from .executors import map_row_blocks, EXECUTORS
+from .correlation_store import Correlation_store
+from .result_cache import Result_cache, hash_dataarray, DEFAULT_CACHE_DIR, CACHE_FORMAT_VERSION
+from .significance import (teleconnection_significance, pearson_p_value, kendall_p_value,
+                           effective_sample_size, lag1_autocorrelation, benjamini_hochberg,
+                           sidak_p_value)
+from .sparse_output import Sparse_threshold_collector
+from .streaming_statistics import Streaming_correlation_statistics
+from .pair_masks import (Region_pair_mask, Distance_pair_mask, region_membership, 
+                         combine_pair_masks, EARTH_RADIUS_KM)
+from .multiresolution import area_weighted_coarsen, refine_candidates, pyramid_min_correlation
+from .accuracy import teleconnection_accuracy
+from .ann_search import Random_projection_forest, approximate_min_correlation
+from .low_rank import randomized_svd, low_rank_min_correlation
+from .synthetic import planted_dipole_dataset, planted_partner_recall
+from .instrumentation import stage, profile, Profiler, register_callback, unregister_callback
+from .linepaths import linepaths_gdf
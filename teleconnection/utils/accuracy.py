@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy of approximate teleconnection results against the exact ones.
+"""
+
+import numpy as np
+
+
+def teleconnection_accuracy(Teleconnection, partner_index,
+                            reference_Teleconnection, reference_partner_index,
+                            tolerance=0.01):
+
+    '''
+    Function description:
+
+        Compares an approximate result (i.e.: of the pyramid search) with the
+        exact (exhaustive) one, over the locations with an exact partner.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        Teleconnection, partner_index (1D arrays): the approximate result
+
+        reference_Teleconnection, reference_partner_index (1D arrays): the
+                                                                exact result
+
+        tolerance (float = 0.01): the absolute correlation difference under
+                                  which a Teleconnection is counted as found
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        dict with:
+
+            'n_locations': the number of compared locations
+
+            'partner_recall': the fraction of locations whose exact partner
+                              was found
+
+            'within_tolerance': the fraction of locations whose Teleconnection
+                                is within "tolerance" of the exact one
+
+            'mean_absolute_error', 'max_absolute_error': of the Teleconnection
+                                                         (NaN counts as the
+                                                         largest error, 2)
+
+    '''
+
+    Teleconnection = np.asarray(Teleconnection, dtype=np.float64)
+
+    partner_index = np.asarray(partner_index)
+
+    reference_Teleconnection = np.asarray(reference_Teleconnection, dtype=np.float64)
+
+    reference_partner_index = np.asarray(reference_partner_index)
+
+    compared = reference_partner_index >= 0
+
+    n_locations = int(compared.sum())
+
+    if n_locations == 0:
+
+        return {'n_locations':0, 'partner_recall':np.nan, 'within_tolerance':np.nan,
+                'mean_absolute_error':np.nan, 'max_absolute_error':np.nan}
+
+    error = np.abs(Teleconnection[compared] - reference_Teleconnection[compared])
+
+    error = np.where(np.isnan(error), 2.0, error)
+
+    return {'n_locations':n_locations,
+            'partner_recall':float(np.mean(partner_index[compared] == reference_partner_index[compared])),
+            'within_tolerance':float(np.mean(error <= tolerance)),
+            'mean_absolute_error':float(error.mean()),
+            'max_absolute_error':float(error.max())}
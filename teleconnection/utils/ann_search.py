@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Approximate (sub-quadratic) search of the most negatively correlated partner.
+
+After standardization (zero mean and unit norm, see
+utils.standardize_series), the Pearson correlation of two locations is the
+dot product of their series, and their squared Euclidean distance is
+2 - 2 * correlation. The most negatively correlated partner of a location
+is therefore the nearest neighbour of its negated series.
+
+The nearest neighbours are searched with a forest of random projection
+trees: each tree recursively splits the locations by the hyperplane that
+bisects two of them (at the median of their projections), down to leaves
+of at most "leaf_size" locations. Each negated series descends every tree,
+and is only correlated with the locations of the leaves it falls in (one
+BLAS product per leaf). The cost is O(N * n_trees * leaf_size) correlations,
+instead of the O(N**2) of the exhaustive search.
+"""
+
+import numpy as np
+
+
+class Random_projection_forest(object):
+
+    def __init__(self, Z, n_trees=8, leaf_size=64, seed=None):
+
+        '''
+        Class description:
+        ------------------
+
+            Forest of random projection trees over the standardized series of
+            each location (see the module description).
+
+            More trees (or larger leaves) raise the recall of the exact
+            partners, at a proportional cost.
+
+            The series with NaN values (i.e.: constant series, or masked
+            locations) are not indexed, and never become partners.
+
+
+        Attributes:
+
+            Z (2D array):
+            -------------
+
+                (time x locations) standardized series
+                (see utils.standardize_series)
+
+
+            n_trees (int = 8):
+            ------------------
+
+                the number of trees of the forest
+
+
+            leaf_size (int = 64):
+            ---------------------
+
+                the maximum number of locations of each leaf
+
+
+            seed (int = None):
+            ------------------
+
+                the seed of the random splits (for reproducible results)
+
+        '''
+
+        self.points = np.ascontiguousarray(np.asarray(Z).T)
+
+        self.n_locations = self.points.shape[0]
+
+        self.valid = np.flatnonzero(~np.isnan(self.points).any(axis=1))
+
+        self.n_trees = n_trees
+
+        self.leaf_size = max(int(leaf_size), 1)
+
+        self._random = np.random.default_rng(seed)
+
+        self.trees = [self._build_tree() for tree in range(n_trees)]
+
+    def _split(self, members):
+
+        # the hyperplane that bisects two random members, at the median of
+        # the projections (balanced children). None if the members cannot
+        # be split (i.e.: repeated series)
+
+        a, b = self._random.choice(members, size=2, replace=False)
+
+        direction = self.points[a] - self.points[b]
+
+        projections = self.points[members] @ direction
+
+        threshold = np.median(projections)
+
+        left = projections <= threshold
+
+        if left.all():
+
+            # ties at the median: the strict side
+            left = projections < threshold
+
+        if left.all() or not left.any():
+            return None
+
+        return direction, threshold, left
+
+    def _build_tree(self):
+
+        # the nodes are stored in flat arrays: the internal nodes have a
+        # direction, a threshold and two children; the leaves (leaf >= 0)
+        # point to their members
+
+        directions, thresholds, children, leaves = [], [], [], []
+
+        stack = [(0, self.valid)]
+
+        n_nodes = 1
+
+        node_entries = {}
+
+        while stack:
+
+            node, members = stack.pop()
+
+            split = None
+
+            if members.size > self.leaf_size:
+                split = self._split(members)
+
+            if split is None:
+
+                node_entries[node] = (-1, len(leaves))
+
+                leaves.append(members)
+
+                continue
+
+            direction, threshold, left = split
+
+            node_entries[node] = (len(directions), -1)
+
+            directions.append(direction)
+
+            thresholds.append(threshold)
+
+            children.append((n_nodes, n_nodes + 1))
+
+            stack.append((n_nodes, members[left]))
+
+            stack.append((n_nodes + 1, members[~left]))
+
+            n_nodes += 2
+
+        split_of_node = np.array([node_entries[node][0] for node in range(n_nodes)])
+
+        leaf_of_node = np.array([node_entries[node][1] for node in range(n_nodes)])
+
+        n_time = self.points.shape[1]
+
+        return {'split_of_node':split_of_node,
+                'leaf_of_node':leaf_of_node,
+                'directions':np.array(directions).reshape(-1, n_time),
+                'thresholds':np.array(thresholds),
+                'children':np.array(children, dtype=np.int64).reshape(-1, 2),
+                'leaves':leaves}
+
+    def _descend(self, tree, queries):
+
+        # the leaf of each query (all the queries descend together, one
+        # level per iteration)
+
+        node = np.zeros(queries.shape[0], dtype=np.int64)
+
+        split = tree['split_of_node'][node]
+
+        active = np.flatnonzero(split >= 0)
+
+        while active.size:
+
+            projections = np.einsum('ij,ij->i', queries[active], tree['directions'][split[active]])
+
+            side = (projections > tree['thresholds'][split[active]]).astype(np.int64)
+
+            node[active] = tree['children'][split[active], side]
+
+            split = tree['split_of_node'][node]
+
+            active = np.flatnonzero(split >= 0)
+
+        return tree['leaf_of_node'][node]
+
+    def min_correlation(self):
+
+        '''
+        Function description:
+
+            Evaluates the (approximate) minimum correlation of each location
+            and its partner: the minimum over the locations of the leaves
+            reached by its negated series, in every tree.
+
+            Each leaf tile is symmetric, so that it also updates the partners
+            of the leaf members (with the locations whose negated series fell
+            in the leaf).
+
+        ------------------------------------------------------------------
+
+        Returns:
+
+            Teleconnection (1D array): NaN for the series that are not indexed
+
+            partner_index (1D array of int): -1 for the series that are not
+                                             indexed
+
+        '''
+
+        running_min = np.full(self.n_locations, np.inf)
+
+        running_arg = np.full(self.n_locations, -1, dtype=np.int64)
+
+        queries = -self.points[self.valid]
+
+        for tree in self.trees:
+
+            query_leaf = self._descend(tree, queries)
+
+            order = np.argsort(query_leaf, kind='stable')
+
+            bounds = np.searchsorted(query_leaf[order], np.arange(len(tree['leaves']) + 1))
+
+            for leaf, members in enumerate(tree['leaves']):
+
+                rows = self.valid[order[bounds[leaf]:bounds[leaf + 1]]]
+
+                if rows.size == 0 or members.size == 0:
+                    continue
+
+                tile = np.clip(self.points[rows] @ self.points[members].T, -1, 1)
+
+                # no self-pairs
+                tile[rows[:, None] == members[None, :]] = np.inf
+
+                _update_candidates(running_min, running_arg, rows, members, tile)
+
+                _update_candidates(running_min, running_arg, members, rows, tile.T)
+
+        Teleconnection = np.where(np.isinf(running_min), np.nan, running_min)
+
+        return Teleconnection, running_arg
+
+
+def _update_candidates(running_min, running_arg, rows, columns, tile):
+
+    # as utils.tiled_correlation._update_running_min, for arbitrary
+    # (index arrays of) rows and columns
+
+    local_arg = np.argmin(tile, axis=1)
+
+    local_min = tile[np.arange(tile.shape[0]), local_arg]
+
+    better = local_min < running_min[rows]
+
+    running_min[rows] = np.where(better, local_min, running_min[rows])
+
+    running_arg[rows] = np.where(better, columns[local_arg], running_arg[rows])
+
+
+def approximate_min_correlation(Z, n_trees=8, leaf_size=64, seed=None):
+
+    '''
+    Function description:
+
+        Approximate version of utils.tiled_min_correlation, through a forest
+        of random projection trees (see Random_projection_forest).
+
+        The returned Teleconnection of a location is always a true
+        correlation, higher or equal to the exact minimum (equal whenever its
+        exact partner is found).
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        Z (2D array): (time x locations) standardized series
+                      (see utils.standardize_series)
+
+        n_trees (int = 8), leaf_size (int = 64): the recall/speed knobs of
+                      the search: each location is correlated with at most
+                      2 * n_trees * leaf_size locations
+
+        seed (int = None): the seed of the random splits
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        Teleconnection (1D array), partner_index (1D array of int)
+
+    '''
+
+    return Random_projection_forest(Z, n_trees=n_trees, leaf_size=leaf_size, seed=seed).min_correlation()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent, memory-mapped store of a (locations x locations) correlation
+matrix.
+
+The store is a directory with:
+
+    correlation.npy: the (N x N) correlation matrix (memory-mapped .npy)
+
+    coords.npz: the coordinates of each location dimension (i.e.: lat, lon)
+
+Rows are read lazily from the memory-mapped file, so that the correlation
+map of a single location (or of a block of locations) can be queried
+without loading the whole matrix.
+"""
+
+import os
+
+import numpy as np
+import xarray as xr
+
+
+class Correlation_store(object):
+
+    CORRELATION_FILE = 'correlation.npy'
+
+    COORDS_FILE = 'coords.npz'
+
+    def __init__(self, path, mode='r'):
+
+        '''
+        Class description:
+        ------------------
+
+            Opens an existing correlation store (see Correlation_store.create).
+
+
+        Attributes:
+
+            path (str):
+            -----------
+
+                the directory of the store
+
+
+            mode (str = 'r'):
+            -----------------
+
+                the numpy.memmap mode of the correlation matrix
+                ('r' read-only, 'r+' read and write)
+
+        '''
+
+        self.path = path
+
+        self.correlation = np.load(os.path.join(path, self.CORRELATION_FILE), mmap_mode=mode)
+
+        with np.load(os.path.join(path, self.COORDS_FILE), allow_pickle=False) as coords_file:
+
+            self.dims = [str(x) for x in coords_file['__dims__']]
+
+            self.coords = {x:coords_file[x] for x in self.dims}
+
+        self.shape = tuple(self.coords[x].size for x in self.dims)
+
+    @ classmethod
+    def create(cls, path, coords, dims, dtype=np.float32):
+
+        '''
+        Function description:
+
+            Creates an empty store for the locations given by the product of
+            the coordinates of "dims" (in C order, as flattened by
+            get_teleconnection_via_numpy).
+
+        ------------------------------------------------------------------
+
+        Parameters:
+
+            path (str): the directory of the store (created if needed)
+
+            coords (dict): the coordinate values of each dimension
+
+            dims (list of str): the location dimensions (i.e.: ['lat', 'lon'])
+
+            dtype (numpy dtype = float32): the dtype of the stored correlations
+
+        ------------------------------------------------------------------
+
+        Returns:
+
+            a writable Correlation_store
+
+        '''
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        n_locations = int(np.prod([np.size(coords[x]) for x in dims]))
+
+        correlation = np.lib.format.open_memmap(os.path.join(path, cls.CORRELATION_FILE),
+                                                mode='w+', dtype=dtype,
+                                                shape=(n_locations, n_locations))
+
+        # every entry is later written by the tiles (see write_tile)
+        del correlation
+
+        np.savez(os.path.join(path, cls.COORDS_FILE),
+                 __dims__=np.array(dims),
+                 **{x:np.asarray(coords[x]) for x in dims})
+
+        return cls(path, mode='r+')
+
+    @ property
+    def n_locations(self):
+
+        return self.correlation.shape[0]
+
+    def write_tile(self, rows, columns, tile):
+
+        '''
+        Writes a tile of the upper triangle (and its transpose, since the
+        correlation matrix is symmetric).
+        '''
+
+        self.correlation[rows, columns] = tile
+
+        if rows != columns:
+
+            self.correlation[columns, rows] = tile.T
+
+    def flush(self):
+
+        self.correlation.flush()
+
+    def location_index(self, **coordinates):
+
+        '''
+        Returns the flat index of the location nearest to the given
+        coordinates (i.e.: location_index(lat=-10, lon=300)).
+
+        The longitudes of the store are normalized to [-180, 180) (see
+        Base_class_space_time_netcdf_gdf): a coordinate outside of this
+        range is wrapped the same way (i.e.: lon=300 is lon=-60) whenever
+        the coordinates of its dimension lie inside it.
+        '''
+
+        positions = []
+
+        for x in self.dims:
+
+            values = self.coords[x]
+
+            value = coordinates[x]
+
+            if (-180 <= values.min() and values.max() < 180) and not (-180 <= value < 180):
+                value = ((value + 180) % 360) - 180
+
+            positions.append(int(np.abs(values - value).argmin()))
+
+        return int(np.ravel_multi_index(positions, self.shape))
+
+    def get_rows(self, locations):
+
+        '''
+        Returns the (len(locations) x N) correlations of the given flat
+        location indexes (or slice). Only these rows are read from disk.
+        '''
+
+        return np.array(self.correlation[locations])
+
+    def get_row(self, location):
+
+        return self.get_rows(location).ravel()
+
+    def get_row_map(self, location=None, **coordinates):
+
+        '''
+        Function description:
+
+            Returns the correlation map of a single location as a
+            xarray-DataArray over the location dimensions (i.e.: to re-plot
+            the Teleconnection map of one location).
+
+        ------------------------------------------------------------------
+
+        Parameters:
+
+            location (int = None): the flat index of the location
+
+            **coordinates: the coordinates of the location, used if no
+                           location index is given (see location_index)
+
+        '''
+
+        if location is None:
+            location = self.location_index(**coordinates)
+
+        row_map = xr.DataArray(self.get_row(location).reshape(self.shape),
+                               dims=self.dims,
+                               coords=self.coords,
+                               name='Correlation')
+
+        for x in self.dims:
+
+            row_map = row_map.sortby(x)
+
+        return row_map
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Execution backends for the blocks of reference pixels.
+
+Each block of reference pixels is independent from the others, so the
+blocks can be spread over a thread pool, a process pool or a local dask
+distributed cluster. The results are always returned in the order of the
+blocks, so that the outputs are deterministic whatever the backend.
+"""
+
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+import os
+
+
+EXECUTORS = ['serial', 'threads', 'processes', 'distributed']
+
+
+# the (time x locations) array of each worker process (see _init_worker)
+_shared_data = None
+
+
+def _init_worker(data):
+
+    global _shared_data
+
+    _shared_data = data
+
+
+def _call_with_shared_data(function, rows):
+
+    return function(_shared_data, rows)
+
+
+def map_row_blocks(function, data, blocks, executor=None, n_workers=None):
+
+    '''
+    Function description:
+
+        Applies function(data, rows) to each block of rows, using the
+        requested execution backend.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        function (callable): function(data, rows) evaluated for each block.
+                             It must be picklable (i.e.: a module level
+                             function or a functools.partial of it) for the
+                             'processes' and 'distributed' backends.
+
+        data (2D array): the (time x locations) array shared by all blocks.
+                         It is sent only once to each worker process.
+
+        blocks (iterable of slices): the blocks of reference rows
+
+        executor (None, string or concurrent.futures.Executor):
+
+            None or 'serial': evaluates the blocks one after the other
+
+            'threads': thread pool (numpy releases the GIL in its
+                       matrix products)
+
+            'processes': process pool
+
+            'distributed': local dask distributed cluster
+                           (requires the dask "distributed" package)
+
+            a concurrent.futures.Executor instance: used as is (it is
+            not shut down by this function)
+
+        n_workers (int = None): the number of workers
+                                (default: the number of cpus)
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        list with the result of each block, in the order of the blocks.
+
+    '''
+
+    blocks = list(blocks)
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    if executor is None or executor == 'serial':
+
+        return [function(data, rows) for rows in blocks]
+
+    elif isinstance(executor, Executor):
+
+        return list(executor.map(partial(function, data), blocks))
+
+    elif executor == 'threads':
+
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+
+            return list(pool.map(partial(function, data), blocks))
+
+    elif executor == 'processes':
+
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_worker,
+                                 initargs=(data,)) as pool:
+
+            return list(pool.map(partial(_call_with_shared_data, function), blocks))
+
+    elif executor == 'distributed':
+
+        try:
+            from dask.distributed import Client, LocalCluster
+
+        except ImportError:
+            raise ImportError("the 'distributed' executor requires the dask distributed package "
+                              "(pip install distributed)")
+
+        with LocalCluster(n_workers=n_workers, threads_per_worker=1, processes=True) as cluster:
+
+            with Client(cluster) as client:
+
+                data_future = client.scatter(data, broadcast=True)
+
+                futures = client.map(function, [data_future] * len(blocks), blocks, pure=False)
+
+                return client.gather(futures)
+
+    else:
+
+        raise ValueError("executor must be one of {0} or a concurrent.futures.Executor, "
+                         "not {1}".format(EXECUTORS, executor))
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing and memory instrumentation of the teleconnection pipelines.
+
+The pipelines mark their named stages (i.e.: 'normalization', 'reshape',
+'corrcoef', 'idxmin', 'geometry') with the stage context manager:
+
+    with stage('reshape', nbytes=data.nbytes):
+        ...
+
+Nothing is measured unless a recorder is active: the stage context manager
+then returns a shared no-op object (one function call and one list check
+per stage). The records are collected by a Profiler:
+
+    with profile() as Profiler:
+        main(ds)
+
+    Profiler.summary()          # dict: stage -> totals
+    Profiler.to_dataframe()     # one row per stage call
+
+or by any callable registered with register_callback (i.e.: a logger),
+which receives each record when its stage ends.
+
+Each record holds the stage name, its duration, the bytes it processed (if
+given), its nesting depth and the peak traced memory above its start (only
+if memory tracing is requested, through tracemalloc, which slows down the
+allocations while active; numpy reports its array buffers to it).
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+
+# the active recorders: callables that receive each record
+_recorders = []
+
+# the recorders that requested memory tracing: whether each one started
+# tracemalloc (keyed by id)
+_memory_tracing = {}
+
+# the open stages of each thread (nested stages)
+_local = threading.local()
+
+
+class _Null_stage(object):
+
+    # the (shared) stage returned while no recorder is active
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_bytes(self, nbytes):
+        pass
+
+
+_NULL_STAGE = _Null_stage()
+
+
+class _Stage(object):
+
+    def __init__(self, name, nbytes=None):
+
+        self.name = name
+
+        self.nbytes = nbytes
+
+    def add_bytes(self, nbytes):
+
+        # the bytes processed by the stage, if they are only known inside it
+
+        self.nbytes = (self.nbytes or 0) + int(nbytes)
+
+    def __enter__(self):
+
+        self._stack = getattr(_local, 'stack', None)
+
+        if self._stack is None:
+            self._stack = _local.stack = []
+
+        self.trace_memory = bool(_memory_tracing) and tracemalloc.is_tracing()
+
+        if self.trace_memory:
+
+            # the peak so far belongs to the enclosing stage
+            if self._stack:
+                self._stack[-1].peak = max(getattr(self._stack[-1], 'peak', 0), tracemalloc.get_traced_memory()[1])
+
+            tracemalloc.reset_peak()
+
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+
+            self.peak = self.memory_start
+
+        self.depth = len(self._stack)
+
+        self._stack.append(self)
+
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        seconds = time.perf_counter() - self.start
+
+        self._stack.pop()
+
+        peak_memory = None
+
+        if self.trace_memory:
+
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+
+            peak_memory = self.peak - self.memory_start
+
+            if self._stack:
+                self._stack[-1].peak = max(getattr(self._stack[-1], 'peak', 0), self.peak)
+
+        record = {'stage':self.name,
+                  'seconds':seconds,
+                  'bytes':self.nbytes,
+                  'peak_memory_bytes':peak_memory,
+                  'depth':self.depth,
+                  'failed':exc_info[0] is not None}
+
+        for recorder in list(_recorders):
+            recorder(record)
+
+        return False
+
+
+def stage(name, nbytes=None):
+
+    '''
+    Function description:
+
+        Context manager that marks a named stage of a pipeline.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        name (str): the name of the stage
+
+        nbytes (int = None): the bytes processed by the stage (i.e.: the size
+                             of its input). It can also be added inside the
+                             stage, with the add_bytes method of the returned
+                             object.
+
+    '''
+
+    if not _recorders:
+        return _NULL_STAGE
+
+    return _Stage(name, nbytes)
+
+
+def register_callback(callback, trace_memory=False):
+
+    '''
+    Function description:
+
+        Registers a callable, which receives the record (dict) of each stage
+        when it ends. If trace_memory is True, tracemalloc is started (if it
+        is not already), and the records hold the peak memory of each stage.
+
+    '''
+
+    _recorders.append(callback)
+
+    if trace_memory:
+
+        _memory_tracing[id(callback)] = not tracemalloc.is_tracing()
+
+        if _memory_tracing[id(callback)]:
+            tracemalloc.start()
+
+    return callback
+
+
+def unregister_callback(callback):
+
+    _recorders.remove(callback)
+
+    if _memory_tracing.pop(id(callback), False):
+        tracemalloc.stop()
+
+
+class Profiler(object):
+
+    def __init__(self):
+
+        '''
+        Class description:
+        ------------------
+
+            Recorder that collects the records of every stage (see the
+            module description and the profile context manager).
+
+
+        Attributes:
+
+            records (list of dicts):
+            ------------------------
+
+                one record per stage call, in the order in which the stages
+                ended (the nested stages end before their enclosing stage)
+
+        '''
+
+        self.records = []
+
+    def __call__(self, record):
+
+        self.records.append(record)
+
+    def to_dataframe(self):
+
+        return pd.DataFrame(self.records, columns=['stage', 'seconds', 'bytes', 'peak_memory_bytes',
+                                                   'depth', 'failed'])
+
+    def summary(self):
+
+        '''
+        Returns a dict with the totals of each stage (in order of first
+        appearance): the number of 'calls', the total 'seconds' and 'bytes',
+        and the largest 'peak_memory_bytes'.
+        '''
+
+        totals = {}
+
+        for record in self.records:
+
+            total = totals.setdefault(record['stage'], {'calls':0, 'seconds':0.0,
+                                                        'bytes':None, 'peak_memory_bytes':None})
+
+            total['calls'] += 1
+
+            total['seconds'] += record['seconds']
+
+            if record['bytes'] is not None:
+                total['bytes'] = (total['bytes'] or 0) + record['bytes']
+
+            if record['peak_memory_bytes'] is not None:
+                total['peak_memory_bytes'] = max(total['peak_memory_bytes'] or 0, record['peak_memory_bytes'])
+
+        return totals
+
+    def summary_dataframe(self):
+
+        return pd.DataFrame.from_dict(self.summary(), orient='index')
+
+
+@contextmanager
+def profile(trace_memory=False):
+
+    '''
+    Function description:
+
+        Context manager that records every stage run inside it, and returns
+        its Profiler:
+
+            with profile() as Profiler:
+                ...
+
+            Profiler.summary()
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        trace_memory (bool = False): if True, the peak memory of each stage
+                                     is traced (tracemalloc), at the cost of
+                                     slower allocations
+
+    '''
+
+    profiler = register_callback(Profiler(), trace_memory=trace_memory)
+
+    try:
+        yield profiler
+
+    finally:
+        unregister_callback(profiler)
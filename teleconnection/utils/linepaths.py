@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+The GeoDataFrame of the teleconnection line paths, shared by every entry
+point: one LineString per (origin, partner) pair of locations.
+"""
+
+import numpy as np
+import shapely
+import geopandas as gpd
+
+
+def linepaths_gdf(origin_lons, origin_lats, partner_lons, partner_lats, columns, crs=None, index=None):
+
+    '''
+    Function description:
+
+        Builds the GeoDataFrame of the LineStrings that link each origin to
+        its partner. All the LineStrings are built in a single vectorized
+        call (shapely.linestrings).
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        origin_lons, origin_lats (1D arrays): the coordinates of each origin
+
+        partner_lons, partner_lats (1D arrays): the coordinates of the
+                                                respective partners
+
+        columns (dict): the columns of the GeoDataFrame (i.e.: the
+                        correlation of each pair)
+
+        crs (= None): the crs of the GeoDataFrame
+
+        index (array = None): the index of the GeoDataFrame
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        geopandas GeoDataFrame (one row per pair)
+
+    '''
+
+    # (paths x 2 points x 2 coordinates)
+    coordinates = np.stack([np.stack([origin_lons, origin_lats], axis=-1),
+                            np.stack([partner_lons, partner_lats], axis=-1)],
+                           axis=1).astype(float)
+
+    return gpd.GeoDataFrame(columns,
+                            geometry=shapely.linestrings(coordinates.reshape(-1, 2, 2)),
+                            crs=crs,
+                            index=index)
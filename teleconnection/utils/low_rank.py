@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Low-rank (EOF/PCA) approximation of the correlation matrix.
+
+With the (time x locations) standardized series Z (see
+utils.standardize_series) and its truncated SVD Z ~ U S Vt (rank r), the
+correlation matrix Z.T @ Z is approximated by W.T @ W, with W = S Vt
+(r x locations). The rows of Vt are the EOF patterns, the columns of U S
+their principal components, and S**2 / N the fraction of the variance
+explained by each EOF.
+
+Only O(N * r) values are kept, and each correlation tile costs r (instead
+of T) multiply-adds per pair.
+"""
+
+import numpy as np
+import dask.array
+
+from .tiled_correlation import DEFAULT_TILE_MEMORY_BUDGET, tiled_min_correlation, standardized_pearson_tile
+
+
+def randomized_svd(Z, rank, oversampling=10, n_power_iterations=2, seed=None):
+
+    '''
+    Function description:
+
+        Truncated SVD of Z through a randomized range finder (Halko,
+        Martinsson and Tropp, 2011): Z is projected onto rank + oversampling
+        random directions, refined by power iterations, and the SVD is
+        evaluated for the (small) projected matrix only.
+
+        Dask arrays are decomposed with dask.array.linalg.svd_compressed
+        (the same algorithm, one block at a time).
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        Z (2D array): (time x locations) numpy or dask array (without NaN)
+
+        rank (int): the number of singular values/vectors kept
+
+        oversampling (int = 10): the extra random directions, which improve
+                                 the accuracy of the last singular vectors
+
+        n_power_iterations (int = 2): the number of power iterations (more
+                                      iterations are needed when the
+                                      singular values decay slowly)
+
+        seed (int = None): the seed of the random directions
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        U (2D array): (time x rank)
+
+        S (1D array): (rank) the singular values, in decreasing order
+
+        Vt (2D array): (rank x locations)
+
+    '''
+
+    rank = int(min(rank, *Z.shape))
+
+    if hasattr(Z, 'compute'):
+
+        U, S, Vt = dask.array.linalg.svd_compressed(Z, rank,
+                                                    n_power_iter=n_power_iterations,
+                                                    n_oversamples=oversampling,
+                                                    seed=seed)
+
+        return dask.compute(U, S, Vt)
+
+    n_components = min(rank + oversampling, *Z.shape)
+
+    random = np.random.default_rng(seed)
+
+    Q = np.linalg.qr(Z @ random.standard_normal((Z.shape[1], n_components)).astype(Z.dtype))[0]
+
+    for iteration in range(n_power_iterations):
+
+        # re-orthonormalized at each step, so that the small singular
+        # values are not lost to rounding
+        Q = np.linalg.qr(Z @ np.linalg.qr(Z.T @ Q)[0])[0]
+
+    U_small, S, Vt = np.linalg.svd(Q.T @ Z, full_matrices=False)
+
+    return (Q @ U_small)[:, :rank], S[:rank], Vt[:rank]
+
+
+def low_rank_min_correlation(Z, rank=20, oversampling=10, n_power_iterations=2, seed=None,
+                             tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET):
+
+    '''
+    Function description:
+
+        Evaluates the minimum correlation of each location and its partner
+        from the rank-r approximation of the correlation matrix (see the
+        module description), with the tiled reduction of the (r x locations)
+        matrix W = S Vt.
+
+        The approximated correlations are the covariances of the EOF-filtered
+        series: their magnitude is lower than the exact one by the fraction
+        of the variance of the locations that is not explained by the r EOFs.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        Z (2D array): (time x locations) standardized series
+                      (see utils.standardize_series). Its NaN series are
+                      excluded from the decomposition, and never become
+                      partners.
+
+        rank, oversampling, n_power_iterations, seed: see randomized_svd
+
+        tile_memory_budget (int): maximum number of bytes of each tile
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        Teleconnection (1D array), partner_index (1D array of int), and the
+        truncated SVD (U, S, Vt) of Z (the EOFs of the NaN series are NaN)
+
+    '''
+
+    if hasattr(Z, 'compute'):
+
+        valid = ~np.asarray(dask.array.isnan(Z).any(axis=0))
+
+        Z = dask.array.where(dask.array.isnan(Z), 0, Z)
+
+    else:
+
+        valid = ~np.isnan(Z).any(axis=0)
+
+        Z = np.where(valid, Z, 0)
+
+    U, S, Vt = randomized_svd(Z, rank, oversampling=oversampling,
+                              n_power_iterations=n_power_iterations, seed=seed)
+
+    Vt = np.where(valid, Vt, np.nan)
+
+    Teleconnection, partner_index = tiled_min_correlation(S[:, None] * Vt,
+                                                          tile_memory_budget=tile_memory_budget,
+                                                          correlation_tile=standardized_pearson_tile)
+
+    return Teleconnection, partner_index, (U, S, Vt)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Coarse-to-fine (pyramid) search of the teleconnection partners.
+
+The field is coarsened (area-weighted) several times. The candidate
+partners of each coarse cell are found exhaustively at the coarsest level
+only; at each finer level, the correlations are evaluated only between the
+children of a coarse cell and the children of the (neighbourhood of the)
+candidate partners of that cell.
+
+For a grid of N locations, the cost at each level is O(N * k * (2n + 1)**2
+* factor**2) correlations (k candidates, n neighbourhood cells), instead of
+the O(N**2) of the exhaustive search.
+"""
+
+import numpy as np
+
+from .tiled_correlation import DEFAULT_TILE_MEMORY_BUDGET, tiled_topk_correlation, standardized_pearson_tile
+
+
+def area_weighted_coarsen(dataArray, factor, dims, latitude_dimension='lat'):
+
+    '''
+    Function description:
+
+        Coarsens the dataArray by "factor" along each of "dims" (blocks of
+        factor x factor cells), weighting each cell by the cosine of its
+        latitude (i.e.: its area). Missing cells are ignored, and the
+        incomplete blocks at the edges are kept (padded).
+
+        It is lazy for dask-backed dataArrays.
+
+    '''
+
+    weights = np.cos(np.radians(dataArray[latitude_dimension])).where(dataArray.notnull())
+
+    windows = {x:factor for x in dims}
+
+    weighted_sum = (dataArray * weights).coarsen(windows, boundary='pad').sum()
+
+    total_weight = weights.coarsen(windows, boundary='pad').sum()
+
+    return weighted_sum / total_weight.where(total_weight > 0)
+
+
+def _children(cells, shape, parent_shape, factor):
+
+    # the flat (child-level) indexes of the children of the given flat
+    # parent cells: (... x factor**2), -1 for none (edges or -1 cells)
+
+    parent_row, parent_column = np.unravel_index(np.maximum(cells, 0), parent_shape)
+
+    offset_row, offset_column = np.divmod(np.arange(factor**2), factor)
+
+    row = parent_row[..., None] * factor + offset_row
+
+    column = parent_column[..., None] * factor + offset_column
+
+    valid = (row < shape[0]) & (column < shape[1]) & (cells[..., None] >= 0)
+
+    return np.where(valid, np.ravel_multi_index((np.minimum(row, shape[0] - 1),
+                                                 np.minimum(column, shape[1] - 1)), shape), -1)
+
+
+def _neighbourhood(cells, shape, neighbourhood):
+
+    # the flat indexes of the cells within "neighbourhood" cells (along
+    # each dimension) of the given flat cells: (... x (2n + 1)**2)
+
+    row, column = np.unravel_index(np.maximum(cells, 0), shape)
+
+    offsets = np.arange(-neighbourhood, neighbourhood + 1)
+
+    offset_row, offset_column = [x.ravel() for x in np.meshgrid(offsets, offsets, indexing='ij')]
+
+    row = row[..., None] + offset_row
+
+    column = column[..., None] + offset_column
+
+    valid = (row >= 0) & (row < shape[0]) & (column >= 0) & (column < shape[1]) & (cells[..., None] >= 0)
+
+    return np.where(valid, np.ravel_multi_index((np.clip(row, 0, shape[0] - 1),
+                                                 np.clip(column, 0, shape[1] - 1)), shape), -1)
+
+
+def _unique_rows(candidates):
+
+    # marks the repeated candidates of each row as -1
+
+    candidates = np.sort(candidates, axis=-1)
+
+    repeated = np.zeros(candidates.shape, dtype=bool)
+
+    repeated[..., 1:] = candidates[..., 1:] == candidates[..., :-1]
+
+    return np.where(repeated, -1, candidates)
+
+
+def refine_candidates(Z, shape, parent_shape, parent_candidates, factor=2, k=1, neighbourhood=1,
+                      tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET):
+
+    '''
+    Function description:
+
+        One step of the pyramid: evaluates the k most negative correlations
+        of each location of a level, among the children of the
+        neighbourhood of the candidate partners of its parent cell.
+
+        All the children of a same parent share its candidates, so that the
+        correlations of a parent are a single (children x candidates) tile;
+        the tiles of many parents are evaluated in batched matrix products.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        Z (2D array): (time x locations) standardized series of this level
+                      (see utils.standardize_series). It can be a numpy, a
+                      dask or a memory-mapped array: only the columns of each
+                      batch are loaded.
+
+        shape (tuple): the 2D grid shape of this level
+
+        parent_shape (tuple): the 2D grid shape of the coarser level
+
+        parent_candidates (2D array of int): (parent cells x candidates) the
+                                             candidate partners of each parent
+                                             cell (-1 for none)
+
+        factor (int): the coarsening factor between both levels
+
+        k (int): the number of candidates kept for each location
+
+        neighbourhood (int): the number of cells around each parent candidate
+                             whose children are also evaluated
+
+        tile_memory_budget (int): the maximum number of bytes of each batch
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        correlation (2D array): (locations x k) the most negative
+                                correlations (NaN if none)
+
+        partner_index (2D array of int): (locations x k) their partners
+                                         (-1 if none)
+
+    '''
+
+    n_time, n_locations = Z.shape
+
+    n_parents = parent_candidates.shape[0]
+
+    n_rows = factor**2
+
+    n_columns = parent_candidates.shape[1] * (2 * neighbourhood + 1)**2 * factor**2
+
+    # the loaded columns, their gathered copies and the tiles
+    batch_bytes = (2 * n_time * (n_rows + n_columns) + n_rows * n_columns) * Z.dtype.itemsize
+
+    batch_size = int(np.clip(tile_memory_budget // max(batch_bytes, 1), 1, n_parents))
+
+    correlation = np.full((n_locations, k), np.nan)
+
+    partner_index = np.full((n_locations, k), -1, dtype=np.int64)
+
+    n_kept = min(k, n_columns)
+
+    for start in range(0, n_parents, batch_size):
+
+        parents = np.arange(start, min(start + batch_size, n_parents))
+
+        batch_rows = _children(parents, shape, parent_shape, factor)
+
+        batch_columns = _neighbourhood(parent_candidates[parents], parent_shape, neighbourhood)
+
+        batch_columns = _children(batch_columns.reshape(parents.size, -1), shape, parent_shape, factor)
+
+        batch_columns = _unique_rows(batch_columns.reshape(parents.size, -1))
+
+        # only the columns of the batch are loaded; the -1 (missing)
+        # indexes gather any loaded column, and are excluded below
+        loaded = np.unique(np.concatenate([batch_rows.ravel(), batch_columns.ravel()]))
+
+        loaded = loaded[loaded >= 0]
+
+        block = np.asarray(Z[:, loaded])
+
+        row_positions = np.searchsorted(loaded, np.maximum(batch_rows, 0))
+
+        column_positions = np.searchsorted(loaded, np.maximum(batch_columns, 0))
+
+        # (batch x children x time) @ (batch x time x candidates)
+        tiles = np.matmul(block[:, row_positions].transpose(1, 2, 0),
+                          block[:, column_positions].transpose(1, 0, 2))
+
+        excluded = (batch_columns[:, None, :] < 0) | (batch_rows[:, :, None] == batch_columns[:, None, :])
+
+        tiles = np.where(excluded | np.isnan(tiles), np.inf, np.clip(tiles, -1, 1))
+
+        if n_kept == 1:
+
+            order = np.argmin(tiles, axis=-1)[..., None]
+
+        else:
+
+            order = np.argpartition(tiles, n_kept - 1, axis=-1)[..., :n_kept]
+
+            # strongest first
+            order = np.take_along_axis(order, np.argsort(np.take_along_axis(tiles, order, axis=-1), axis=-1), axis=-1)
+
+        values = np.take_along_axis(tiles, order, axis=-1)
+
+        indexes = np.take_along_axis(np.broadcast_to(batch_columns[:, None, :], tiles.shape), order, axis=-1)
+
+        valid_rows = batch_rows >= 0
+
+        correlation[batch_rows[valid_rows], :n_kept] = np.where(np.isinf(values), np.nan, values)[valid_rows]
+
+        partner_index[batch_rows[valid_rows], :n_kept] = np.where(np.isinf(values), -1, indexes)[valid_rows]
+
+    return correlation, partner_index
+
+
+def pyramid_min_correlation(levels, shapes, factor=2, k=3, neighbourhood=1,
+                            tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET):
+
+    '''
+    Function description:
+
+        Coarse-to-fine search of the most negatively correlated partner of
+        each location.
+
+        The k candidates of each cell of the coarsest level are evaluated
+        exhaustively (see utils.tiled_topk_correlation), and then refined
+        level by level down to the finest one (see refine_candidates).
+
+        The result is exact whenever the true partner of a location lies in
+        the neighbourhood of one of the candidates of its parent cells;
+        otherwise its Teleconnection is the minimum over the evaluated
+        candidates (i.e.: higher or equal to the exhaustive one).
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        levels (list of 2D arrays): the (time x locations) standardized
+                                    series of each level, from the finest to
+                                    the coarsest (at least two levels)
+
+        shapes (list of tuples): the 2D grid shape of each level
+
+        factor (int): the coarsening factor between consecutive levels
+
+        k (int): the number of candidates kept for each cell of the coarser
+                 levels
+
+        neighbourhood (int): see refine_candidates
+
+        tile_memory_budget (int): maximum number of bytes of each tile/batch
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        Teleconnection (1D array), partner_index (1D array of int)
+
+    '''
+
+    candidates = tiled_topk_correlation(levels[-1], k, largest=False,
+                                        tile_memory_budget=tile_memory_budget,
+                                        correlation_tile=standardized_pearson_tile)[1]
+
+    for level in range(len(levels) - 2, -1, -1):
+
+        Teleconnection, candidates = refine_candidates(levels[level], shapes[level], shapes[level + 1], candidates,
+                                                       factor=factor,
+                                                       k=1 if level == 0 else k,
+                                                       neighbourhood=neighbourhood,
+                                                       tile_memory_budget=tile_memory_budget)
+
+    return Teleconnection[:, 0], candidates[:, 0]
@@ -9,11 +9,13 @@ import pandas as pd
 pd.set_option('display.width', 50000)
 pd.set_option('display.max_rows', 500)
 pd.set_option('display.max_columns', 500)
-from shapely.geometry import Point
+import shapely
 import geopandas as gpd
 
 import numpy as np
 
+from .instrumentation import stage
+
 
 
 class Base_class_space_time_netcdf_gdf(object):
@@ -21,6 +23,7 @@ class Base_class_space_time_netcdf_gdf(object):
                  netcdf_temporal_coord_name='time',
                  longitude_dimension='lon',
                  latitude_dimension='lat',
+                 crs='epsg:4326',
 				):
         
         
@@ -32,7 +35,12 @@ class Base_class_space_time_netcdf_gdf(object):
             
             Ex: the Netcdf has to be sorted in ascending order for all dimensions (ex: time ,longitude, latitude). 
             Otherwise, the returned algorithm would return Nan values for all slices
-            
+
+            The coordinates are checked first (monotonicity and range), so that the
+            sorting and the wrapping of the longitudes/latitudes are only applied when
+            needed. A descending dimension is reversed through a lazy slice, so that
+            a lazily opened (dask) dataset is never loaded nor copied here.
+
             Also, it is mandatory for the user to define the longitude and latitude dimension Names (ex: 'lon', 'lat'),
             since there is no stadardization for defining these properties in the Netcdf files worldwide.
             
@@ -61,6 +69,12 @@ class Base_class_space_time_netcdf_gdf(object):
             latitude_dimension (str = 'lat'): 
             ----------------------------------
                 the name of the latitude/vertical dimension in the netcdf file
+            
+            
+            crs (str = 'epsg:4326'): 
+            ------------------------
+                the coordinate reference system of the GeoDataFrames 
+                returned by netcdf_to_gdf
         
 
         
@@ -68,20 +82,32 @@ class Base_class_space_time_netcdf_gdf(object):
         self.longitude_dimension = longitude_dimension
         
         self.latitude_dimension = latitude_dimension
-        self.__netcdf_ds = xarray_dataset
-        
         
-        self.__netcdf_ds = self.__netcdf_ds.sortby( [longitude_dimension, 
-                                                    latitude_dimension, 
-                                                    netcdf_temporal_coord_name])
+        self.crs = crs
+        self.__netcdf_ds = xarray_dataset
         
         self._temporal_coords = netcdf_temporal_coord_name
 
         # setting Standard spatial_coords/dimension names 
         self.spatial_coords = dict(x = longitude_dimension,
                                    y = latitude_dimension)
-        self._convert_lat_180_to_90()
-        self._convert_long_360_to_180()
+        
+        # each step below only inspects the (in-memory) coordinates, and is 
+        # skipped when it is not needed, so that no index work nor copy is 
+        # triggered for an already normalized (i.e.: lazily opened) dataset.
+        # The wrapping comes first, since it may break the order of the 
+        # longitudes (i.e.: 0 to 360 degrees).
+        
+        with stage('normalization'):
+            
+            self._convert_lat_180_to_90()
+            self._convert_long_360_to_180()
+            
+            for dimension in [longitude_dimension, 
+                              latitude_dimension, 
+                              netcdf_temporal_coord_name]:
+                
+                self._sort_ascending(dimension)
         
     
     @ property    
@@ -101,12 +127,43 @@ class Base_class_space_time_netcdf_gdf(object):
         
     
         
+    def _sort_ascending(self, dimension):
+        
+        # ascending: nothing to do; descending: a reversed (lazy) slice; 
+        # otherwise: a full sortby of this dimension only
+        
+        index = self.netcdf_ds.indexes[dimension]
+        
+        if index.is_monotonic_increasing:
+            return
+        
+        elif index.is_monotonic_decreasing:
+            self.netcdf_ds = self.netcdf_ds.isel({dimension:slice(None, None, -1)})
+        
+        else:
+            self.netcdf_ds = self.netcdf_ds.sortby(dimension)
+    
+    def _coordinate_range(self, dimension):
+        
+        values = self.netcdf_ds[dimension].values
+        
+        return values.min(), values.max()
+    
     def _convert_long_360_to_180(self):
+        
+        lon_min, lon_max = self._coordinate_range(self.longitude_dimension)
+        
+        if -180 <= lon_min and lon_max < 180:
+            return
 
         self.netcdf_ds = self.netcdf_ds.assign_coords({self.longitude_dimension :(((self.netcdf_ds[self.longitude_dimension] + 180) % 360) - 180)})
     
     def _convert_lat_180_to_90(self):
         
+        lat_min, lat_max = self._coordinate_range(self.latitude_dimension)
+        
+        if -90 <= lat_min and lat_max <= 90:
+            return
     
         self.netcdf_ds = self.netcdf_ds.assign_coords({self.latitude_dimension:( ((self.netcdf_ds[self.latitude_dimension] + 90) % 180) - 90)})
         
@@ -122,18 +179,97 @@ class Base_class_space_time_netcdf_gdf(object):
         return self._get_coords_resolution(self.netcdf_ds, dimension)
     
     
-    def netcdf_to_gdf(self, netcdf_ds):
+    def _get_cell_geometries(self, netcdf_ds):
+        
+        # one Point per grid cell, built in a single vectorized call. 
+        # The cell of (x[i], y[j]) is at position j * x.size + i
+        
+        x = netcdf_ds[self.spatial_coords['x']].values
+        
+        y = netcdf_ds[self.spatial_coords['y']].values
+        
+        xx, yy = np.meshgrid(x, y)
+        
+        return shapely.points(xx.ravel(), yy.ravel())
+    
+    def _long_table_to_gdf(self, netcdf_ds, cell_geometries, crs):
+        
+        # joins the long-format values to the (shared) geometries of their 
+        # grid cells, through the position of their coordinates
         
         netcdf_as_dataframe = netcdf_ds.to_dataframe().reset_index()
         
-        netcdf_as_dataframe.loc[:, 'geometry'] = None
+        x_position = netcdf_ds.indexes[self.spatial_coords['x']].get_indexer(netcdf_as_dataframe[self.spatial_coords['x']])
+        
+        y_position = netcdf_ds.indexes[self.spatial_coords['y']].get_indexer(netcdf_as_dataframe[self.spatial_coords['y']])
         
-        netcdf_as_dataframe['geometry'] = [Point([x,y]) for x,y in zip(netcdf_as_dataframe[self.spatial_coords['x']], netcdf_as_dataframe.reset_index()[self.spatial_coords['y']])]
+        cell = y_position * netcdf_ds[self.spatial_coords['x']].size + x_position
         
+        return gpd.GeoDataFrame(netcdf_as_dataframe, 
+                                geometry=cell_geometries[cell], 
+                                crs=crs)
+    
+    def netcdf_to_gdf(self, netcdf_ds, crs=None, time_block_size=None):
         
+        '''
+        Function description:
+            
+            Converts the netcdf into a long-format GeoDataFrame (one row per 
+            time, latitude and longitude), whose geometry is the Point of each 
+            grid cell.
+            
+            Only one Point is built per grid cell (not per row): the rows of 
+            a same cell share its geometry.
         
-        netcdf_as_dataframe = gpd.GeoDataFrame(netcdf_as_dataframe, crs=self.gdf.crs)
+        ------------------------------------------------------------------
+        
+        Parameters:
+            
+            netcdf_ds (xarray-Dataset): the data to be converted
+            
+            crs (str = None): the coordinate reference system of the 
+                              GeoDataFrame (default: self.crs)
+            
+            time_block_size (int = None): if given, a generator is returned, 
+                              which yields one GeoDataFrame per block of 
+                              "time_block_size" time steps, so that the whole 
+                              long table is never held in memory.
+        
+        ------------------------------------------------------------------
+        
+        Returns:
+            
+            geopandas GeoDataFrame, or a generator of GeoDataFrames 
+            (if time_block_size is given)
         
-        return netcdf_as_dataframe
+        '''
+        
+        if crs is None:
+            crs = self.crs
+        
+        if time_block_size is not None:
+            
+            return self.iter_netcdf_to_gdf(netcdf_ds, crs=crs, time_block_size=time_block_size)
+        
+        return self._long_table_to_gdf(netcdf_ds, self._get_cell_geometries(netcdf_ds), crs)
     
-    
\ No newline at end of file
+    def iter_netcdf_to_gdf(self, netcdf_ds, crs=None, time_block_size=1):
+        
+        '''
+        Generator version of netcdf_to_gdf: yields one GeoDataFrame per block 
+        of "time_block_size" time steps. The grid cell geometries are built 
+        once, and shared by every block.
+        '''
+        
+        if crs is None:
+            crs = self.crs
+        
+        cell_geometries = self._get_cell_geometries(netcdf_ds)
+        
+        n_time = netcdf_ds[self.temporal_coords].size
+        
+        for start in range(0, n_time, time_block_size):
+            
+            block = netcdf_ds.isel({self.temporal_coords:slice(start, start + time_block_size)})
+            
+            yield self._long_table_to_gdf(block, cell_geometries, crs)
@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""
+Masks of the location pairs allowed in the tiled correlation reductions.
+
+A pair mask is an object with two methods:
+
+    any_pair(rows, columns): whether the tile of locations (rows x columns)
+                             holds at least one allowed pair. Tiles without
+                             any allowed pair are skipped before any
+                             correlation arithmetic is done.
+
+    __call__(rows, columns): the boolean (rows x columns) tile of the
+                             allowed pairs. The correlations of the other
+                             pairs are masked (NaN), so that they never
+                             become partners.
+"""
+
+import numpy as np
+import shapely
+import xarray as xr
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+# the largest difference (degrees) between the coordinates of a region mask
+# and of the grid for them to be the same cell
+COORDINATE_TOLERANCE = 1e-6
+
+
+def _get_geometry(region):
+
+    # a shapely geometry, or the union of the geometries of a
+    # GeoDataFrame/GeoSeries
+
+    if hasattr(region, 'geometry'):
+        region = region.geometry
+
+    if hasattr(region, 'union_all'):
+        return region.union_all()
+
+    if hasattr(region, 'unary_union'):
+        return region.unary_union
+
+    return region
+
+
+def _align_region(region, lons, lats, coordinate_names):
+
+    # the values of a (lat, lon) DataArray mask at each location, matched by
+    # coordinates: the mask may be on the grid of the user (i.e.: descending
+    # latitudes, 0 to 360 longitudes), before its normalization by
+    # Base_class_space_time_netcdf_gdf. The same wrapping is applied here.
+
+    lon, lat = coordinate_names['lon'], coordinate_names['lat']
+
+    region_lons = region[lon].values
+
+    if region_lons.min() < -180 or region_lons.max() >= 180:
+        region = region.assign_coords({lon:((region[lon] + 180) % 360) - 180})
+
+    region_lats = region[lat].values
+
+    if region_lats.min() < -90 or region_lats.max() > 90:
+        region = region.assign_coords({lat:((region[lat] + 90) % 180) - 90})
+
+    region = region.sortby([lon, lat])
+
+    try:
+
+        membership = region.sel({lon:xr.DataArray(np.asarray(lons), dims='location'),
+                                 lat:xr.DataArray(np.asarray(lats), dims='location')},
+                                method='nearest', tolerance=COORDINATE_TOLERANCE)
+
+    except KeyError:
+
+        raise ValueError("the region mask does not cover every location of the grid")
+
+    if membership.dims != ('location',):
+
+        raise ValueError("the region mask must only have the location dimensions, not {0}".format(region.dims))
+
+    membership = membership.values
+
+    if membership.dtype.kind == 'f':
+
+        # missing (NaN) cells are outside of the region
+        membership = np.nan_to_num(membership)
+
+    return membership.astype(bool)
+
+
+def region_membership(lons, lats, region, dims=None, coordinate_names=None):
+
+    '''
+    Function description:
+
+        Evaluates which locations fall inside the given region.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        lons, lats (1D arrays): the coordinates of each location
+
+        region: a shapely (Multi)Polygon, a GeoDataFrame/GeoSeries (the union
+                of its geometries), or a boolean mask (i.e.: a land-sea mask):
+                either a (lat, lon) xarray-DataArray, whose cells are matched
+                to the locations by their coordinates (after the same
+                wrapping of the longitudes/latitudes as the normalization of
+                the dataset), or an array with one value per location, in
+                their order
+
+        dims (list of str = None): the order of the flattened location
+                                   dimensions, used to transpose a boolean
+                                   xarray-DataArray region without
+                                   coordinates
+
+        coordinate_names (dict = None): the names of the 'lat' and 'lon'
+                                        coordinates of a DataArray region
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        1D array of bool (one value per location)
+
+    '''
+
+    lons = np.asarray(lons)
+
+    if (coordinate_names is not None and isinstance(region, xr.DataArray) and
+        all(x in region.coords for x in coordinate_names.values())):
+
+        return _align_region(region, lons, lats, coordinate_names)
+
+    if dims is not None and hasattr(region, 'transpose') and hasattr(region, 'dims'):
+        region = region.transpose(*dims)
+
+    if isinstance(region, np.ndarray) or hasattr(region, 'dtype'):
+
+        membership = np.asarray(region, dtype=bool).ravel()
+
+        if membership.size != lons.size:
+            raise ValueError("the region mask has {0} values, but there are {1} locations".format(membership.size, lons.size))
+
+        return membership
+
+    return shapely.contains_xy(_get_geometry(region), lons, np.asarray(lats))
+
+
+class Region_pair_mask(object):
+
+    def __init__(self, membership, allowed):
+
+        '''
+        Class description:
+        ------------------
+
+            Pair mask (see the module description) of region-pair rules:
+            the pair of locations (i, j) is allowed if location i is in a
+            region "a" and location j in a region "b" (or the other way
+            around), for any allowed pair of regions (a, b).
+
+            The allowed pairs of a tile are a product of the (small)
+            membership matrices, and a tile is skipped if the regions of its
+            rows and of its columns have no allowed pair.
+
+
+        Attributes:
+
+            membership (2D array of bool):
+            ------------------------------
+
+                (locations x regions): whether each location is in each region
+
+
+            allowed (2D array of bool):
+            ---------------------------
+
+                (regions x regions): the allowed pairs of regions
+                (symmetrized)
+
+        '''
+
+        self.membership = np.asarray(membership, dtype=bool)
+
+        allowed = np.asarray(allowed, dtype=bool)
+
+        self.allowed = allowed | allowed.T
+
+    @ classmethod
+    def from_regions(cls, lons, lats, region=None, region_pairs=None, dims=None, coordinate_names=None):
+
+        '''
+        Function description:
+
+            Builds the pair mask of a region and/or of region pairs.
+
+        ------------------------------------------------------------------
+
+        Parameters:
+
+            lons, lats (1D arrays): the coordinates of each location
+
+            region (= None): only the pairs whose locations are both inside
+                             this region are allowed (see region_membership)
+
+            region_pairs (list of tuples = None): only the pairs that link
+                             the first to the second region of any of these
+                             (region_a, region_b) tuples are allowed
+                             (i.e.: [(ocean_basin, land_region)])
+
+            dims (list of str = None), coordinate_names (dict = None): see
+                             region_membership
+
+        ------------------------------------------------------------------
+
+        Returns:
+
+            a Region_pair_mask, or None if neither is given
+
+        '''
+
+        if region is None and region_pairs is None:
+            return None
+
+        if region_pairs is None:
+
+            # a single region, allowed with itself
+            membership = np.ones((np.size(lons), 1), dtype=bool)
+
+            allowed = np.ones((1, 1), dtype=bool)
+
+        else:
+
+            # two columns of membership per pair of regions
+            membership = np.stack([region_membership(lons, lats, region_x, dims=dims,
+                                                     coordinate_names=coordinate_names)
+                                   for region_a, region_b in region_pairs
+                                   for region_x in (region_a, region_b)], axis=1)
+
+            allowed = np.zeros((membership.shape[1], membership.shape[1]), dtype=bool)
+
+            allowed[np.arange(0, membership.shape[1], 2), np.arange(1, membership.shape[1], 2)] = True
+
+        if region is not None:
+
+            membership = membership & region_membership(lons, lats, region, dims=dims,
+                                                        coordinate_names=coordinate_names)[:, None]
+
+        return cls(membership, allowed)
+
+    def any_pair(self, rows, columns):
+
+        regions_i = self.membership[rows].any(axis=0)
+
+        regions_j = self.membership[columns].any(axis=0)
+
+        return bool(self.allowed[np.ix_(regions_i, regions_j)].any())
+
+    def __call__(self, rows, columns):
+
+        membership_i = self.membership[rows].astype(np.float32)
+
+        membership_j = self.membership[columns].astype(np.float32)
+
+        return (membership_i @ self.allowed.astype(np.float32) @ membership_j.T) > 0
+
+
+def _unit_vectors(lons, lats):
+
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+
+    return np.stack([np.cos(lats) * np.cos(lons),
+                     np.cos(lats) * np.sin(lons),
+                     np.sin(lats)], axis=1)
+
+
+class Distance_pair_mask(object):
+
+    def __init__(self, lons, lats, min_distance_km, earth_radius_km=EARTH_RADIUS_KM):
+
+        '''
+        Class description:
+        ------------------
+
+            Pair mask (see the module description) that excludes the pairs of
+            locations closer than "min_distance_km" (great-circle distance).
+
+            Only the unit vectors of the locations are kept (O(N) memory): the
+            mask of each tile is evaluated by brute force from the chord
+            distances between its rows and columns (the great-circle distance
+            d maps onto the chord distance 2 * R * sin(d / 2R), so that the
+            comparison is the haversine one), with a single
+            (rows x 3) @ (3 x columns) product. This replaces the former
+            spatial index (cKDTree) and its sparse matrix of the close pairs,
+            whose memory grew with the number of close pairs: the whole map
+            now costs about 3 * N**2 flops and one (rows x columns) boolean
+            tile at a time, i.e. 3 / n_time of the correlations themselves.
+
+            any_pair first bounds the distances of the tile with the bounding
+            balls of its rows and of its columns (O(rows + columns)): the
+            tiles that are surely all allowed, or all excluded, are decided
+            without evaluating their mask. Only the others are evaluated, and
+            their last tile is cached, since the reductions then ask for the
+            tile itself.
+
+
+        Attributes:
+
+            lons, lats (1D arrays):
+            -----------------------
+
+                the coordinates of each location (degrees)
+
+
+            min_distance_km (float):
+            ------------------------
+
+                the minimum great-circle distance of an allowed pair
+
+
+            earth_radius_km (float = 6371.0088):
+            ------------------------------------
+
+                the mean radius of the Earth
+
+        '''
+
+        self.min_distance_km = min_distance_km
+
+        self.points = _unit_vectors(lons, lats)
+
+        # the chord (in units of the radius) of the minimum distance
+        angle = min(min_distance_km / float(earth_radius_km), np.pi)
+
+        self.squared_chord = (2 * np.sin(angle / 2) * (1 - 1e-12))**2
+
+        self._last_tile = (None, None)
+
+    def _allowed(self, rows, columns):
+
+        key = (rows.start, rows.stop, columns.start, columns.stop)
+
+        # read (and replaced) at once, so that the threads of the reduction
+        # never get the tile of another one
+        last_key, allowed = self._last_tile
+
+        if last_key == key:
+            return allowed
+
+        # squared chord distances: |p_i - p_j|**2 = 2 - 2 p_i . p_j
+        squared_chords = 2 - 2 * (self.points[rows] @ self.points[columns].T)
+
+        allowed = squared_chords > self.squared_chord
+
+        # the self-pairs are excluded as well
+        row_index = np.arange(rows.start, rows.stop)
+
+        allowed[row_index[:, None] == np.arange(columns.start, columns.stop)[None, :]] = False
+
+        self._last_tile = (key, allowed)
+
+        return allowed
+
+    def _bounding_ball(self, locations):
+
+        points = self.points[locations]
+
+        center = points.mean(axis=0)
+
+        return center, np.sqrt(((points - center)**2).sum(axis=1).max())
+
+    def any_pair(self, rows, columns):
+
+        row_center, row_radius = self._bounding_ball(rows)
+
+        column_center, column_radius = self._bounding_ball(columns)
+
+        distance = np.sqrt(((row_center - column_center)**2).sum())
+
+        chord = np.sqrt(self.squared_chord)
+
+        # every pair is farther than the chord (and thus none is a self-pair)
+        if distance - row_radius - column_radius > chord:
+            return True
+
+        # every pair is within the chord
+        if distance + row_radius + column_radius <= chord:
+            return False
+
+        return bool(self._allowed(rows, columns).any())
+
+    def __call__(self, rows, columns):
+
+        return self._allowed(rows, columns)
+
+
+class Combined_pair_mask(object):
+
+    def __init__(self, *masks):
+
+        '''
+        Class description:
+        ------------------
+
+            Pair mask that only allows the pairs allowed by every one of the
+            given pair masks (None entries are ignored).
+
+        '''
+
+        self.masks = [mask for mask in masks if mask is not None]
+
+    def any_pair(self, rows, columns):
+
+        return all(mask.any_pair(rows, columns) for mask in self.masks)
+
+    def __call__(self, rows, columns):
+
+        allowed = True
+
+        for mask in self.masks:
+
+            allowed = allowed & mask(rows, columns)
+
+        return allowed
+
+
+def combine_pair_masks(*masks):
+
+    '''
+    Combines the given pair masks (None entries are ignored). Returns None
+    if there is no mask, and the mask itself if there is only one.
+    '''
+
+    masks = [mask for mask in masks if mask is not None]
+
+    if not masks:
+        return None
+
+    if len(masks) == 1:
+        return masks[0]
+
+    return Combined_pair_mask(*masks)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized rank correlations.
+
+Each series is ranked once; the correlation of a whole block of pairs of
+series is then evaluated with numpy (BLAS) matrix products, instead of
+calling scipy.stats once per pair.
+"""
+
+from functools import partial
+
+import numpy as np
+from scipy import stats
+
+from .tiled_correlation import standardize_series
+
+
+DEFAULT_PAIR_BLOCK_SIZE = 4096
+
+
+def rank_series(data, axis=0):
+
+    '''
+    Function description:
+
+        Ranks each series of "data" along "axis" (ties receive the same rank).
+
+        Series containing any NaN value are returned as all-NaN, so that
+        their correlations propagate NaN (as scipy.stats.kendalltau does).
+
+        Dask arrays are ranked lazily, block by block (each block holding
+        whole series).
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        data (array): the values to be ranked
+
+        axis (int): the axis of the series (i.e.: the time axis)
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        array of float64 ranks, with the same shape as "data".
+
+    '''
+
+    if hasattr(data, 'map_blocks'):
+
+        return data.rechunk({axis:-1}).map_blocks(rank_series, axis=axis, dtype=np.float64)
+
+    data = np.asarray(data, dtype=np.float64)
+
+    has_nan = np.isnan(data).any(axis=axis, keepdims=True)
+
+    ranks = stats.rankdata(np.where(has_nan, 0, data), method='average', axis=axis)
+
+    return np.where(has_nan, np.nan, ranks)
+
+
+def kendall_tau_b_tile(ranks_i, ranks_j, pair_block_size=DEFAULT_PAIR_BLOCK_SIZE):
+
+    '''
+    Function description:
+
+        Kendall tau-b correlation between each column of ranks_i and each
+        column of ranks_j.
+
+        For each pair of time steps (a, b), the sign of the difference of each
+        series is evaluated once; the difference between concordant and
+        discordant pairs of every pair of series is then a matrix product
+        of these sign matrices. Ties are handled as scipy's tau-b:
+
+            tau_b = (n_c - n_d) / sqrt((n_0 - n_1) * (n_0 - n_2))
+
+        The time pairs are processed in blocks of "pair_block_size",
+        bounding the memory of the sign matrices. The tiled reductions size
+        both the tile and "pair_block_size" from their memory budget (see
+        fit_kendall_tile).
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        ranks_i (2D array): (time x locations_i) ranked series
+                            (see rank_series). Raw values also work,
+                            since only the order of the values matters.
+
+        ranks_j (2D array): (time x locations_j) ranked series
+
+        pair_block_size (int): number of time pairs per block
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        2D array (locations_i x locations_j) with values between (-1, 1).
+        NaN for constant series or series with NaN values.
+
+    '''
+
+    n_time = ranks_i.shape[0]
+
+    first, second = np.triu_indices(n_time, k=1)
+
+    n_pairs = first.size
+
+    concordance = np.zeros((ranks_i.shape[1], ranks_j.shape[1]))
+
+    ties_i = np.zeros(ranks_i.shape[1])
+
+    ties_j = np.zeros(ranks_j.shape[1])
+
+    for start in range(0, n_pairs, pair_block_size):
+
+        a = first[start:start + pair_block_size]
+
+        b = second[start:start + pair_block_size]
+
+        sign_i = np.sign(ranks_i[b] - ranks_i[a])
+
+        sign_j = np.sign(ranks_j[b] - ranks_j[a])
+
+        concordance += sign_i.T @ sign_j
+
+        ties_i += (sign_i == 0).sum(axis=0)
+
+        ties_j += (sign_j == 0).sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+
+        tau = concordance / np.sqrt(np.outer(n_pairs - ties_i, n_pairs - ties_j))
+
+    return np.clip(tau, -1, 1)
+
+
+def fit_kendall_tile(n_time, n_rows, n_locations, tile_memory_budget, block_time=None):
+
+    '''
+    Function description:
+
+        Sizes a Kendall tile (see kendall_tau_b_tile) for the tiled
+        reductions: the number of columns per tile and the "pair_block_size",
+        so that the row block, the column data block, the tile and the sign
+        matrices (pair_block_size x (rows + columns), about three times
+        over with their temporaries) fit inside the memory budget.
+
+        Half of the budget left by the row block sizes the tile; the sign
+        matrices then get the other half (at most DEFAULT_PAIR_BLOCK_SIZE
+        pairs), and any budget they do not use is given back to the tile.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        n_time (int): the length of the ranked series
+
+        n_rows (int): the number of reference locations (rows) of the tile
+
+        n_locations (int): the total number of locations (columns)
+
+        tile_memory_budget (int): maximum number of bytes for a single tile
+
+        block_time (int = None): the length of the column data block
+                                 (default: n_time)
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        tile_size (int): number of columns per tile (at least 1)
+
+        correlation_tile (callable): kendall_tau_b_tile with the fitted
+                                     pair_block_size
+
+    '''
+
+    block_time = n_time if block_time is None else block_time
+
+    n_pairs = max(n_time * (n_time - 1) // 2, 1)
+
+    # float64 values: the ranks, the tile and the sign matrices
+    n_values = tile_memory_budget / 8.0
+
+    # the row block, and the (two int64) indexes of the time pairs
+    n_values -= n_time * n_rows + 2 * n_pairs
+
+    n_values = max(n_values, 0)
+
+    column_values = block_time + 3 * n_rows
+
+    tile_size = max(n_values / 2 // column_values, 1)
+
+    pair_block_size = int(np.clip(n_values / 2 // (3 * (n_rows + tile_size)), 1,
+                                  min(DEFAULT_PAIR_BLOCK_SIZE, n_pairs)))
+
+    tile_size = (n_values - 3 * pair_block_size * n_rows) // (column_values + 3 * pair_block_size)
+
+    tile_size = int(np.clip(tile_size, 1, max(n_locations, 1)))
+
+    return tile_size, partial(kendall_tau_b_tile, pair_block_size=pair_block_size)
+
+
+kendall_tau_b_tile.fit_tile = fit_kendall_tile
+
+
+def standardized_ranks(data, dtype=np.float64):
+
+    '''
+    Function description:
+
+        Ranks each series once and standardizes the ranks (see
+        utils.standardize_series), so that the Spearman correlation of any
+        two series is the dot product of their standardized ranks: the
+        Spearman tiles are then the same BLAS matrix products as the
+        Pearson ones (see utils.standardized_pearson_tile).
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        data (2D array): (time x locations) numpy or dask array
+
+        dtype (numpy dtype = float64): the precision of the standardized ranks
+
+    '''
+
+    return standardize_series(rank_series(data, axis=0), dtype=dtype)
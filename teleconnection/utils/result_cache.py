@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed, size-bounded on-disk cache of teleconnection results.
+
+Each result is stored in a pickle file named by the hash of the input data,
+its coordinates and the parameters of the run. The least recently used
+results are evicted whenever the cache grows beyond its size limit.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+import shapely
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'teleconnection')
+
+DEFAULT_CACHE_MAX_BYTES = 2 * 2**30
+
+# part of every key: bump it whenever the computations or the format of the
+# cached results change, so that the stale entries are never served
+CACHE_FORMAT_VERSION = 1
+
+
+def _update_hash_with_array(hasher, values):
+
+    values = np.ascontiguousarray(values)
+
+    hasher.update(str(values.dtype).encode())
+
+    hasher.update(str(values.shape).encode())
+
+    hasher.update(values.view(np.uint8).ravel() if values.dtype != object else repr(values.tolist()).encode())
+
+
+def hash_dataarray(dataArray, hasher=None, chunk_size=64):
+
+    '''
+    Function description:
+
+        Hashes the values, dimensions and coordinates of a xarray-DataArray.
+
+        The values are read "chunk_size" steps of the first dimension at a
+        time, so that lazy (dask) arrays are hashed in bounded memory.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        the updated hashlib object
+
+    '''
+
+    if hasher is None:
+        hasher = hashlib.sha256()
+
+    hasher.update(repr(dataArray.dims).encode())
+
+    for name in sorted(dataArray.coords):
+
+        hasher.update(str(name).encode())
+
+        _update_hash_with_array(hasher, dataArray.coords[name].values)
+
+    first_dim = dataArray.dims[0]
+
+    for start in range(0, dataArray.shape[0], chunk_size):
+
+        _update_hash_with_array(hasher, dataArray.isel({first_dim:slice(start, start + chunk_size)}).values)
+
+    return hasher
+
+
+def _update_hash_with_geometries(hasher, geometries):
+
+    # by content (WKB), whatever the repr of the geometries
+
+    for wkb in shapely.to_wkb(np.asarray(geometries, dtype=object).ravel()):
+
+        wkb = b'' if wkb is None else wkb
+
+        hasher.update(str(len(wkb)).encode())
+
+        hasher.update(wkb)
+
+
+def _update_hash_with_pandas(hasher, values):
+
+    hasher.update(type(values).__name__.encode())
+
+    hasher.update(pd.util.hash_pandas_object(values.index).values.tobytes())
+
+    if getattr(values, 'crs', None) is not None:
+        hasher.update(str(values.crs).encode())
+
+    columns = values.items() if isinstance(values, pd.DataFrame) else [(values.name, values)]
+
+    for name, column in columns:
+
+        hasher.update(repr(name).encode())
+
+        if str(column.dtype) == 'geometry':
+            _update_hash_with_geometries(hasher, column.values)
+
+        else:
+            hasher.update(pd.util.hash_pandas_object(column, index=False).values.tobytes())
+
+
+def update_hash_with_parameter(hasher, value):
+
+    '''
+    Function description:
+
+        Hashes a parameter of a run by its content: xarray objects (see
+        hash_dataarray), numpy arrays, pandas and geopandas objects (the
+        geometries by their WKB), shapely geometries, and (nested) lists,
+        tuples and dicts of them. The scalars, strings and types are hashed
+        by their repr.
+
+        A TypeError is raised for any other object (i.e.: a function),
+        whose repr may not describe its content.
+
+    '''
+
+    hasher.update(type(value).__name__.encode())
+
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic, np.dtype, type)):
+
+        hasher.update(repr(value).encode())
+
+    elif isinstance(value, shapely.Geometry):
+
+        _update_hash_with_geometries(hasher, [value])
+
+    elif hasattr(value, 'data_vars'): # xarray-Dataset
+
+        for name in sorted(value.data_vars):
+
+            hasher.update(str(name).encode())
+
+            hash_dataarray(value[name], hasher)
+
+    elif hasattr(value, 'dims') and hasattr(value, 'coords'): # xarray-DataArray
+
+        hash_dataarray(value, hasher)
+
+    elif isinstance(value, (pd.Series, pd.DataFrame)):
+
+        _update_hash_with_pandas(hasher, value)
+
+    elif isinstance(value, np.ndarray):
+
+        if value.dtype == object:
+
+            hasher.update(str(value.shape).encode())
+
+            for x in value.ravel():
+                update_hash_with_parameter(hasher, x)
+
+        else:
+            _update_hash_with_array(hasher, value)
+
+    elif isinstance(value, (list, tuple)):
+
+        hasher.update(str(len(value)).encode())
+
+        for x in value:
+            update_hash_with_parameter(hasher, x)
+
+    elif isinstance(value, dict):
+
+        for name in sorted(value, key=repr):
+
+            hasher.update(repr(name).encode())
+
+            update_hash_with_parameter(hasher, value[name])
+
+    else:
+
+        raise TypeError("the parameters of type {0} cannot be hashed by content".format(type(value).__name__))
+
+    return hasher
+
+
+class Result_cache(object):
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+
+        '''
+        Class description:
+        ------------------
+
+            Content-addressed on-disk cache of results.
+
+            The recency of each entry is its file modification time, which
+            is refreshed at each hit; the least recently used entries are
+            evicted when the total size exceeds "max_bytes".
+
+
+        Attributes:
+
+            path (str = ~/.cache/teleconnection):
+            --------------------------------------
+
+                the directory of the cache
+
+
+            max_bytes (int = 2 GiB):
+            ------------------------
+
+                the maximum total size of the cached results
+
+        '''
+
+        self.path = path
+
+        self.max_bytes = max_bytes
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def key(self, dataArray, **parameters):
+
+        '''
+        Returns the key of a run over "dataArray" with the given parameters,
+        which are hashed by content (see update_hash_with_parameter), and of
+        the CACHE_FORMAT_VERSION. Raises a TypeError if any parameter cannot
+        be hashed.
+        '''
+
+        hasher = hash_dataarray(dataArray)
+
+        hasher.update('version={0}'.format(CACHE_FORMAT_VERSION).encode())
+
+        for name in sorted(parameters):
+
+            hasher.update('{0}='.format(name).encode())
+
+            update_hash_with_parameter(hasher, parameters[name])
+
+        return hasher.hexdigest()
+
+    def _filename(self, key):
+
+        return os.path.join(self.path, key + '.pkl')
+
+    def get(self, key, default=None):
+
+        filename = self._filename(key)
+
+        try:
+            with open(filename, 'rb') as f:
+                value = pickle.load(f)
+
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+
+        os.utime(filename, None) # marks the entry as recently used
+
+        return value
+
+    def __contains__(self, key):
+
+        return os.path.exists(self._filename(key))
+
+    def put(self, key, value):
+
+        # atomic write: a reader never sees a partially written entry
+        file_descriptor, temporary = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+
+        with os.fdopen(file_descriptor, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temporary, self._filename(key))
+
+        self._evict()
+
+    def _entries(self):
+
+        entries = []
+
+        for name in os.listdir(self.path):
+
+            if name.endswith('.pkl'):
+
+                stat = os.stat(os.path.join(self.path, name))
+
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        return sorted(entries)
+
+    def _evict(self):
+
+        entries = self._entries()
+
+        total = sum(size for _, size, _ in entries)
+
+        # oldest entries first; the most recent entry is always kept
+        for _, size, name in entries[:-1]:
+
+            if total <= self.max_bytes:
+                break
+
+            os.remove(os.path.join(self.path, name))
+
+            total -= size
+
+    def invalidate(self, key=None):
+
+        '''
+        Removes the entry of the given key, or every entry if key is None.
+        '''
+
+        names = [key + '.pkl'] if key is not None else [name for _, _, name in self._entries()]
+
+        for name in names:
+
+            filename = os.path.join(self.path, name)
+
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    @ property
+    def size(self):
+
+        return sum(size for _, size, _ in self._entries())
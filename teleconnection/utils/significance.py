@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized significance tests of the teleconnection correlations.
+
+All the tests work over whole arrays of correlations (one value per
+location), so that the significance of the teleconnections is evaluated
+from the O(N) results of the tiled reductions, without a second pass over
+the correlation matrix nor a per-pixel scipy call.
+"""
+
+import numpy as np
+from scipy import stats
+
+from .tiled_correlation import iter_tiles, _load_block
+
+
+SIGNIFICANCE_METHODS = ['pearson', 'kendall']
+
+
+def pearson_p_value(r, n):
+
+    '''
+    Function description:
+
+        Two-sided p-value of the Pearson correlation "r" for "n" samples,
+        through the t-test: t = r * sqrt((n - 2) / (1 - r**2)),
+        with n - 2 degrees of freedom.
+
+    '''
+
+    r = np.clip(np.asarray(r, dtype=np.float64), -1, 1)
+
+    n = np.asarray(n, dtype=np.float64)
+
+    degrees_of_freedom = np.maximum(n - 2, 1e-12)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        t = r * np.sqrt(degrees_of_freedom / (1 - r**2))
+
+    return 2 * stats.t.sf(np.abs(t), degrees_of_freedom)
+
+
+def kendall_p_value(tau, n):
+
+    '''
+    Function description:
+
+        Two-sided p-value of the Kendall correlation "tau" for "n" samples,
+        through the normal approximation of its null distribution:
+
+            var(tau) = 2 * (2n + 5) / (9n * (n - 1))
+
+        The tie correction of the variance is not applied (it is small for
+        continuous climate fields).
+
+    '''
+
+    tau = np.asarray(tau, dtype=np.float64)
+
+    n = np.asarray(n, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        z = tau / np.sqrt(2 * (2 * n + 5) / (9 * n * (n - 1)))
+
+    return 2 * stats.norm.sf(np.abs(z))
+
+
+def sidak_p_value(p_value, n_candidates):
+
+    '''
+    Function description:
+
+        Adjusts the p-value of the most extreme of "n_candidates" correlations
+        for the search among them (Sidak): the probability that at least one
+        of n_candidates independent null correlations is as extreme,
+
+            1 - (1 - p)**n_candidates
+
+        evaluated as -expm1(n_candidates * log1p(-p)), so that the small
+        p-values keep their precision.
+
+    '''
+
+    p_value = np.asarray(p_value, dtype=np.float64)
+
+    n_candidates = np.asarray(n_candidates, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        adjusted = -np.expm1(n_candidates * np.log1p(-p_value))
+
+    return np.clip(adjusted, 0, 1)
+
+
+def lag1_autocorrelation(data, tile_size=4096):
+
+    '''
+    Function description:
+
+        Lag-1 autocorrelation of each location series (column) of "data",
+        evaluated "tile_size" locations at a time.
+
+    '''
+
+    n_time, n_locations = data.shape
+
+    r1 = np.full(n_locations, np.nan)
+
+    for sl in iter_tiles(n_locations, tile_size):
+
+        anomalies = _load_block(data, sl)
+
+        anomalies = anomalies - anomalies.mean(axis=0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+
+            r1[sl] = (anomalies[1:] * anomalies[:-1]).sum(axis=0) / (anomalies**2).sum(axis=0)
+
+    return r1
+
+
+def effective_sample_size(n, r1_x, r1_y):
+
+    '''
+    Function description:
+
+        Effective number of independent samples of the correlation between
+        two autocorrelated series (Bretherton et al., 1999):
+
+            n_eff = n * (1 - r1_x * r1_y) / (1 + r1_x * r1_y)
+
+        where r1_x and r1_y are the lag-1 autocorrelations of each series.
+        n_eff is bounded between 3 and n.
+
+    '''
+
+    product = np.asarray(r1_x) * np.asarray(r1_y)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        n_eff = n * (1 - product) / (1 + product)
+
+    return np.clip(n_eff, 3, n)
+
+
+def benjamini_hochberg(p_values, alpha=0.05):
+
+    '''
+    Function description:
+
+        Benjamini-Hochberg control of the false discovery rate (field
+        significance) across all locations. NaN p-values are ignored.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        significant (array of bool): the rejected null hypotheses
+
+        q_values (array): the adjusted p-values (NaN where p is NaN)
+
+    '''
+
+    p_values = np.asarray(p_values, dtype=np.float64)
+
+    valid = np.flatnonzero(~np.isnan(p_values))
+
+    q_values = np.full(p_values.shape, np.nan)
+
+    order = valid[np.argsort(p_values[valid], kind='stable')]
+
+    n_tests = order.size
+
+    if n_tests:
+
+        ranked = p_values[order] * n_tests / np.arange(1, n_tests + 1)
+
+        # enforcing monotonicity from the largest p-value down
+        ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+
+        q_values[order] = np.minimum(ranked, 1)
+
+    significant = np.zeros(p_values.shape, dtype=bool)
+
+    significant[valid] = q_values[valid] <= alpha
+
+    return significant, q_values
+
+
+def teleconnection_significance(Teleconnection, partner_index, data,
+                                method='pearson',
+                                use_effective_sample_size=False,
+                                fdr_alpha=None,
+                                n_samples=None,
+                                n_candidates=None):
+
+    '''
+    Function description:
+
+        Significance of the teleconnection of each location (its correlation
+        with its partner), from the O(N) results of a tiled reduction.
+
+        The partner is the most negative of all the correlations of the
+        location: the p-value of that single pair understates the chance of
+        finding such a correlation by searching. If "n_candidates" is given,
+        the p-values are adjusted for the search (see sidak_p_value);
+        otherwise they are the unadjusted ones of each pair.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        Teleconnection (1D array): the correlation of each location with its
+                                   partner
+
+        partner_index (1D array of int): the partner of each location
+                                         (-1 if none)
+
+        data (2D array): the (time x locations) array that was correlated.
+                         It is only read if use_effective_sample_size is True.
+
+        method (str = 'pearson'): 'pearson' (t-test) or 'kendall'
+                                  (normal approximation)
+
+        use_effective_sample_size (bool = False): if True, the number of
+                                  samples of each pair is corrected for the
+                                  lag-1 autocorrelation of both series
+                                  (see effective_sample_size)
+
+        fdr_alpha (float = None): if given, the field significance is
+                                  controlled with the Benjamini-Hochberg
+                                  procedure at this false discovery rate
+
+        n_samples (1D array = None): the number of samples of each pair
+                                     (i.e.: the overlap of lagged series).
+                                     Default: the size of the time dimension.
+
+        n_candidates (int = None): the number of candidate partners searched
+                                   for each location (i.e.: N - 1). If None,
+                                   the p-values are not adjusted.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        dict with:
+
+            'p_value': the p-value of each location (NaN if no partner),
+                       adjusted for the search if n_candidates is given
+
+            'q_value' and 'significant': only if fdr_alpha is given
+
+    '''
+
+    if method not in SIGNIFICANCE_METHODS:
+        raise ValueError("method must be one of {0}, not {1}".format(SIGNIFICANCE_METHODS, method))
+
+    Teleconnection = np.asarray(Teleconnection, dtype=np.float64)
+
+    partner_index = np.asarray(partner_index)
+
+    if n_samples is None:
+        n_samples = data.shape[0]
+
+    n = np.broadcast_to(np.asarray(n_samples, dtype=np.float64), Teleconnection.shape)
+
+    if use_effective_sample_size:
+
+        r1 = lag1_autocorrelation(data)
+
+        n = effective_sample_size(n, r1, r1[np.maximum(partner_index, 0)])
+
+    if method == 'pearson':
+        p_value = pearson_p_value(Teleconnection, n)
+
+    else:
+        p_value = kendall_p_value(Teleconnection, n)
+
+    if n_candidates is not None:
+        p_value = sidak_p_value(p_value, n_candidates)
+
+    p_value = np.where(partner_index >= 0, p_value, np.nan)
+
+    Significance = {'p_value':p_value}
+
+    if fdr_alpha is not None:
+
+        Significance['significant'], Significance['q_value'] = benjamini_hochberg(p_value, alpha=fdr_alpha)
+
+    return Significance
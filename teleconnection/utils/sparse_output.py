@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse (thresholded) output of the tiled correlation reductions.
+
+Only the pairs of locations whose correlation is below a threshold (i.e.:
+the actual teleconnections) are kept, tile by tile, so that the output
+memory scales with the number of teleconnections instead of N**2.
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+class Sparse_threshold_collector(object):
+
+    def __init__(self, n_locations, threshold=-0.5, dtype=np.float32):
+
+        '''
+        Class description:
+        ------------------
+
+            Tile callback (see utils.tiled_min_correlation) that keeps the
+            location pairs whose correlation is lower or equal to
+            "threshold", as COO triplets (row, column, correlation).
+
+            The tiles of the upper triangle are mirrored, so that the
+            resulting matrix is symmetric. The self-pairs are never kept.
+
+
+        Attributes:
+
+            n_locations (int):
+            ------------------
+
+                the number of locations (rows and columns of the matrix)
+
+
+            threshold (float = -0.5):
+            --------------------------
+
+                the maximum correlation of a kept pair
+
+
+            dtype (numpy dtype = float32):
+            -------------------------------
+
+                the dtype of the kept correlations
+
+        '''
+
+        self.n_locations = n_locations
+
+        self.threshold = threshold
+
+        self.dtype = dtype
+
+        index_dtype = np.int32 if n_locations < np.iinfo(np.int32).max else np.int64
+
+        self.index_dtype = index_dtype
+
+        self._rows = []
+
+        self._columns = []
+
+        self._values = []
+
+    def __call__(self, rows, columns, tile):
+
+        tile_rows, tile_columns = np.nonzero(tile <= self.threshold)
+
+        values = tile[tile_rows, tile_columns].astype(self.dtype)
+
+        tile_rows = (tile_rows + rows.start).astype(self.index_dtype)
+
+        tile_columns = (tile_columns + columns.start).astype(self.index_dtype)
+
+        not_self = tile_rows != tile_columns
+
+        tile_rows, tile_columns, values = tile_rows[not_self], tile_columns[not_self], values[not_self]
+
+        self._rows.append(tile_rows)
+
+        self._columns.append(tile_columns)
+
+        self._values.append(values)
+
+        if rows != columns:
+
+            self._rows.append(tile_columns)
+
+            self._columns.append(tile_rows)
+
+            self._values.append(values)
+
+    @ property
+    def nnz(self):
+
+        return int(sum(values.size for values in self._values))
+
+    def to_coo(self):
+
+        '''
+        Returns the kept pairs as a scipy.sparse COO matrix (N x N).
+        '''
+
+        if self._values:
+
+            rows = np.concatenate(self._rows)
+
+            columns = np.concatenate(self._columns)
+
+            values = np.concatenate(self._values)
+
+        else:
+
+            rows = columns = np.zeros(0, dtype=self.index_dtype)
+
+            values = np.zeros(0, dtype=self.dtype)
+
+        return sparse.coo_matrix((values, (rows, columns)),
+                                 shape=(self.n_locations, self.n_locations))
+
+    def to_csr(self):
+
+        '''
+        Returns the kept pairs as a scipy.sparse CSR matrix (N x N), whose
+        row i holds the teleconnections of location i.
+        '''
+
+        return self.to_coo().tocsr()
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+One-pass (streaming) sufficient statistics of the correlation matrix.
+
+The (time x locations) data is read one time chunk at a time. Only the
+count, the mean of each location and the (locations x locations) co-moment
+matrix (the sum of the products of the anomalies) are kept, so that the
+memory does not depend on the length of the record. The correlations are
+finished at the end, tile by tile.
+
+The statistics can be persisted in a directory:
+
+    comoment.npy: the (N x N) co-moment matrix (memory-mapped .npy)
+
+    state.npz: the count, the means, the tile size, the coordinates of the
+               locations and the last time step already accumulated
+
+    update.pending: present while the co-moments hold an update that is not
+                    flushed yet (see flush and open)
+
+so that new time steps are later merged into them (see update), instead of
+reprocessing the whole record.
+
+Each chunk is merged into the running statistics with the pairwise update
+of Chan et al. (1979), which is numerically stable, unlike the raw sums and
+sums of squares (whose difference cancels out for long records).
+"""
+
+import os
+
+import numpy as np
+
+from .tiled_correlation import (DEFAULT_TILE_MEMORY_BUDGET, get_tile_size, iter_tiles,
+                                _update_running_min, _apply_pair_mask)
+
+
+# the units of the (numeric) time_stop of the cftime (object) time axes
+TIME_STOP_UNITS = 'microseconds since 1970-01-01'
+
+
+def _encode_time_stop(time_stop):
+
+    # the state is read without pickle: the datetime64, numeric and string
+    # time steps are stored as they are, and the cftime dates as a numeric
+    # offset (TIME_STOP_UNITS) in their calendar
+
+    calendar = getattr(time_stop, 'calendar', None)
+
+    if calendar is not None:
+
+        import cftime
+
+        return {'__time_stop__':np.asarray(cftime.date2num(time_stop, TIME_STOP_UNITS, calendar=calendar)),
+                '__time_stop_calendar__':np.asarray(calendar)}
+
+    encoded = np.asarray(time_stop)
+
+    if encoded.dtype == object:
+        raise ValueError("the time steps of type {0} cannot be persisted".format(type(time_stop).__name__))
+
+    return {'__time_stop__':encoded}
+
+
+def _decode_time_stop(state):
+
+    if '__time_stop__' not in state.files:
+        return None
+
+    time_stop = state['__time_stop__'][()]
+
+    if '__time_stop_calendar__' in state.files:
+
+        import cftime
+
+        return cftime.num2date(time_stop, TIME_STOP_UNITS, calendar=str(state['__time_stop_calendar__']))
+
+    return time_stop
+
+
+class Streaming_correlation_statistics(object):
+
+    COMOMENT_FILE = 'comoment.npy'
+
+    STATE_FILE = 'state.npz'
+
+    PENDING_FILE = 'update.pending'
+
+    def __init__(self, n_locations, path=None,
+                 tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                 coords=None, dims=None):
+
+        '''
+        Class description:
+        ------------------
+
+            Running statistics (count, means and co-moments) of "n_locations"
+            series, updated one time chunk at a time (see update).
+
+            The co-moment matrix is held (and updated) in square tiles of the
+            upper triangle; the tiles below the diagonal are never used.
+
+
+        Attributes:
+
+            n_locations (int):
+            ------------------
+
+                the number of locations (columns of each chunk)
+
+
+            path (str = None):
+            ------------------
+
+                if given, the (N x N) co-moment matrix is a memory-mapped
+                file in this directory, instead of an in-memory array
+
+
+            tile_memory_budget (int):
+            -------------------------
+
+                maximum number of bytes of a single co-moment tile
+
+
+            coords (dict = None) and dims (list of str = None):
+            ----------------------------------------------------
+
+                the coordinates of the location dimensions (in the order of
+                the flattened locations), persisted with the statistics
+
+        '''
+
+        self.n_locations = n_locations
+
+        self.path = path
+
+        self.tile_size = get_tile_size(0, n_locations, tile_memory_budget)
+
+        self.count = 0
+
+        self.mean = np.zeros(n_locations)
+
+        self.dims = [] if dims is None else list(dims)
+
+        self.coords = {} if coords is None else {x:np.asarray(coords[x]) for x in self.dims}
+
+        # the last time step already accumulated (set by the caller)
+        self.time_stop = None
+
+        if path is None:
+
+            self.comoment = np.zeros((n_locations, n_locations))
+
+        else:
+
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+            self.comoment = np.lib.format.open_memmap(os.path.join(path, self.COMOMENT_FILE),
+                                                      mode='w+', dtype=np.float64,
+                                                      shape=(n_locations, n_locations))
+
+    def _iter_upper_tiles(self):
+
+        tiles = list(iter_tiles(self.n_locations, self.tile_size))
+
+        for i, sl_i in enumerate(tiles):
+
+            for sl_j in tiles[i:]:
+
+                yield sl_i, sl_j
+
+    def update(self, chunk):
+
+        '''
+        Function description:
+
+            Merges a (time x locations) chunk into the running statistics.
+
+            With the chunk count n_b, mean m_b and co-moment C_b:
+
+                n = n_a + n_b
+
+                delta = m_b - m_a
+
+                C = C_a + C_b + outer(delta, delta) * n_a * n_b / n
+
+                m = m_a + delta * n_b / n
+
+            Series with any NaN value propagate NaN (their correlations are
+            then NaN, and they never become partners).
+
+            The co-moments of a persisted instance are updated in place, so
+            that the PENDING_FILE marker is written first: until flush,
+            the co-moments may hold time steps that the state does not.
+
+        '''
+
+        chunk = np.asarray(chunk, dtype=np.float64)
+
+        n_b = chunk.shape[0]
+
+        if n_b == 0:
+            return
+
+        n = self.count + n_b
+
+        mean_b = chunk.mean(axis=0)
+
+        anomalies = chunk - mean_b
+
+        delta = mean_b - self.mean
+
+        scale = self.count * n_b / float(n)
+
+        if self.path is not None:
+
+            open(os.path.join(self.path, self.PENDING_FILE), 'w').close()
+
+        for sl_i, sl_j in self._iter_upper_tiles():
+
+            self.comoment[sl_i, sl_j] += (anomalies[:, sl_i].T @ anomalies[:, sl_j]
+                                          + scale * np.outer(delta[sl_i], delta[sl_j]))
+
+        self.mean += delta * n_b / float(n)
+
+        self.count = n
+
+    def accumulate(self, data, time_chunk_size=None):
+
+        '''
+        Function description:
+
+            Streams a (time x locations) array (numpy, dask or memory-mapped)
+            into the running statistics, one time chunk at a time. Only the
+            current chunk is loaded (i.e.: the files of one chunk of an
+            open_mfdataset record).
+
+        ------------------------------------------------------------------
+
+        Parameters:
+
+            data (2D array): the (time x locations) data
+
+            time_chunk_size (int = None): the number of time steps per chunk.
+                                          Default: the time chunks of a dask
+                                          array; otherwise as many time steps
+                                          as fit in a co-moment tile budget.
+
+        '''
+
+        n_time = data.shape[0]
+
+        if time_chunk_size is None and hasattr(data, 'chunks'):
+
+            bounds = np.cumsum((0,) + tuple(data.chunks[0]))
+
+        else:
+
+            if time_chunk_size is None:
+                time_chunk_size = max(1, self.tile_size**2 // max(self.n_locations, 1))
+
+            bounds = list(range(0, n_time, time_chunk_size)) + [n_time]
+
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+
+            self.update(data[start:stop])
+
+        return self
+
+    @ property
+    def variance(self):
+
+        # the diagonal of the co-moment matrix (n times the variance)
+        return np.diagonal(self.comoment).copy()
+
+    def correlation_tile(self, rows, columns, norms=None):
+
+        '''
+        Returns the (rows x columns) correlation tile, finished from the
+        co-moments (NaN for constant series). "rows" must not start after
+        "columns" (upper triangle).
+        '''
+
+        if norms is None:
+            norms = np.sqrt(self.variance)
+
+        denominator = np.outer(norms[rows], norms[columns])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+
+            tile = np.where(denominator > 0, self.comoment[rows, columns] / denominator, np.nan)
+
+        return np.clip(tile, -1, 1)
+
+    def min_correlation(self, tile_callback=None, pair_mask=None):
+
+        '''
+        Function description:
+
+            Finishes the correlations tile by tile, and evaluates the minimum
+            correlation of each location and its partner (as
+            utils.tiled_min_correlation).
+
+        ------------------------------------------------------------------
+
+        Parameters:
+
+            tile_callback (callable = None): function(rows, columns, tile)
+                                             called with each correlation tile
+                                             of the upper triangle
+
+            pair_mask (= None): the allowed pairs of locations (see
+                                utils.tiled_min_correlation)
+
+        ------------------------------------------------------------------
+
+        Returns:
+
+            Teleconnection (1D array), partner_index (1D array of int)
+
+        '''
+
+        norms = np.sqrt(self.variance)
+
+        running_min = np.full(self.n_locations, np.inf)
+
+        running_arg = np.full(self.n_locations, -1, dtype=np.int64)
+
+        for sl_i, sl_j in self._iter_upper_tiles():
+
+            if pair_mask is not None and not pair_mask.any_pair(sl_i, sl_j):
+
+                if tile_callback is not None:
+
+                    tile_callback(sl_i, sl_j, np.full((sl_i.stop - sl_i.start, sl_j.stop - sl_j.start), np.nan))
+
+                continue
+
+            tile = _apply_pair_mask(pair_mask, sl_i, sl_j, self.correlation_tile(sl_i, sl_j, norms=norms))
+
+            if tile_callback is not None:
+
+                tile_callback(sl_i, sl_j, tile)
+
+            _update_running_min(running_min, running_arg, sl_i, tile, sl_j.start)
+
+            if sl_j != sl_i:
+
+                _update_running_min(running_min, running_arg, sl_j, tile.T, sl_i.start)
+
+        Teleconnection = np.where(np.isinf(running_min), np.nan, running_min)
+
+        return Teleconnection, running_arg
+
+    def flush(self):
+
+        '''
+        Writes the co-moments and the state of a persisted instance (see
+        Streaming_correlation_statistics.open).
+        '''
+
+        if self.path is None:
+            raise ValueError("only the statistics created with a path can be flushed")
+
+        self.comoment.flush()
+
+        state = {'count':np.array(self.count),
+                 'mean':self.mean,
+                 'tile_size':np.array(self.tile_size),
+                 '__dims__':np.array(self.dims, dtype=str)}
+
+        state.update(self.coords)
+
+        if self.time_stop is not None:
+            state.update(_encode_time_stop(self.time_stop))
+
+        # the state file is replaced at once (never half-written), and only
+        # then the pending marker of the update is removed: a crash before
+        # this point leaves the marker, and open refuses the statistics
+        temporary = os.path.join(self.path, 'state.tmp.npz')
+
+        np.savez(temporary, **state)
+
+        os.replace(temporary, os.path.join(self.path, self.STATE_FILE))
+
+        pending = os.path.join(self.path, self.PENDING_FILE)
+
+        if os.path.exists(pending):
+            os.remove(pending)
+
+    @ classmethod
+    def open(cls, path, mode='r+'):
+
+        '''
+        Opens the statistics persisted in "path" (see flush), i.e.: to merge
+        new time steps into them.
+
+        Raises a ValueError if an update was interrupted before its flush:
+        the co-moments may then hold time steps that the count and the
+        means do not, and merging them again would count them twice.
+        '''
+
+        if os.path.exists(os.path.join(path, cls.PENDING_FILE)):
+
+            raise ValueError("an update of the statistics in {0} was interrupted before it was flushed: "
+                             "they are inconsistent, and must be computed again".format(path))
+
+        statistics = cls.__new__(cls)
+
+        statistics.path = path
+
+        statistics.comoment = np.load(os.path.join(path, cls.COMOMENT_FILE), mmap_mode=mode)
+
+        statistics.n_locations = statistics.comoment.shape[0]
+
+        with np.load(os.path.join(path, cls.STATE_FILE), allow_pickle=False) as state:
+
+            statistics.count = int(state['count'])
+
+            statistics.mean = np.array(state['mean'])
+
+            statistics.tile_size = int(state['tile_size'])
+
+            statistics.dims = [str(x) for x in state['__dims__']]
+
+            statistics.coords = {x:state[x] for x in statistics.dims}
+
+            statistics.time_stop = _decode_time_stop(state)
+
+        return statistics
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic space-time fields with planted teleconnections (dipoles).
+
+Every grid cell holds white noise, except the cells of the planted dipoles:
+the two cells of a dipole share a common signal with opposite signs, so
+that each one is the most negatively correlated partner of the other. The
+expected answer is therefore known, without any download (i.e.:
+xr.tutorial) nor reference run.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import shapely
+
+
+def planted_dipole_dataset(n_lat=32, n_lon=64, n_time=120, n_dipoles=4, noise=0.3,
+                           dtype=np.float64, chunks=None, seed=0, variable='air', dim='time'):
+
+    '''
+    Function description:
+
+        Builds a (time x lat x lon) dataset of white noise with
+        "n_dipoles" planted dipoles.
+
+        The correlation of a dipole is about -1 / (1 + noise**2) (-0.92 for
+        the default noise), far below the minimum correlation of the noise
+        cells (about -sqrt(2 * log(N) / n_time)).
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        n_lat, n_lon, n_time (int): the shape of the field. The coordinates
+                                    are the centres of a regular global grid
+                                    (ascending, longitudes in [-180, 180)).
+
+        n_dipoles (int = 4): the number of planted dipoles
+
+        noise (float = 0.3): the amplitude of the independent noise added to
+                             each cell of a dipole
+
+        dtype (numpy dtype = float64): the precision of the variable
+
+        chunks (dict = None): if given, the dataset is chunked (dask)
+
+        seed (int = 0): the seed of the random field
+
+        variable (str = 'air'), dim (str = 'time'): the names of the variable
+                                                    and of its time dimension
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        ds (xarray-Dataset)
+
+        Dipoles (pandas DataFrame): one row per dipole, with the coordinates
+                                    of both cells ('lat_a', 'lon_a', 'lat_b',
+                                    'lon_b')
+
+    '''
+
+    random = np.random.default_rng(seed)
+
+    data = random.standard_normal((n_time, n_lat * n_lon))
+
+    cells = random.choice(n_lat * n_lon, size=(n_dipoles, 2), replace=False)
+
+    for a, b in cells:
+
+        signal = random.standard_normal(n_time)
+
+        data[:, a] = signal + noise * random.standard_normal(n_time)
+
+        data[:, b] = - signal + noise * random.standard_normal(n_time)
+
+    lat = -90 + (np.arange(n_lat) + 0.5) * 180.0 / n_lat
+
+    lon = -180 + (np.arange(n_lon) + 0.5) * 360.0 / n_lon
+
+    ds = xr.Dataset({variable:((dim, 'lat', 'lon'), data.reshape(n_time, n_lat, n_lon).astype(dtype))},
+                    coords={dim:pd.date_range('2000-01-01', periods=n_time, freq='D'),
+                            'lat':lat,
+                            'lon':lon})
+
+    if chunks:
+        ds = ds.chunk(chunks)
+
+    lat_index, lon_index = np.unravel_index(cells, (n_lat, n_lon))
+
+    Dipoles = pd.DataFrame({'lat_a':lat[lat_index[:, 0]], 'lon_a':lon[lon_index[:, 0]],
+                            'lat_b':lat[lat_index[:, 1]], 'lon_b':lon[lon_index[:, 1]]})
+
+    return ds, Dipoles
+
+
+def planted_partner_recall(Teleconnection_paths, Dipoles):
+
+    '''
+    Function description:
+
+        The fraction of the planted dipole cells whose teleconnection path
+        (a (origin, partner) LineString, as returned by both entry points)
+        ends at the other cell of their dipole.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        Teleconnection_paths (geopandas GeoDataFrame): the line paths
+
+        Dipoles (pandas DataFrame): see planted_dipole_dataset
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        float between 0 and 1
+
+    '''
+
+    coordinates = shapely.get_coordinates(np.asarray(Teleconnection_paths.geometry)).reshape(-1, 2, 2)
+
+    partners = {tuple(np.round(origin, 9)):tuple(np.round(partner, 9)) for origin, partner in coordinates}
+
+    found = []
+
+    for row in Dipoles.itertuples():
+
+        cell_a = tuple(np.round((row.lon_a, row.lat_a), 9))
+
+        cell_b = tuple(np.round((row.lon_b, row.lat_b), 9))
+
+        found.append(partners.get(cell_a) == cell_b)
+
+        found.append(partners.get(cell_b) == cell_a)
+
+    return float(np.mean(found)) if found else np.nan
@@ -0,0 +1,758 @@
+# -*- coding: utf-8 -*-
+"""
+Blocked (tiled) correlation reductions.
+
+The functions of this module walk the (locations x locations) correlation
+matrix tile by tile, so that only a single tile is held in memory at a time.
+
+Only O(N) results (i.e.: the minimum correlation of each location and the
+index of its respective partner) are kept between tiles.
+"""
+
+import numpy as np
+
+
+DEFAULT_TILE_MEMORY_BUDGET = 256 * 2**20 # bytes
+
+
+def get_tile_size(n_time, n_locations, tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET, itemsize=8):
+
+    '''
+    Function description:
+
+        Evaluates the number of locations per tile so that a correlation tile
+        (tile_size x tile_size) plus its two data blocks (n_time x tile_size)
+        fit inside the given memory budget.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        n_time (int): the size of the correlation dimension (i.e.: time)
+
+        n_locations (int): the total number of locations in space
+
+        tile_memory_budget (int): maximum number of bytes for a single tile
+
+        itemsize (int): the number of bytes of each value (8 for float64)
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        tile_size (int): number of locations per tile (at least 1)
+
+    '''
+
+    n_values = tile_memory_budget / float(itemsize)
+
+    # solving: tile_size**2 + 2 * n_time * tile_size <= n_values
+    tile_size = int(np.floor(-n_time + np.sqrt(n_time**2 + n_values)))
+
+    return int(np.clip(tile_size, 1, max(n_locations, 1)))
+
+
+def iter_tiles(n_locations, tile_size):
+
+    '''
+    Function description:
+
+        Yields consecutive slices of at most "tile_size" locations.
+
+    '''
+
+    for start in range(0, n_locations, tile_size):
+
+        yield slice(start, min(start + tile_size, n_locations))
+
+
+def _load_block(data, sl):
+
+    # works for numpy, dask and memory-mapped arrays alike.
+    # Floating arrays keep their precision (i.e.: float32)
+
+    block = np.asarray(data[:, sl])
+
+    if not np.issubdtype(block.dtype, np.floating):
+
+        block = block.astype(np.float64)
+
+    return block
+
+
+def standardize_series(data, dtype=np.float64):
+
+    '''
+    Function description:
+
+        Standardizes each location series (column) of "data" once:
+        zero mean and unit norm. The Pearson correlation between any two
+        locations is then the dot product of their standardized series, so
+        that a correlation tile is a plain (BLAS) matrix product
+        (see standardized_pearson_tile).
+
+        Dask arrays are standardized lazily: the statistics of a column are
+        only evaluated when a block containing it is loaded.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        data (2D array): (time x locations) numpy or dask array
+
+        dtype (numpy dtype = float64): the precision of the standardized
+                                       series. float32 halves the memory and
+                                       roughly doubles the BLAS throughput.
+                                       The correlations then differ from the
+                                       float64 ones by up to ~1e-6 (measured
+                                       maximum absolute error: 8e-7 for
+                                       T=120, 1.2e-6 for T=480 and 2e-6 for
+                                       T=2000), so near-tied partners may be
+                                       selected differently.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        2D array with the same type (numpy or dask) and shape as "data".
+        Constant series, or series with NaN values, are all-NaN.
+
+    '''
+
+    if not hasattr(data, 'compute'):
+
+        data = np.asarray(data)
+
+    data = data.astype(dtype)
+
+    anomalies = data - data.mean(axis=0)
+
+    norm = np.sqrt((anomalies**2).sum(axis=0))
+
+    norm = np.where(norm > 0, norm, np.nan).astype(dtype)
+
+    return anomalies / norm
+
+
+def standardized_pearson_tile(z_i, z_j):
+
+    '''
+    Function description:
+
+        Pearson correlation tile of two blocks of standardized series
+        (see standardize_series): z_i.T @ z_j.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        2D array (locations_i x locations_j) with values between (-1, 1).
+
+    '''
+
+    return np.clip(z_i.T @ z_j, -1, 1)
+
+
+def pearson_tile(block_i, block_j):
+
+    '''
+    Function description:
+
+        Pearson correlation between each column of block_i and each column
+        of block_j.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        block_i (2D array): (time x locations_i)
+
+        block_j (2D array): (time x locations_j)
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        2D array (locations_i x locations_j) with values between (-1, 1).
+
+    '''
+
+    n_i = block_i.shape[1]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+
+        tile = np.corrcoef(block_i, block_j, rowvar=False)
+
+    return tile[:n_i, n_i:]
+
+
+def _update_running_min(running_min, running_arg, rows, tile, column_offset):
+
+    # NaN correlations (i.e.: constant or masked series) never become partners
+
+    tile = np.where(np.isnan(tile), np.inf, tile)
+
+    local_arg = np.argmin(tile, axis=1)
+
+    local_min = tile[np.arange(tile.shape[0]), local_arg]
+
+    # strict comparison: keeps the first occurrence in case of ties,
+    # as pandas' idxmin does
+    better = local_min < running_min[rows]
+
+    running_min[rows] = np.where(better, local_min, running_min[rows])
+
+    running_arg[rows] = np.where(better, local_arg + column_offset, running_arg[rows])
+
+    return better
+
+
+def _apply_pair_mask(pair_mask, rows, columns, tile):
+
+    # the correlations of the pairs that are not allowed are masked (NaN),
+    # so that they never become partners
+
+    if pair_mask is None:
+        return tile
+
+    return np.where(pair_mask(rows, columns), tile, np.nan)
+
+
+def _fit_tile(correlation_tile, n_time, n_rows, n_locations, tile_memory_budget, itemsize,
+              block_time=None):
+
+    # the number of columns per tile (and the tile function) so that a
+    # (rows x columns) tile plus its (block_time x columns) data block fit
+    # inside the budget. The tile functions that need more working memory
+    # per column (i.e.: kendall_tau_b_tile) size themselves, through their
+    # "fit_tile" attribute
+
+    block_time = n_time if block_time is None else block_time
+
+    fit_tile = getattr(correlation_tile, 'fit_tile', None)
+
+    if fit_tile is not None:
+        return fit_tile(n_time, n_rows, n_locations, tile_memory_budget, block_time)
+
+    n_values = tile_memory_budget / float(itemsize)
+
+    tile_size = int(np.clip(n_values // (n_rows + block_time), 1, max(n_locations, 1)))
+
+    return tile_size, correlation_tile
+
+
+def row_block_min_correlation(data, rows,
+                              tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                              correlation_tile=pearson_tile,
+                              pair_mask=None):
+
+    '''
+    Function description:
+
+        Evaluates the minimum correlation (and respective partner) of a block
+        of reference locations ("rows") against every location of "data".
+
+        The columns are walked in tiles, so that only a
+        (rows x tile) correlation tile is held in memory at a time.
+
+        Contrary to tiled_min_correlation, each row block is independent
+        from the others, so that row blocks can be evaluated in any order
+        (i.e.: in parallel).
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        data (2D array): (time x locations) array
+
+        rows (slice): the reference locations of the block
+
+        tile_memory_budget (int): maximum number of bytes for a single tile
+
+        correlation_tile (callable): see tiled_min_correlation
+
+        pair_mask (= None): the allowed pairs of locations (see
+                            utils.Region_pair_mask). The tiles without any
+                            allowed pair are skipped before any correlation
+                            is evaluated.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        Teleconnection (1D array): minimum correlation of each row
+                                   (NaN if the row has no valid partner)
+
+        partner_index (1D array of int): index of the most negatively
+                                         correlated location (-1 if none)
+
+    '''
+
+    n_time, n_locations = data.shape
+
+    block_i = _load_block(data, rows)
+
+    n_rows = block_i.shape[1]
+
+    tile_size, correlation_tile = _fit_tile(correlation_tile, n_time, n_rows, n_locations,
+                                            tile_memory_budget, block_i.dtype.itemsize)
+
+    running_min = np.full(n_rows, np.inf)
+
+    running_arg = np.full(n_rows, -1, dtype=np.int64)
+
+    for sl_j in iter_tiles(n_locations, tile_size):
+
+        if pair_mask is not None and not pair_mask.any_pair(rows, sl_j):
+            continue
+
+        tile = correlation_tile(block_i, _load_block(data, sl_j))
+
+        tile = _apply_pair_mask(pair_mask, rows, sl_j, tile)
+
+        _update_running_min(running_min, running_arg, slice(None), tile, sl_j.start)
+
+    Teleconnection = np.where(np.isinf(running_min), np.nan, running_min)
+
+    return Teleconnection, running_arg
+
+
+def tiled_min_correlation(data,
+                          tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                          correlation_tile=pearson_tile,
+                          tile_callback=None,
+                          pair_mask=None):
+
+    '''
+    Function description:
+
+        Evaluates, for each location, the minimum correlation against every
+        other location and the index of that partner location,
+        without ever materializing the (N x N) correlation matrix.
+
+        Since the correlation matrix is symmetric, only the upper triangle of
+        tiles is evaluated; each tile updates both its rows and its columns.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        data (2D array): (time x locations) array. It can be a numpy array,
+                         a dask array or a memory-mapped array.
+
+        tile_memory_budget (int): maximum number of bytes for a single tile.
+                                  It bounds the peak memory of the reduction.
+
+        correlation_tile (callable): function(block_i, block_j) that returns
+                                     the (locations_i x locations_j)
+                                     correlation tile. Default: pearson_tile.
+
+        tile_callback (callable = None): function(rows, columns, tile) called
+                                         with each evaluated tile of the upper
+                                         triangle (i.e.: to persist it, see
+                                         Correlation_store.write_tile).
+                                         The skipped tiles (see pair_mask)
+                                         are passed as all-NaN tiles.
+
+        pair_mask (= None): the allowed pairs of locations (see
+                            utils.Region_pair_mask). The tiles without any
+                            allowed pair are skipped before any correlation
+                            is evaluated.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        Teleconnection (1D array): minimum correlation of each location
+                                   (NaN if the location has no valid partner)
+
+        partner_index (1D array of int): index of the most negatively
+                                         correlated location (-1 if none)
+
+    '''
+
+    n_time, n_locations = data.shape
+
+    tile_size = get_tile_size(n_time, n_locations, tile_memory_budget, itemsize=data.dtype.itemsize)
+
+    running_min = np.full(n_locations, np.inf)
+
+    running_arg = np.full(n_locations, -1, dtype=np.int64)
+
+    tiles = list(iter_tiles(n_locations, tile_size))
+
+    for i, sl_i in enumerate(tiles):
+
+        block_i = _load_block(data, sl_i)
+
+        for sl_j in tiles[i:]:
+
+            if pair_mask is not None and not pair_mask.any_pair(sl_i, sl_j):
+
+                if tile_callback is not None:
+
+                    tile_callback(sl_i, sl_j, np.full((sl_i.stop - sl_i.start, sl_j.stop - sl_j.start), np.nan))
+
+                continue
+
+            block_j = block_i if sl_j == sl_i else _load_block(data, sl_j)
+
+            tile = _apply_pair_mask(pair_mask, sl_i, sl_j, correlation_tile(block_i, block_j))
+
+            if tile_callback is not None:
+
+                tile_callback(sl_i, sl_j, tile)
+
+            _update_running_min(running_min, running_arg, sl_i, tile, sl_j.start)
+
+            if sl_j != sl_i:
+
+                _update_running_min(running_min, running_arg, sl_j, tile.T, sl_i.start)
+
+    Teleconnection = np.where(np.isinf(running_min), np.nan, running_min)
+
+    return Teleconnection, running_arg
+
+
+def _update_running_topk(running_values, running_index, tile, column_offset, k):
+
+    # keeps, for each row, the k smallest values among the running ones and
+    # the ones of the new tile
+
+    tile = np.where(np.isnan(tile), np.inf, tile)
+
+    tile_index = np.broadcast_to(np.arange(column_offset, column_offset + tile.shape[1]), tile.shape)
+
+    candidates = np.concatenate([running_values, tile], axis=1)
+
+    candidates_index = np.concatenate([running_index, tile_index], axis=1)
+
+    selected = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+
+    return (np.take_along_axis(candidates, selected, axis=1),
+            np.take_along_axis(candidates_index, selected, axis=1))
+
+
+def row_block_topk_correlation(data, rows, k,
+                               largest=False,
+                               tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                               correlation_tile=pearson_tile):
+
+    '''
+    Function description:
+
+        Evaluates the k most negative (or the k most positive) correlations
+        of a block of reference locations ("rows") against every location
+        of "data", and the respective partners.
+
+        The columns are walked in tiles; only the (rows x k) running
+        selection is kept between tiles. The self-correlation of each
+        reference location is never selected.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        data (2D array): (time x locations) array
+
+        rows (slice): the reference locations of the block
+
+        k (int): the number of partners per location
+
+        largest (bool = False): if True, selects the k most positive
+                                correlations instead of the k most negative
+
+        tile_memory_budget (int): maximum number of bytes for a single tile
+
+        correlation_tile (callable): see tiled_min_correlation
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        correlation (2D array): (rows x k) correlations, sorted from the
+                                strongest to the weakest. NaN where there
+                                are less than k valid partners.
+
+        partner_index (2D array of int): (rows x k) partner indexes
+                                         (-1 where there is no partner)
+
+    '''
+
+    n_time, n_locations = data.shape
+
+    block_i = _load_block(data, rows)
+
+    n_rows = block_i.shape[1]
+
+    row_index = np.arange(n_locations)[rows]
+
+    tile_size, correlation_tile = _fit_tile(correlation_tile, n_time, n_rows, n_locations,
+                                            tile_memory_budget, block_i.dtype.itemsize)
+
+    sign = -1. if largest else 1.
+
+    running_values = np.full((n_rows, k), np.inf)
+
+    running_index = np.full((n_rows, k), -1, dtype=np.int64)
+
+    for sl_j in iter_tiles(n_locations, tile_size):
+
+        tile = sign * correlation_tile(block_i, _load_block(data, sl_j))
+
+        # excluding the self-correlations
+        column_index = np.arange(n_locations)[sl_j]
+
+        tile[row_index[:, None] == column_index[None, :]] = np.nan
+
+        running_values, running_index = _update_running_topk(running_values, running_index,
+                                                             tile, sl_j.start, k)
+
+    # sorting from the strongest to the weakest correlation
+    # (ties are ordered by partner index)
+    order = np.argsort(running_index, axis=1, kind='stable')
+
+    running_values = np.take_along_axis(running_values, order, axis=1)
+
+    running_index = np.take_along_axis(running_index, order, axis=1)
+
+    order = np.argsort(running_values, axis=1, kind='stable')
+
+    running_values = np.take_along_axis(running_values, order, axis=1)
+
+    running_index = np.take_along_axis(running_index, order, axis=1)
+
+    no_partner = np.isinf(running_values)
+
+    correlation = np.where(no_partner, np.nan, sign * running_values)
+
+    partner_index = np.where(no_partner, -1, running_index)
+
+    return correlation, partner_index
+
+
+def tiled_topk_correlation(data, k,
+                           largest=False,
+                           tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                           correlation_tile=pearson_tile):
+
+    '''
+    Function description:
+
+        Evaluates, for each location, its k most negative (or most positive)
+        correlations and the respective partners, in O(N * k) memory.
+
+        See row_block_topk_correlation.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        correlation (2D array): (locations x k)
+
+        partner_index (2D array of int): (locations x k)
+
+    '''
+
+    n_time, n_locations = data.shape
+
+    tile_size = get_tile_size(n_time, n_locations, tile_memory_budget, itemsize=data.dtype.itemsize)
+
+    correlation = np.full((n_locations, k), np.nan)
+
+    partner_index = np.full((n_locations, k), -1, dtype=np.int64)
+
+    for rows in iter_tiles(n_locations, tile_size):
+
+        correlation[rows], partner_index[rows] = row_block_topk_correlation(data, rows, k,
+                                                                            largest=largest,
+                                                                            tile_memory_budget=tile_memory_budget,
+                                                                            correlation_tile=correlation_tile)
+
+    return correlation, partner_index
+
+
+def chain_tile_callbacks(*callbacks):
+
+    '''
+    Function description:
+
+        Combines several tile callbacks (see tiled_min_correlation) into a
+        single one. None callbacks are ignored; returns None if there is
+        no callback left.
+
+    '''
+
+    callbacks = [callback for callback in callbacks if callback is not None]
+
+    if not callbacks:
+        return None
+
+    def tile_callback(rows, columns, tile):
+
+        for callback in callbacks:
+
+            callback(rows, columns, tile)
+
+    return tile_callback
+
+
+def lag_segments(n_time, lag):
+
+    '''
+    Function description:
+
+        Time slices of the reference series (x) and of the partner series (y)
+        so that x[t] is paired with y[t + lag] (a positive lag means that the
+        partner lags behind the reference location).
+
+    '''
+
+    return (slice(max(0, -lag), n_time - max(0, lag)),
+            slice(max(0, lag), n_time - max(0, -lag)))
+
+
+def row_block_lagged_min_correlation(data, rows, lags,
+                                     tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                                     correlation_tile=standardized_pearson_tile,
+                                     prepare_segment=standardize_series,
+                                     pair_mask=None):
+
+    '''
+    Function description:
+
+        Lagged version of row_block_min_correlation: evaluates, for each
+        reference location, the minimum correlation over every partner and
+        every lag, with the respective partner and lag.
+
+        For each lag, the overlapping segments of the reference block are
+        prepared once (i.e.: standardized), and each correlation tile is a
+        single blocked product, so that no shifted copy of the dataset
+        is ever built. The self-pairs are excluded at every lag.
+
+    ------------------------------------------------------------------
+
+    Parameters:
+
+        data (2D array): (time x locations) array
+
+        rows (slice): the reference locations of the block
+
+        lags (iterable of int): the lags (in steps of the time dimension)
+
+        tile_memory_budget (int): maximum number of bytes for a single tile
+
+        correlation_tile (callable): see tiled_min_correlation
+
+        prepare_segment (callable): function(segment) that prepares a
+                                    (time x locations) segment for the
+                                    correlation_tile (default:
+                                    standardize_series, for the
+                                    standardized_pearson_tile)
+
+        pair_mask (= None): the allowed pairs of locations (see
+                            utils.Region_pair_mask). The tiles without any
+                            allowed pair are skipped before any correlation
+                            is evaluated.
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        Teleconnection (1D array): minimum correlation of each row
+
+        partner_index (1D array of int): the respective partner (-1 if none)
+
+        best_lag (1D array of int): the respective lag
+
+    '''
+
+    lags = [int(lag) for lag in lags]
+
+    n_time, n_locations = data.shape
+
+    block_i = _load_block(data, rows)
+
+    n_rows = block_i.shape[1]
+
+    row_index = np.arange(n_locations)[rows]
+
+    tile_size, correlation_tile = _fit_tile(correlation_tile, n_time, n_rows, n_locations,
+                                            tile_memory_budget, block_i.dtype.itemsize,
+                                            block_time=n_time * len(lags))
+
+    segments_i = {lag:prepare_segment(block_i[lag_segments(n_time, lag)[0]]) for lag in lags}
+
+    running_min = np.full(n_rows, np.inf)
+
+    running_arg = np.full(n_rows, -1, dtype=np.int64)
+
+    running_lag = np.zeros(n_rows, dtype=np.int64)
+
+    for sl_j in iter_tiles(n_locations, tile_size):
+
+        if pair_mask is not None and not pair_mask.any_pair(rows, sl_j):
+            continue
+
+        block_j = _load_block(data, sl_j)
+
+        # the self-pairs (and the pairs that are not allowed) are excluded
+        excluded = row_index[:, None] == np.arange(n_locations)[sl_j][None, :]
+
+        if pair_mask is not None:
+            excluded |= ~pair_mask(rows, sl_j)
+
+        for lag in lags:
+
+            tile = correlation_tile(segments_i[lag], prepare_segment(block_j[lag_segments(n_time, lag)[1]]))
+
+            tile = np.where(excluded, np.nan, tile)
+
+            better = _update_running_min(running_min, running_arg, slice(None), tile, sl_j.start)
+
+            running_lag[better] = lag
+
+    Teleconnection = np.where(np.isinf(running_min), np.nan, running_min)
+
+    return Teleconnection, running_arg, running_lag
+
+
+def tiled_lagged_min_correlation(data, lags,
+                                 tile_memory_budget=DEFAULT_TILE_MEMORY_BUDGET,
+                                 correlation_tile=standardized_pearson_tile,
+                                 prepare_segment=standardize_series,
+                                 pair_mask=None):
+
+    '''
+    Function description:
+
+        Evaluates, for each location, its most negatively correlated partner
+        over all the given lags (see row_block_lagged_min_correlation).
+
+    ------------------------------------------------------------------
+
+    Returns:
+
+        Teleconnection, partner_index, best_lag (1D arrays)
+
+    '''
+
+    n_time, n_locations = data.shape
+
+    tile_size = get_tile_size(n_time, n_locations, tile_memory_budget, itemsize=data.dtype.itemsize)
+
+    Teleconnection = np.full(n_locations, np.nan)
+
+    partner_index = np.full(n_locations, -1, dtype=np.int64)
+
+    best_lag = np.zeros(n_locations, dtype=np.int64)
+
+    for rows in iter_tiles(n_locations, tile_size):
+
+        Teleconnection[rows], partner_index[rows], best_lag[rows] = row_block_lagged_min_correlation(data, rows, lags,
+                                                                                                     tile_memory_budget=tile_memory_budget,
+                                                                                                     correlation_tile=correlation_tile,
+                                                                                                     prepare_segment=prepare_segment,
+                                                                                                     pair_mask=pair_mask)
+
+    return Teleconnection, partner_index, best_lag
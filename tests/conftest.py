@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+The modules of the package import each other as top-level modules (i.e.:
+"from utils import ..."), so that their directory is added to the path.
+"""
+
+import os
+import sys
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'teleconnection'))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the pixel datasets (dsx) returned by get_correlation_for_each_pixel.
+"""
+
+import pytest
+import xarray as xr
+
+from utils import planted_dipole_dataset
+from teleconnection_with_connecting_pathways import get_correlation_for_each_pixel
+
+
+@pytest.fixture
+def two_variable_dataset():
+
+    ds, Dipoles = planted_dipole_dataset(n_lat=4, n_lon=6, n_time=30, n_dipoles=2, seed=1)
+
+    ds['other'] = ds['air'] * 2 + 1
+
+    ds.coords['height'] = 2.0
+
+    return ds
+
+
+@pytest.mark.parametrize('engine, mode', [('vectorized', 'per_pixel'), ('vectorized', 'all_pairs')])
+def test_pixel_datasets_are_the_same_across_engines(two_variable_dataset, engine, mode):
+
+    reference = get_correlation_for_each_pixel(two_variable_dataset, variable='air', dim='time',
+                                               engine='scipy', mode='per_pixel',
+                                               verbose=False)[0]
+
+    dsx = get_correlation_for_each_pixel(two_variable_dataset, variable='air', dim='time',
+                                         engine=engine, mode=mode,
+                                         verbose=False)[0]
+
+    assert len(dsx) == len(reference)
+
+    for x, x_reference in zip(dsx, reference):
+
+        assert set(x.data_vars) == {'air', 'other'}
+
+        assert set(x.coords) == set(x_reference.coords)
+
+        xr.testing.assert_allclose(x, x_reference)
+